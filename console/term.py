@@ -2,69 +2,31 @@
 # -*- coding: UTF-8 -*-
 
 import argparse
+import os
 import re
-import select
-import serial
-import socket
 import sys
 
 from PyQt5.QtWidgets import QApplication, QWidget, QTextEdit, QVBoxLayout, QPushButton, QStatusBar, QMainWindow
 from PyQt5.QtCore import QCoreApplication, Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QTextCursor, QFont
 
+# 和监控程序的 term.py 共用串口、TCP 连接
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'thinpad_top.srcs', 'sim_1', 'runtime', 'supervisor', 'term'))
+from transport import Connection
+
 inp = None
 outp = None
 
-class tcp_wrapper:
-    def __init__(self, sock=None):
-        if sock is None:
-            self.sock = socket.socket(
-                socket.AF_INET, socket.SOCK_STREAM)
-        else:
-            self.sock = sock
-
-    def connect(self, host, port):
-        self.sock.connect((host, port))
-
-    def write(self, msg):
-        totalsent = 0
-        MSGLEN = len(msg)
-        while totalsent < MSGLEN:
-            sent = self.sock.send(msg[totalsent:])
-            if sent == 0:
-                raise RuntimeError("socket connection broken")
-            totalsent = totalsent + sent
-
-    def flush(self): # dummy
-        pass
-
-    def read(self, MSGLEN):
-        chunks = []
-        bytes_recd = 0
-        while bytes_recd < MSGLEN:
-            chunk = self.sock.recv(min(MSGLEN - bytes_recd, 2048))
-            # print 'read:...', list(map(lambda c: hex(ord(c)), chunk))
-            if chunk == b'':
-                raise RuntimeError("socket connection broken")
-            chunks.append(chunk)
-            bytes_recd = bytes_recd + len(chunk)
-        return b''.join(chunks)
-
-    def reset_input_buffer(self):
-        local_input = [self.sock]
-        while True:
-            inputReady, o, e = select.select(local_input, [], [], 0.0)
-            if len(inputReady) == 0:
-                break
-            for s in inputReady:
-                s.recv(1)
-
 def InitializeSerial(pipe_path, baudrate):
     global outp, inp
     sys.stdout.write("connecting to serial %s@%s..." % (pipe_path, baudrate))
     sys.stdout.flush()
-    tty = serial.Serial(port=pipe_path, baudrate=baudrate)
-    tty.reset_input_buffer()
+    try:
+        tty = Connection().open_serial(pipe_path, int(baudrate))
+    except ImportError:
+        print('Please install pyserial')
+        return False
     inp = tty
     outp = tty
     print('connected')
@@ -80,11 +42,14 @@ def InitializeTCP(host_port):
 
     match = ValidIpAddressRegex.search(host_port) or ValidHostnameRegex.search(host_port)
     groups = match.groups()
-    ser = tcp_wrapper()
     host, port = groups[0], groups[4]
     sys.stdout.write("connecting to %s:%s..." % (host, port))
     sys.stdout.flush()
-    ser.connect(host, int(port))
+    try:
+        ser = Connection().open_tcp(host, int(port))
+    except OSError as e:
+        print(e)
+        return False
     print("connected")
 
     global outp, inp
@@ -103,7 +103,7 @@ module cpld_model_term(
     } send_state;
 
     integer recv_length, recv_count;
-    integer send_length;
+    integer send_length, send_count;
     logic inited;
     logic[31:0] recv_word, send_word, recv_addr;
 
@@ -266,7 +266,9 @@ module cpld_model_term(
                 send_length = send_length + 1;
                 if (send_length == 4) begin
                     $display("SEND: Length (A): %d", send_word);
-                    send_state = a_inst;
+                    // 一条 A 命令可以写入多个字
+                    send_count = send_word / 4;
+                    send_state = send_count == 0 ? idle : a_inst;
                     send_word = 0;
                     send_length = 0;
                 end
@@ -276,7 +278,8 @@ module cpld_model_term(
                 send_length = send_length + 1;
                 if (send_length == 4) begin
                     $display("SEND: Inst (A): 0x%08x", send_word);
-                    send_state = idle;
+                    send_count = send_count - 1;
+                    send_state = send_count == 0 ? idle : a_inst;
                     send_word = 0;
                     send_length = 0;
                 end
@@ -310,11 +313,12 @@ module cpld_model_term(
                 send_length = send_length + 1;
                 if (send_length == 4) begin
                     $display("SEND: Num (D): %d", send_word);
+                    // num 为字节数，按字显示
+                    recv_count = send_word / 4;
                     send_state = idle;
                     send_word = 0;
                     send_length = 0;
                     recv_state = r_d_num;
-                    recv_count = send_word;
                     recv_length = 0;
                     recv_word = 0;
                 end
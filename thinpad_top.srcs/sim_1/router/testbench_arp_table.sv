@@ -22,7 +22,12 @@ module testbench_arp_table();
     logic insert_valid;
     logic insert_ready = 1;
     
-    simple_arp_table arp_table_inst(
+    // ARP 表的项数，须和 arp_generate_testcase.py -c 一致，否则被挤掉的项的期望结果不对
+    localparam ARP_ENTRY_COUNT = 8;
+
+    simple_arp_table #(
+        .ENTRY_COUNT(ARP_ENTRY_COUNT)
+    ) arp_table_inst(
         .clk(clk),
         .rst_n(~rst),
 
@@ -158,6 +163,40 @@ module testbench_arp_table();
     end
     endtask 
 
+    // 十六进制测例（arp_generate_testcase.py -x）的最大操作数
+    localparam HEX_RECORDS = 1 << 21;
+    bit[127:0] records[HEX_RECORDS];
+
+    // 测例第一行是注释则为十六进制格式
+    function bit is_hex_test;
+        string line;
+        int file_descriptor;
+    begin
+        file_descriptor = $fopen("arp_test.mem", "r");
+        void'($fgets(line, file_descriptor));
+        $fclose(file_descriptor);
+        is_hex_test = line.len() >= 2 && line.substr(0, 1) == "//";
+    end
+    endfunction
+
+    // 用 $readmemh 一次读入全部操作，每行的布局和 run_test_entry 中的 buffer 相同，[127:124] 为操作类型
+    task run_test_hex;
+        int i;
+        bit[127:0] buffer;
+    begin
+        $readmemh("arp_test.mem", records);
+        for (i = 0; i < HEX_RECORDS && records[i][127:124] != 0; i++) begin
+            buffer = records[i];
+            $display("%0d.", i + 1);
+            if (buffer[127:124] == 1)
+                insert(buffer[31:0], buffer[79:32], buffer[82:80]);
+            else
+                query(buffer[31:0], buffer[79:32], buffer[82:80]);
+        end
+        $display("end");
+    end
+    endtask
+
     initial begin
         clk = 0;
         rst = 1;
@@ -170,7 +209,10 @@ module testbench_arp_table();
         #100
         rst = 0;
 
-        run_test_entry();
+        if (is_hex_test())
+            run_test_hex();
+        else
+            run_test_entry();
     end
     
     always clk = #10 ~clk; // 50MHz
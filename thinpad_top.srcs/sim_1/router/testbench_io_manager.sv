@@ -34,19 +34,68 @@ always #2.5 clk_200M = ~clk_200M;
 always #4 clk_125M = ~clk_125M;
 
 string tx_packet = "";
+bit [7:0] tx_bytes[$];
+// 路由器发出的包和测例中的期望输出，按顺序一一比对
+string outputs[$];
+string expected[$];
+int pass_count = 0;
+int fail_count = 0;
+int discard_count = 0;
+int rip_count = 0;
 always_ff @ (negedge clk_125M) begin
     if (tx_valid) begin
         $sformat(tx_packet, "%s %02x", tx_packet, tx_data);
+        tx_bytes.push_back(tx_data);
         if (tx_last) begin
-            $display("Router OUT:\t%s\n", tx_packet);
+            // rip_packer 发出的 RIP 包（UDP 520）不是对某个输入的回复，不参与比对
+            if (tx_bytes.size() > 41 && tx_bytes[16] == 8'h08 && tx_bytes[17] == 8'h00 &&
+                tx_bytes[27] == 8'h11 && tx_bytes[40] == 8'h02 && tx_bytes[41] == 8'h08) begin
+                $display("Router OUT (RIP):\t%s\n", tx_packet);
+                rip_count++;
+            end else begin
+                $display("Router OUT:\t%s\n", tx_packet);
+                outputs.push_back(tx_packet);
+            end
             tx_packet = "";
+            tx_bytes.delete();
         end
     end
+    // 输出可能先于 expect 行被读到，两边都有时再比对
+    while (outputs.size() > 0 && expected.size() > 0) begin
+        if (outputs[0] == expected[0]) begin
+            pass_count++;
+        end else begin
+            fail_count++;
+            $display("\033[31mMismatch:\033[0m");
+            $display("Expected:\t%s", expected[0]);
+            $display("Got:\t\t%s\n", outputs[0]);
+        end
+        void'(outputs.pop_front());
+        void'(expected.pop_front());
+    end
 end
 
+task report; begin
+    // 多出来的输出意味着有应当丢弃的包被发出了
+    fail_count += outputs.size() + expected.size();
+    $display("io_manager test: %0d passed, %0d failed, %0d discarded, %0d RIP packets sent",
+        pass_count, fail_count, discard_count, rip_count);
+    if (outputs.size() > 0)
+        $display("\033[31m%0d unexpected packets\033[0m", outputs.size());
+    if (expected.size() > 0)
+        $display("\033[31m%0d expected packets not sent\033[0m", expected.size());
+    outputs.delete();
+    expected.delete();
+    pass_count = 0;
+    fail_count = 0;
+    discard_count = 0;
+    rip_count = 0;
+end endtask
+
 string info_line = "";
 string packet_info = "";
 string rx_packet = "";
+string expect_packet = "";
 always_ff @ (negedge clk_125M) begin
     if (fd) case (state)
         READ_LABEL: begin
@@ -65,6 +114,18 @@ always_ff @ (negedge clk_125M) begin
                         rx_packet = "";
                         // $write("Frame IN:\t");
                     end
+                    "expect:": begin
+                        expect_packet = "";
+                        $fscanf(fd, "%x", data);
+                        while (data != 12'hfff) begin
+                            $sformat(expect_packet, "%s %02x", expect_packet, data[7:0]);
+                            $fscanf(fd, "%x", data);
+                        end
+                        expected.push_back(expect_packet);
+                    end
+                    "discard": begin
+                        discard_count++;
+                    end
                 endcase
             end
         end
@@ -97,8 +158,11 @@ always_ff @ (negedge clk_125M) begin
         default:
             state = state + 1;
     endcase
-    else
+    else begin
+        // 等待所有输出完成后汇总，然后重新读取测例
         fd = #1000000 $fopen("io_manager_test.mem", "r");
+        report();
+    end
 end
 
 logic clk_btn;
@@ -142,6 +142,39 @@ begin
 end
 endtask
 
+// 十六进制测例（routing_generate_testcase.py -x）的最大操作数
+localparam HEX_RECORDS = 1 << 21;
+bit[127:0] records[HEX_RECORDS];
+
+// 测例第一行是注释则为十六进制格式
+function bit is_hex_test;
+    string line;
+begin
+    file_descriptor = $fopen("routing_test.mem", "r");
+    void'($fgets(line, file_descriptor));
+    $fclose(file_descriptor);
+    is_hex_test = line.len() >= 2 && line.substr(0, 1) == "//";
+end
+endfunction
+
+// 用 $readmemh 一次读入全部操作，每行的布局和 run_test_entry 中的 buffer 相同，[127:124] 为操作类型
+task run_test_hex;
+    int i;
+begin
+    $readmemh("routing_test.mem", records);
+    for (i = 0; i < HEX_RECORDS && records[i][127:124] != 0; i++) begin
+        #100;
+        count += 1;
+        buffer = records[i];
+        if (buffer[127:124] == 1)
+            insert(buffer[31:0], buffer[71:40], buffer[37:32], buffer[76:72], buffer[79:77]);
+        else
+            query(buffer[31:0], buffer[71:40]);
+    end
+    $display("end");
+end
+endtask
+
 initial begin
     $timeformat(-9, 0, " ns", 12);
     clk_125M = 0;
@@ -152,7 +185,10 @@ initial begin
     #1000
 
     @ (posedge clk_125M);
-    run_test_entry();
+    if (is_hex_test())
+        run_test_hex();
+    else
+        run_test_entry();
 end
 
 always clk_125M = #4 ~clk_125M;
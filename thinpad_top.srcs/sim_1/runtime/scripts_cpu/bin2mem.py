@@ -1,25 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding=utf-8 -*-
+
+# Convert a little-endian binary to a memory initialization file
+#
+# Every word of the input becomes one hex line, most significant byte first.
+# The conversion works on whole blocks: the bytes of every word are swapped at
+# once (array.byteswap for 32 and 64 bits, strided slice copies otherwise,
+# e.g. the 72-bit nodes of routing_table.sv) and bytes.hex puts a newline
+# after every word, so no Python code runs per word. Large inputs are mapped
+# with mmap instead of being read into memory.
+#
+# Formats:
+#   readmemh  one word per line, for $readmemh and MEMORY_INIT_FILE of XPM
+#             (an @address line first if --address is given)
+#   mem       the same, always starting with an @address line as updatemem
+#             expects
+#   coe       memory_initialization_vector of a Xilinx COE file, words before
+#             --address are filled with zeros
+
+import argparse
+import array
+import mmap
+import os
 import sys
 
-fmt = lambda x: '%02x' % x
+FORMATS = ('readmemh', 'mem', 'coe')
+WIDTHS = (32, 64, 72)
+
+# words converted at once, so that the output is written while converting
+BLOCK_WORDS = 1 << 16
+
+# inputs at least this large are mapped instead of read
+MMAP_THRESHOLD = 1 << 20
+
+# array typecode of each word size that has a native type
+TYPECODES = {array.array(code).itemsize: code for code in 'IQ'}
+
+
+def swap_words(data, size):
+    # the bytes of data (a whole number of words of size bytes) with every
+    # word in big-endian order
+    if size in TYPECODES:
+        words = array.array(TYPECODES[size])
+        words.frombytes(data)
+        words.byteswap()
+        return words.tobytes()
+    # otherwise one strided copy per byte position of a word
+    data = memoryview(data).cast('B')
+    swapped = bytearray(len(data))
+    for i in range(size):
+        swapped[i::size] = data[size-1-i::size]
+    return bytes(swapped)
+
+
+def hex_lines(data, size, separator):
+    # one hex word per line, separator after every word but the last
+    return swap_words(data, size).hex('\n', size).replace('\n', separator)
+
+
+def convert(data, width, fmt, address, output):
+    size = width // 8
+    if len(data) % size != 0:
+        # the last word is padded with zeros instead of being dropped
+        data = bytes(data) + bytes(size - len(data) % size)
+    separator = ',\n' if fmt == 'coe' else '\n'
+
+    if fmt == 'coe':
+        output.write('memory_initialization_radix=16;\nmemory_initialization_vector=\n')
+        # zeros read the same in both byte orders
+        zeros = bytes(size) * address
+        data = zeros + bytes(data) if address else data
+    elif fmt == 'mem' or address:
+        output.write('@%x\n' % address)
+
+    view = memoryview(data)
+    block = BLOCK_WORDS * size
+    for offset in range(0, len(view), block):
+        if offset > 0:
+            output.write(separator)
+        output.write(hex_lines(view[offset:offset+block], size, separator))
+    output.write(';\n' if fmt == 'coe' else '\n')
+
+
+def open_input(path, skip):
+    # the input from byte skip on, as a memoryview of a mapping or of bytes
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            # the mapping stays valid after the file is closed
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[skip:]
+        f.seek(skip)
+        return memoryview(f.read())
+
+
+def write_output(path, write):
+    # the output file is replaced only when complete, so make never sees a
+    # half written .mem after an interrupted build
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        write(f)
+    os.replace(temp, path)
+
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Usage python3 bin2mem.py <input> (<output>)')
-        exit()
-    input = sys.argv[1]
-    if len(sys.argv) > 2:
-        output = open(sys.argv[2], 'w')
+    parser = argparse.ArgumentParser(description='Convert a little-endian binary to a memory initialization file.')
+    parser.add_argument('input', help='Binary file, e.g. from objcopy -O binary')
+    parser.add_argument('output', nargs='?', default=None, help='Output file (stdout by default)')
+    parser.add_argument('-w', '--width', default=32, type=int, choices=WIDTHS, help='Bits per word (32 by default)')
+    parser.add_argument('-f', '--format', default='readmemh', choices=FORMATS, help='Output format (readmemh by default)')
+    parser.add_argument('-a', '--address', default='0', help='Word address of the first word, in hex (0 by default)')
+    parser.add_argument('-s', '--skip', default='0', help='Bytes skipped at the start of the input, in hex (0 by default)')
+    args = parser.parse_args()
+
+    try:
+        address = int(args.address, 16)
+        skip = int(args.skip, 16)
+        data = open_input(args.input, skip)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        exit(1)
+
+    def write(output):
+        convert(data, args.width, args.format, address, output)
+
+    if args.output:
+        write_output(args.output, write)
     else:
-        output = None
-    with open(input, 'rb') as f:
-        data = f.read()
-        num_inst = len(data) // 4
-        for i in range(num_inst):
-            le = data[i * 4: (i + 1) * 4]
-            inst_str = fmt(le[3]) + fmt(le[2]) + fmt(le[1]) + fmt(le[0])
-            if output:
-                output.write(inst_str + '\n')
-            else:
-                print(inst_str)
-    if output:
-        output.close()
\ No newline at end of file
+        write(sys.stdout)
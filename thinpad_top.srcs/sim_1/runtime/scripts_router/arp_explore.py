@@ -0,0 +1,463 @@
+"""
+比较可以替代 simple_arp_table 的 ARP 表结构
+
+simple_arp_table 每次查询要把 IP 和所有表项同时比较，项数一多时序就不满足；
+这里在同样的项数预算下模拟几种用 BRAM 实现的结构，地址由 arp_generate_testcase.py 的
+IPAddress 生成（-p 时和它的 -p 一样集中在一个较小的范围）:
+    linear      现在的 simple_arp_table，全相联，写满后循环覆盖
+    hashed      直接映射，一个哈希值对应一项
+    set         组相联，每组 -w 项，组内写满后循环覆盖
+    dleft       d-left，-d 张子表，每个桶 -w 项，插入到最空的候选桶，一样空时取最左边的
+    cuckoo      -d 张子表的 cuckoo hashing，每个桶 -w 项，最多踢出 -k 次
+
+每种结构先插入 -n 个不同的地址，再把它们各查询一次，另外查询 -q 个随机地址（几乎都不命中），
+重复 -t 次取平均，报告:
+    collision   插入时首选位置（全相联为整张表，其余为第一个哈希位置）已满的比例
+    fail        插入失败的比例：新表项无处可放，只能挤掉一项已有的（或者放弃插入）
+    found       插入过的地址还能查到的比例
+    hit/miss    命中 / 不命中时平均读几次存储器，组或桶一次读出（几张子表依次读，查到即停）
+    max         命中时最多读几次
+    kicks       cuckoo 平均每次插入踢出几项
+    cmp         需要同时比较几个 IP（linear 为全部项数，决定时序；多张子表按同时读出计）
+    bits        存储位数，每项 IP 32 位 + MAC 48 位 + VLAN ID 3 位（IP 为 0 表示空项），
+                加上循环覆盖的写指针
+"""
+from __future__ import annotations
+from typing import *
+import random
+import sys
+import json
+import arp_generate_testcase
+from arp_generate_testcase import IPAddress
+
+
+class Config:
+    budget = 256            # entries of every structure
+    hosts = 0               # how many addresses to insert, the budget if 0
+    queries = 1024          # how many random addresses to look up in addition
+    trials = 4              # how many times to repeat with different addresses
+    ways = 4                # entries of a set / bucket
+    tables = 2              # subtables of d-left and cuckoo
+    kicks = 64              # max displacements of one cuckoo insertion
+    hash = 'mult'           # index hash, mult or fold
+    layouts = []            # which structures, all if not given
+    pressure = False        # whether inserted IP addresses are condense
+    seed = None             # seed of random, for reproducing a result
+    json = ''               # if given, also write the results to this file
+
+
+# 每项的位数：IP、MAC、VLAN ID
+ENTRY_BITS = 32 + 48 + 3
+
+# 每张子表的乘法哈希常数（奇数）
+MULTIPLIERS = [0x9e3779b1, 0x85ebca6b, 0xc2b2ae35, 0x27d4eb2f, 0x165667b1, 0xd3a2646d, 0xfd7046c5, 0xb55a4f09]
+
+
+def log2(value: int) -> int:
+    return max(0, (value - 1).bit_length())
+
+
+def make_hash(table: int, bits: int) -> Callable[[int], int]:
+    """
+    第 table 张子表的哈希，结果为 bits 位
+        mult    乘法哈希，取乘积的高 bits 位
+        fold    把 IP 循环左移 7 * table 位后每 bits 位异或在一起，硬件中只是一组异或门
+    """
+    if bits == 0:
+        return lambda ip: 0
+    mask = (1 << bits) - 1
+    if Config.hash == 'mult':
+        multiplier = MULTIPLIERS[table % len(MULTIPLIERS)]
+        return lambda ip: ((ip * multiplier) & 0xffffffff) >> (32 - bits)
+    rotate = 7 * table % 32
+
+    def fold(ip: int) -> int:
+        value = ((ip << rotate) | (ip >> (32 - rotate))) & 0xffffffff if rotate else ip
+        index = 0
+        while value:
+            index ^= value & mask
+            value >>= bits
+        return index
+    return fold
+
+
+class Layout:
+    """
+    一种 ARP 表结构，表项只记录 IP，MAC 和 VLAN ID 不影响放置
+    """
+    name = ''
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.insertions = 0
+        self.collisions = 0
+        self.failures = 0
+        self.kicks = 0
+
+    def insert(self, ip: int):
+        raise NotImplementedError()
+
+    def lookup(self, ip: int) -> Tuple[bool, int]:
+        """
+        返回是否查到和读存储器的次数
+        """
+        raise NotImplementedError()
+
+    @property
+    def comparators(self) -> int:
+        raise NotImplementedError()
+
+    @property
+    def bits(self) -> int:
+        raise NotImplementedError()
+
+
+class Linear(Layout):
+    name = 'linear'
+
+    def __init__(self, budget: int):
+        super().__init__(budget)
+        self.entries = {}   # IP -> 下标
+        self.ips = [0] * budget
+        self.write_head = 0
+
+    def insert(self, ip: int):
+        self.insertions += 1
+        if ip in self.entries:
+            return
+        evicted = self.ips[self.write_head]
+        if evicted != 0:
+            self.collisions += 1
+            self.failures += 1
+            del self.entries[evicted]
+        self.ips[self.write_head] = ip
+        self.entries[ip] = self.write_head
+        self.write_head = (self.write_head + 1) % self.budget
+
+    def lookup(self, ip: int) -> Tuple[bool, int]:
+        return ip in self.entries, 1
+
+    @property
+    def comparators(self) -> int:
+        return self.budget
+
+    @property
+    def bits(self) -> int:
+        return self.budget * ENTRY_BITS + log2(self.budget)
+
+
+class Buckets(Layout):
+    """
+    tables 张子表，每张 buckets 个桶，每桶 ways 项；hashed 和 set 是只有一张子表的情况
+    """
+
+    def __init__(self, budget: int, tables: int, ways: int):
+        super().__init__(budget)
+        self.tables = tables
+        self.ways = ways
+        self.buckets = max(1, budget // (tables * ways))
+        self.hashes = [make_hash(i, log2(self.buckets)) for i in range(tables)]
+        # 每张子表的每个桶是一个 IP 的列表
+        self.memory = [[[] for _ in range(self.buckets)] for _ in range(tables)]
+
+    def _bucket(self, table: int, ip: int) -> List[int]:
+        return self.memory[table][self.hashes[table](ip) % self.buckets]
+
+    def lookup(self, ip: int) -> Tuple[bool, int]:
+        for table in range(self.tables):
+            if ip in self._bucket(table, ip):
+                return True, table + 1
+        return False, self.tables
+
+    def contains(self, ip: int) -> bool:
+        return any(ip in self._bucket(table, ip) for table in range(self.tables))
+
+    @property
+    def comparators(self) -> int:
+        return self.ways
+
+    @property
+    def bits(self) -> int:
+        return self.tables * self.buckets * self.ways * ENTRY_BITS
+
+
+class SetAssociative(Buckets):
+    """
+    ways 为 1 时即直接映射
+    """
+
+    def __init__(self, budget: int, ways: int):
+        super().__init__(budget, 1, ways)
+        self.name = 'hashed' if ways == 1 else 'set'
+        self.write_heads = [0] * self.buckets
+
+    def insert(self, ip: int):
+        self.insertions += 1
+        index = self.hashes[0](ip) % self.buckets
+        bucket = self.memory[0][index]
+        if ip in bucket:
+            return
+        if len(bucket) < self.ways:
+            bucket.append(ip)
+            return
+        # 组内循环覆盖
+        self.collisions += 1
+        self.failures += 1
+        bucket[self.write_heads[index]] = ip
+        self.write_heads[index] = (self.write_heads[index] + 1) % self.ways
+
+    @property
+    def bits(self) -> int:
+        return super().bits + self.buckets * log2(self.ways)
+
+
+class DLeft(Buckets):
+    name = 'dleft'
+
+    def insert(self, ip: int):
+        self.insertions += 1
+        if self.contains(ip):
+            return
+        buckets = [self._bucket(table, ip) for table in range(self.tables)]
+        if len(buckets[0]) == self.ways:
+            self.collisions += 1
+        # 最空的桶，一样空时 min 取最左边的
+        bucket = min(buckets, key=len)
+        if len(bucket) == self.ways:
+            self.failures += 1
+            return
+        bucket.append(ip)
+
+    @property
+    def comparators(self) -> int:
+        # 各子表同时读出、同时比较
+        return self.tables * self.ways
+
+
+class Cuckoo(Buckets):
+    name = 'cuckoo'
+
+    def insert(self, ip: int):
+        self.insertions += 1
+        if self.contains(ip):
+            return
+        if len(self._bucket(0, ip)) == self.ways:
+            self.collisions += 1
+        table = 0
+        for _ in range(Config.kicks + 1):
+            # 先找任一候选桶的空位
+            for i in range(self.tables):
+                bucket = self._bucket(i, ip)
+                if len(bucket) < self.ways:
+                    bucket.append(ip)
+                    return
+            # 都满了，踢出下一张子表候选桶中随机一项，被踢出的项换到它的其他位置
+            table = (table + 1) % self.tables
+            bucket = self._bucket(table, ip)
+            slot = random.randrange(self.ways)
+            ip, bucket[slot] = bucket[slot], ip
+            self.kicks += 1
+        # 踢出次数用完，最后被踢出的一项丢失
+        self.failures += 1
+
+    @property
+    def comparators(self) -> int:
+        return self.tables * self.ways
+
+
+# 结构名 -> 按 Config 构造一个空表
+LAYOUTS = {
+    'linear': lambda: Linear(Config.budget),
+    'hashed': lambda: SetAssociative(Config.budget, 1),
+    'set': lambda: SetAssociative(Config.budget, Config.ways),
+    'dleft': lambda: DLeft(Config.budget, Config.tables, Config.ways),
+    'cuckoo': lambda: Cuckoo(Config.budget, Config.tables, Config.ways),
+}
+
+
+def run_trial(layout: Layout, addrs: List[int], misses: List[int]) -> Dict[str, float]:
+    for ip in addrs:
+        layout.insert(ip)
+    found = 0
+    hit_reads = []
+    for ip in addrs:
+        hit, reads = layout.lookup(ip)
+        if hit:
+            found += 1
+            hit_reads.append(reads)
+    miss_reads = []
+    for ip in misses:
+        hit, reads = layout.lookup(ip)
+        if not hit:
+            miss_reads.append(reads)
+    return {
+        'collision': layout.collisions / max(1, layout.insertions),
+        'fail': layout.failures / max(1, layout.insertions),
+        'found': found / max(1, len(addrs)),
+        'hit_reads': sum(hit_reads) / max(1, len(hit_reads)),
+        'max_reads': max(hit_reads, default=0),
+        'miss_reads': sum(miss_reads) / max(1, len(miss_reads)),
+        'kicks': layout.kicks / max(1, layout.insertions),
+    }
+
+
+def generate_addrs(count: int) -> List[int]:
+    """
+    count 个不同的插入地址，-p 时集中在一个较小的范围
+    """
+    addrs = set()
+    while len(addrs) < count:
+        addrs.add(IPAddress.get_insert_addr().value)
+    result = list(addrs)
+    random.shuffle(result)
+    return result
+
+
+def explore() -> List[Dict[str, Any]]:
+    results = []
+    trials = []
+    for _ in range(Config.trials):
+        # 每次试验换一个 -p 的中心
+        IPAddress.center = random.randint(0, 0xffffffff)
+        addrs = generate_addrs(Config.hosts or Config.budget)
+        misses = [IPAddress.get_random_addr().value for _ in range(Config.queries)]
+        trials.append((addrs, misses))
+    for name in Config.layouts or LAYOUTS:
+        total = {}
+        for addrs, misses in trials:
+            layout = LAYOUTS[name]()
+            for key, value in run_trial(layout, addrs, misses).items():
+                total[key] = max(total.get(key, 0), value) if key == 'max_reads' else total.get(key, 0) + value
+        # max_reads 取所有试验中最大的，其余取平均
+        result = {key: value if key == 'max_reads' else value / len(trials) for key, value in total.items()}
+        result['layout'] = name
+        result['comparators'] = layout.comparators
+        result['bits'] = layout.bits
+        results.append(result)
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print('%d 项，插入 %d 个地址%s，%d 次试验，哈希 %s' % (
+        Config.budget, Config.hosts or Config.budget, '（-p）' if Config.pressure else '',
+        Config.trials, Config.hash))
+    print('%-8s %9s %7s %7s %5s %5s %4s %6s %5s %8s' % (
+        'layout', 'collision', 'fail', 'found', 'hit', 'miss', 'max', 'kicks', 'cmp', 'bits'))
+    for result in results:
+        print('%-8s %8.2f%% %6.2f%% %6.2f%% %5.2f %5.2f %4d %6.2f %5d %8d' % (
+            result['layout'], 100 * result['collision'], 100 * result['fail'], 100 * result['found'],
+            result['hit_reads'], result['miss_reads'], result['max_reads'], result['kicks'],
+            result['comparators'], result['bits']))
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '-e <budget>',
+        '\tSpecify how many entries every structure has, a power of 2. Default is %d.' % Config.budget,
+        '-n <hosts>',
+        '\tSpecify how many addresses to insert. Default is the budget.',
+        '-q <queries>',
+        '\tSpecify how many random addresses to look up. Default is %d.' % Config.queries,
+        '-t <trials>',
+        '\tSpecify how many times to repeat with different addresses. Default is %d.' % Config.trials,
+        '-w <ways>',
+        '\tSpecify the entries of a set / bucket. Default is %d.' % Config.ways,
+        '-d <tables>',
+        '\tSpecify the subtables of d-left and cuckoo. Default is %d.' % Config.tables,
+        '-k <kicks>',
+        '\tSpecify the max displacements of a cuckoo insertion. Default is %d.' % Config.kicks,
+        '-l <layout>',
+        '\tOnly evaluate this structure (linear, hashed, set, dleft, cuckoo), may be repeated.',
+        '--hash <hash>',
+        '\tSpecify the index hash, mult or fold. Default is %s.' % Config.hash,
+        '-p | --pressure',
+        '\tIf given, inserted IP addresses will be condensed in a smaller range.',
+        '-s <seed>',
+        '\tSpecify the random seed, so that the result can be reproduced.',
+        '-j <json_file>',
+        '\tAlso write the results as JSON to this file.', sep='\n')
+    exit(0)
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        for v in sys.argv[1:]:
+            if state == '':
+                if v in ('-e', '-n', '-q', '-t', '-w', '-d', '-k', '-l', '-s', '-j'):
+                    state = v[1]
+                elif v == '--hash':
+                    state = 'hash'
+                elif v == '-p' or v == '--pressure':
+                    Config.pressure = True
+                else:
+                    return False
+            elif state == 'e':
+                Config.budget = int(v)
+                if Config.budget <= 0 or Config.budget & (Config.budget - 1):
+                    return False
+                state = ''
+            elif state == 'n':
+                Config.hosts = int(v)
+                if Config.hosts < 0:
+                    return False
+                state = ''
+            elif state == 'q':
+                Config.queries = int(v)
+                if Config.queries < 0:
+                    return False
+                state = ''
+            elif state == 't':
+                Config.trials = int(v)
+                if Config.trials <= 0:
+                    return False
+                state = ''
+            elif state == 'w':
+                Config.ways = int(v)
+                if Config.ways <= 0 or Config.ways & (Config.ways - 1):
+                    return False
+                state = ''
+            elif state == 'd':
+                Config.tables = int(v)
+                if Config.tables <= 0:
+                    return False
+                state = ''
+            elif state == 'k':
+                Config.kicks = int(v)
+                if Config.kicks < 0:
+                    return False
+                state = ''
+            elif state == 'l':
+                if v not in LAYOUTS:
+                    return False
+                Config.layouts.append(v)
+                state = ''
+            elif state == 'hash':
+                if v not in ('mult', 'fold'):
+                    return False
+                Config.hash = v
+                state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'j':
+                Config.json = v
+                state = ''
+        return state == ''
+    except (ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+    random.seed(Config.seed)
+    arp_generate_testcase.Config.pressure = Config.pressure
+
+    results = explore()
+    print_results(results)
+    if Config.json:
+        with open(Config.json, 'w') as f:
+            json.dump(results, f, indent=2)
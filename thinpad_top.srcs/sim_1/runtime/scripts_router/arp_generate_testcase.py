@@ -10,6 +10,19 @@
     end
 
 生成的地址不会为 0.0.0.0 或 00:00:00:00:00:00
+
+-x 十六进制模式下，每个操作输出为一行定长的十六进制数，testbench 用 $readmemh 读取（见 Hex）
+
+查询的期望结果由 forwarding_model.ArpTable 给出，它和 simple_arp_table 一样只有 -c 项（默认 8），
+写满后按 write_head 循环覆盖，已存在的 IP 不更新，所以插入多于 -c 个地址后，早插入的地址会查不到
+-c 须和 testbench_arp_table 中的 ARP_ENTRY_COUNT 一致
+
+-n 主机模式模拟一个子网里有 n 台主机：每次查询随机选一台主机（-m 的比例仍查询随机地址），
+查不到时紧接着插入它，相当于路由器发出 ARP 请求并学到了回复，此时 -i 和 -o 不起作用
+生成后打印命中、未命中（分为从未插入过和被挤掉两种）和覆盖的统计，用于估计 ARP 表需要多大
+
+--zipf / --drift / --flows 让查询按 Zipf 分布、漂移的工作集或流选择已插入的地址或主机（见 workload.py），
+默认均匀选择
 """
 from __future__ import annotations
 from typing import *
@@ -19,6 +32,8 @@ import random
 import os
 import struct
 import json
+from workload import Workload
+from forwarding_model import ArpTable
 
 
 class Config:
@@ -27,11 +42,51 @@ class Config:
     miss_rate = 0.5         # the ratio of queries that would miss
     order = False           # whether all queries will be after insertions
     pressure = False        # whether inserted IP addresses are condense
+    capacity = 8            # entries of the ARP table, ENTRY_COUNT of simple_arp_table
+    hosts = 0               # if not 0, queries pick from this many hosts and insert on miss
+    hex = False             # whether to write fixed-width hex records instead of text
+    zipf = 0.0              # if not 0, queries pick inserted entries with this Zipf exponent
+    drift = 0.0             # how many entries the popularity ranking shifts every query
+    flows = 0               # if not 0, queries belong to this many concurrent flows
+    flow_length = 16.0      # mean number of queries of a flow
+    seed = None             # seed of random, for reproducing a testcase
+    output = ''             # output file, ../arp_test.mem if not given
     path = ''               # (maybe) relative path to runtime_path directory
 
 
 def MAC():
-    return '%02x:%02x:%02x:%02x:%02x:%02x@%d' % (*list(os.urandom(6)), random.randint(1, 4))
+    return '%02x:%02x:%02x:%02x:%02x:%02x@%d' % (*random.getrandbits(48).to_bytes(6, 'big'), random.randint(1, 4))
+
+
+def parse_mac(mac: str) -> Tuple[int, int]:
+    """
+    MAC() 格式的字符串 -> (MAC, port)
+    """
+    mac, port = mac.split('@')
+    return int(mac.replace(':', ''), 16), int(port)
+
+
+def format_mac(mac: int, port: int) -> str:
+    return '%02x:%02x:%02x:%02x:%02x:%02x@%d' % (*mac.to_bytes(6, 'big'), port)
+
+
+class Hex:
+    """
+    十六进制测例，每个操作一行 128 位，布局和 testbench_arp_table 中的 buffer 相同
+        [127:124]   操作：1 插入，2 查询，0 结束
+        [82:80] port, [79:32] mac（查询时为期望结果，全 0 表示无法匹配）, [31:0] ip
+    第一行是注释，testbench 据此区分文本和十六进制两种格式
+    """
+    header = '// arp_test hex records\n'
+    end = '%032x\n' % 0
+
+    @staticmethod
+    def record(op: int, addr: int, mac: str) -> str:
+        """
+        mac 为 MAC() 格式的字符串
+        """
+        mac, port = parse_mac(mac)
+        return '%032x\n' % (op << 124 | port << 80 | mac << 32 | addr)
 
 
 class IPAddress:
@@ -86,20 +141,60 @@ class IPAddress:
         return '%d.%d.%d.%d' % (raw[0], raw[1], raw[2], raw[3])
 
 
+class Statistics:
+    """
+    模型中 ARP 表的命中情况
+    """
+    queries = 0
+    hits = 0
+    cold_misses = 0     # 查询的地址从未插入过
+    evicted_misses = 0  # 查询的地址插入过，但已经被挤掉
+    insertions = 0
+    ignored = 0         # 插入的地址已经在表中，硬件不会更新
+    evictions = 0
+
+    @staticmethod
+    def report():
+        misses = Statistics.cold_misses + Statistics.evicted_misses
+        print('ARP 表 %d 项：%d 次查询，命中 %d（%.2f%%），未命中 %d（从未插入 %d，被挤掉 %d）' % (
+            Config.capacity, Statistics.queries, Statistics.hits,
+            100 * Statistics.hits / max(1, Statistics.queries),
+            misses, Statistics.cold_misses, Statistics.evicted_misses))
+        print('%d 次插入（已存在而忽略 %d），覆盖 %d 项' % (
+            Statistics.insertions, Statistics.ignored, Statistics.evictions))
+
+
 class Entry:
     inserted = set()    # 已经插入的地址
     inserted_list = []  # 已经插入的地址（用于随机选择）
     counter = 0         # 已经生成的条目数量
+    table = ArpTable()  # 硬件中 ARP 表的模型，查询的期望结果
+    workload = None     # 查询目标的分布，None 为均匀选择
 
     @staticmethod
     def _save(addr: IPAddress):
         """
         将一个被插入的条目保存
         """
-        if addr in Entry.inserted:
-            raise Exception()
-        Entry.inserted.add(addr)
-        Entry.inserted_list.append(addr)
+        if addr not in Entry.inserted:
+            Entry.inserted.add(addr)
+            Entry.inserted_list.append(addr)
+
+    @staticmethod
+    def insert_addr(addr: IPAddress) -> str:
+        """
+        插入 addr（mac 已经设置好），同时更新模型
+        """
+        Entry._save(addr)
+        Entry.counter += 1
+        Statistics.insertions += 1
+        if Entry.table.lookup(addr.value) is not None:
+            Statistics.ignored += 1
+        elif Entry.table.add(addr.value, *parse_mac(addr.mac)) is not None:
+            Statistics.evictions += 1
+        if Config.hex:
+            return Hex.record(1, addr.value, addr.mac)
+        return 'insert  %s -> %s\n' % (addr, addr.mac)
 
     @staticmethod
     def insert() -> str:
@@ -110,21 +205,67 @@ class Entry:
         while new_addr in Entry.inserted:
             new_addr = IPAddress.get_insert_addr()
         new_addr.mac = MAC()
-        Entry._save(new_addr)
+        return Entry.insert_addr(new_addr)
+
+    @staticmethod
+    def query_addr(addr: IPAddress) -> Tuple[str, bool]:
+        """
+        查询 addr，返回输出和是否命中
+        """
         Entry.counter += 1
-        return 'insert  %s -> %s\n' % (new_addr, new_addr.mac)
+        Statistics.queries += 1
+        found = Entry.table.lookup(addr.value)
+        if found is not None:
+            Statistics.hits += 1
+            mac = format_mac(*found)
+        elif addr in Entry.inserted:
+            Statistics.evicted_misses += 1
+            mac = '00:00:00:00:00:00@0'
+        else:
+            Statistics.cold_misses += 1
+            mac = '00:00:00:00:00:00@0'
+        if Config.hex:
+            return Hex.record(2, addr.value, mac), found is not None
+        return 'query   %s -> %s\n' % (addr, mac), found is not None
 
     @staticmethod
     def query() -> str:
         if random.random() < Config.miss_rate or len(Entry.inserted) == 0:
             addr = IPAddress.get_random_addr()
+        elif Entry.workload is not None:
+            addr = Entry.inserted_list[Entry.workload.pick(len(Entry.inserted_list))[0]]
         else:
             addr = random.choice(Entry.inserted_list)
-        Entry.counter += 1
-        if addr.mac is not None:
-            return 'query   %s -> %s\n' % (addr, addr.mac)
+        return Entry.query_addr(addr)[0]
+
+
+class Hosts:
+    """
+    -n 主机模式：查询的地址来自固定的一组主机，查不到的主机随后被插入
+    """
+    population = []     # type: List[IPAddress]
+
+    @staticmethod
+    def generate():
+        addrs = set()
+        while len(addrs) < Config.hosts:
+            addrs.add(IPAddress.get_insert_addr())
+        Hosts.population = list(addrs)
+        for addr in Hosts.population:
+            addr.mac = MAC()
+
+    @staticmethod
+    def query() -> str:
+        if random.random() < Config.miss_rate:
+            addr = IPAddress.get_random_addr()
+        elif Entry.workload is not None:
+            addr = Hosts.population[Entry.workload.pick(len(Hosts.population))[0]]
         else:
-            return 'query   %s -> 00:00:00:00:00:00@0\n' % addr
+            addr = random.choice(Hosts.population)
+        output, found = Entry.query_addr(addr)
+        if not found and addr.mac is not None:
+            output += Entry.insert_addr(addr)
+        return output
 
 
 def wrong_usage_exit():
@@ -135,12 +276,30 @@ def wrong_usage_exit():
         '\tSpecify how many routing entry to insert. Default is %d.' % Config.insertion_count,
         '-q <query_count>',
         '\tSpecify how many queries to make. Default is %d.' % Config.query_count,
+        '-c <capacity>',
+        '\tSpecify how many entries the ARP table has, same as ENTRY_COUNT of simple_arp_table, a power of 2. Default is %d.' % Config.capacity,
+        '-n <hosts>',
+        '\tIf given, queries pick from this many hosts, and a host is inserted after a query misses it.',
         '-m <miss_rate>',
         '\tSpecify the ratio of queries that doesn\'t match any insertion. Default is %.2f.' % Config.miss_rate,
         '-o | --order',
         '\tIf given, all queries will be ordered after insertions.',
         '-p | --pressure',
-        '\tIf given, inserted IP addresses will be condensed in a smaller range.', sep='\n')
+        '\tIf given, inserted IP addresses will be condensed in a smaller range.',
+        '-x | --hex',
+        '\tIf given, operations are written as fixed-width hex records for $readmemh.',
+        '--zipf <s>',
+        '\tIf given, queries pick inserted entries with Zipf exponent s instead of uniformly, earlier ones are hotter.',
+        '--drift <d>',
+        '\tSpecify how many entries the popularity ranking shifts every query. Default is %g.' % Config.drift,
+        '--flows <n>',
+        '\tIf given, queries belong to n concurrent flows, and a flow queries the same address until it ends.',
+        '--flow-length <l>',
+        '\tSpecify the mean number of queries of a flow. Default is %g.' % Config.flow_length,
+        '-s <seed>',
+        '\tSpecify the random seed, so that the testcase can be reproduced.',
+        '-f <output_file>',
+        '\tSpecify the output file. Default is ../arp_test.mem.', sep='\n')
     exit(0)
 
 
@@ -150,19 +309,32 @@ def parse_arguments() -> bool:
         # get path
         scripts_path = os.path.dirname(sys.argv[0])
         Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        Config.output = os.path.join(Config.path, 'arp_test.mem')
         # parse arguments
         for v in sys.argv[1:]:
             if state == '':
-                if v == '-i':
+                if v == '-s':
+                    state = 's'
+                elif v == '-f':
+                    state = 'f'
+                elif v == '-i':
                     state = 'i'
                 elif v == '-q':
                     state = 'q'
                 elif v == '-m':
                     state = 'm'
+                elif v in ('--zipf', '--drift', '--flows', '--flow-length'):
+                    state = v
+                elif v == '-c':
+                    state = 'c'
+                elif v == '-n':
+                    state = 'n'
                 elif v == '-o' or v == '--order':
                     Config.order = True
                 elif v == '-p' or v == '--pressure':
                     Config.pressure = True
+                elif v == '-x' or v == '--hex':
+                    Config.hex = True
                 else:
                     return False
             elif state == 'i':
@@ -180,6 +352,41 @@ def parse_arguments() -> bool:
                 if not 0 <= Config.miss_rate <= 1:
                     return False
                 state = ''
+            elif state == 'c':
+                Config.capacity = int(v)
+                # write_head 只有 $clog2(ENTRY_COUNT) 位，其他值会写到表外
+                if Config.capacity <= 0 or Config.capacity & (Config.capacity - 1):
+                    return False
+                state = ''
+            elif state == 'n':
+                Config.hosts = int(v)
+                if Config.hosts < 0:
+                    return False
+                state = ''
+            elif state == '--zipf':
+                Config.zipf = float(v)
+                if Config.zipf < 0:
+                    return False
+                state = ''
+            elif state == '--drift':
+                Config.drift = float(v)
+                state = ''
+            elif state == '--flows':
+                Config.flows = int(v)
+                if Config.flows < 0:
+                    return False
+                state = ''
+            elif state == '--flow-length':
+                Config.flow_length = float(v)
+                if Config.flow_length < 1:
+                    return False
+                state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'f':
+                Config.output = v
+                state = ''
         return state == ''
     except (ValueError):
         return False
@@ -188,21 +395,33 @@ def parse_arguments() -> bool:
 if __name__ == '__main__':
     if not parse_arguments():
         wrong_usage_exit()
+    random.seed(Config.seed)
+    # center 在类定义时就取了随机数，设置种子后重新生成
+    IPAddress.center = random.randint(0, 0xffffffff)
+    workload = Workload(Config.zipf, Config.drift, Config.flows, Config.flow_length)
+    if workload.active:
+        Entry.workload = workload
+    Entry.table = ArpTable(Config.capacity)
+
+    output = Hex.header if Config.hex else ''
+    if Config.hosts > 0:
+        Hosts.generate()
+        for _ in range(Config.query_count):
+            output += Hosts.query()
+    else:
+        operations = ['i'] * Config.insertion_count + ['q'] * Config.query_count
+        if not Config.order:
+            random.shuffle(operations)
+        for op in operations:
+            if op == 'i':
+                output += Entry.insert()
+            else:
+                output += Entry.query()
 
-    operations = ['i'] * Config.insertion_count + ['q'] * Config.query_count
-    if not Config.order:
-        random.shuffle(operations)
-
-    output = ''
-    for op in operations:
-        if op == 'i':
-            output += Entry.insert()
-        else:
-            output += Entry.query()
-
-    output += 'end\n'
+    output += Hex.end if Config.hex else 'end\n'
 
     print('已生成测试样例，共 %d 条插入，%d 条查询' %
-          (Config.insertion_count, Config.query_count))
+          (Statistics.insertions, Statistics.queries))
+    Statistics.report()
 
-    open(os.path.join(Config.path, 'arp_test.mem'), 'w').write(output)
+    open(Config.output, 'w').write(output)
@@ -0,0 +1,69 @@
+"""
+IP / UDP 校验和，供帧测例生成脚本和 forwarding_model 使用
+
+数据可以是 bytes、bytearray 或 memoryview，不需要先转成 hex 串或整数列表
+求和时按本机字节序一次取 8 字节相加，最后折叠为 16 位并换回网络字节序（RFC 1071 的字节序无关性）
+增量更新按 RFC 1624 式 3，只改动头部中某个字段时不需要重新对整个头部求和
+"""
+from __future__ import annotations
+from typing import *
+import sys
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def fold(value: int) -> int:
+    """
+    反码加法的进位回卷，折叠为 16 位
+    """
+    while value >> 16:
+        value = (value & 0xffff) + (value >> 16)
+    return value
+
+
+def ones_sum(data: Buffer, initial: int = 0) -> int:
+    """
+    按大端 16 位字做反码求和，奇数长度时末尾补 0
+    initial 为之前已经求得的部分和，可以分段累加（每段长度为偶数）
+    """
+    view = memoryview(data).cast('B')
+    bulk = len(view) & ~7
+    total = sum(view[:bulk].cast('Q'))
+    tail = bytes(view[bulk:])
+    if len(tail) & 1:
+        tail += b'\x00'
+    total = fold(total + sum(memoryview(tail).cast('H')))
+    if sys.byteorder == 'little':
+        total = (total >> 8) | (total & 0xff) << 8
+    return fold(total + initial)
+
+
+def checksum(data: Buffer, initial: int = 0) -> int:
+    """
+    校验和，即反码和取反；IP 头部计算时 checksum 字段应为 0
+    """
+    return ~ones_sum(data, initial) & 0xffff
+
+
+def pseudo_header_sum(src_ip: int, dst_ip: int, protocol: int, length: int) -> int:
+    """
+    UDP / TCP 伪首部的反码和
+    """
+    return fold((src_ip >> 16) + (src_ip & 0xffff) + (dst_ip >> 16) + (dst_ip & 0xffff) + protocol + length)
+
+
+def udp_checksum(src_ip: int, dst_ip: int, udp: Buffer) -> int:
+    """
+    UDP 校验和，udp 为 UDP 头部（checksum 字段为 0）和数据；结果为 0 时按规定发送 0xffff
+    """
+    value = checksum(udp, pseudo_header_sum(src_ip, dst_ip, 17, len(udp)))
+    return value or 0xffff
+
+
+def update(old_checksum: int, old: Buffer, new: Buffer) -> int:
+    """
+    RFC 1624 式 3: HC' = ~(~HC + ~m + m')
+    old / new 为修改前后的字段，长度相同，且在头部中从偶数偏移开始
+    """
+    value = (~old_checksum & 0xffff) + (~ones_sum(old) & 0xffff) + ones_sum(new)
+    return ~fold(value) & 0xffff
@@ -75,6 +75,9 @@ import struct
 import zlib
 import json
 import re
+from frame_writer import FrameWriter, hex_bytes
+from checksum import checksum
+from pcap import PcapWriter, read_pcap
 
 
 def chance(c: float) -> bool:
@@ -82,25 +85,21 @@ def chance(c: float) -> bool:
 
 
 def big_hex(v: int, size: int) -> str:
-    s = ''
-    for i in range(size):
-        s = '%02X ' % (v & 0xff) + s
-        v >>= 8
-    return s
+    return hex_bytes((v & ((1 << (size * 8)) - 1)).to_bytes(size, 'big'))
 
 
 def little_hex(v: int, size: int) -> str:
-    s = ''
-    for i in range(size):
-        s += '%02X ' % (v & 0xff)
-        v >>= 8
-    return s
+    return hex_bytes((v & ((1 << (size * 8)) - 1)).to_bytes(size, 'little'))
 
 
 class Config:
     count = 128             # 生成多少测例
     discard_rate = 0.5      # 错误测例的比例
     max_data_length = 556   # IP 包数据段最大长度
+    seed = None             # seed of random, for reproducing a testcase
+    pcap = ''               # if given, frames are also written to this pcap file
+    from_pcap = ''          # if given, frames are read from this pcap file instead of generated
+    output = ''             # output file, ../eth_frame_test.mem if not given
     path = ''               # (maybe) relative path to runtime_path directory
 
 
@@ -113,7 +112,15 @@ def wrong_usage_exit():
         '-d <discard_rate>',
         '\tSpecify the ratio of testcases that should be discarded. Default is %.2f.' % Config.discard_rate,
         '-l <max_data_length>',
-        '\tSpecify the max length of IP packet data. Default is %d.' % Config.max_data_length
+        '\tSpecify the max length of IP packet data. Default is %d.' % Config.max_data_length,
+        '-s <seed>',
+        '\tSpecify the random seed, so that the testcase can be reproduced.',
+        '--pcap <pcap_file>',
+        '\tIf given, frames are also written to a pcap file at line rate.',
+        '--from-pcap <pcap_file>',
+        '\tIf given, frames are converted from a pcap file instead of generated.',
+        '-f <output_file>',
+        '\tSpecify the output file. Default is ../eth_frame_test.mem.'
     )
     exit(0)
 
@@ -250,7 +257,7 @@ class IpRequest:
     id: int
     ttl: int
     ip_protocol: int
-    data: List[int]
+    data: bytes
     ip_len: int
     checksum: int
 
@@ -261,43 +268,24 @@ class IpRequest:
         self.ttl = random.choice([64, 128, 255])
         self.ip_protocol = random.randrange(256)
         if chance(0.3):
-            self.ip_len = 20
-            self.data = []
+            self.data = b''
         else:
             data_len = random.randrange(Config.max_data_length + 1)
-            self.data = [random.randrange(256) for i in range(data_len)]
-            self.ip_len = data_len + 20
-        checksum = (
-            0x4500 +
-            self.ip_len +
-            self.id +
-            (self.ttl << 8) + self.ip_protocol +
-            (self.src_ip.value >> 16) + (self.src_ip.value & 0xffff) +
-            (self.dst_ip.value >> 16) + (self.dst_ip.value & 0xffff)
-        )
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        self.checksum = checksum ^ 0xffff
+            self.data = random.getrandbits(data_len * 8).to_bytes(data_len, 'big')
+        self.update_checksum()
 
-    @property
-    def hex(self) -> str:
-        return (
-            '08 00 45 00 ' +
-            big_hex(self.ip_len, 2) +
-            big_hex(self.id, 2) +
-            '00 00 %02X %02X ' % (self.ttl, self.ip_protocol) +
-            big_hex(self.checksum, 2) +
-            self.src_ip.hex +
-            self.dst_ip.hex +
-            ''.join('%02X ' % c for c in self.data)
-        )
+    def update_checksum(self):
+        """
+        根据当前的头部字段和 data 设置 ip_len 和 checksum
+        """
+        self.ip_len = 20 + len(self.data)
+        self.checksum = 0
+        self.checksum = checksum(self.header)
 
     @property
-    def raw(self) -> bytearray:
+    def header(self) -> bytes:
         return (
-            b'\x08\x00\x45\x00' +
+            b'\x45\x00' +
             self.ip_len.to_bytes(2, 'big') +
             self.id.to_bytes(2, 'big') +
             b'\x00\x00' +
@@ -305,10 +293,17 @@ class IpRequest:
             self.ip_protocol.to_bytes(1, 'big') +
             self.checksum.to_bytes(2, 'big') +
             self.src_ip.raw +
-            self.dst_ip.raw +
-            b''.join(c.to_bytes(1, 'big') for c in self.data)
+            self.dst_ip.raw
         )
 
+    @property
+    def hex(self) -> str:
+        return hex_bytes(self.raw)
+
+    @property
+    def raw(self) -> bytes:
+        return b'\x08\x00' + self.header + self.data
+
     def __str__(self):
         return 'IP Request: %s -> %s' % (self.src_ip, self.dst_ip)
 
@@ -327,8 +322,8 @@ class EthFrame:
     ]
 
     @staticmethod
-    def get_preamble():
-        return '55 ' * random.randint(4, 16) + 'D5 '
+    def get_preamble() -> bytes:
+        return b'\x55' * random.randint(4, 16) + b'\xd5'
 
     @staticmethod
     def get_arp() -> EthFrame:
@@ -341,6 +336,7 @@ class EthFrame:
         for mac, ip in EthFrame.subnets[port]:
             if ip == src_ip:
                 src_mac = mac
+                break
         else:
             src_mac = MAC.get_random()
             EthFrame.subnets[port].append((src_mac, src_ip,))
@@ -374,26 +370,33 @@ class EthFrame:
             self.padding_size = 0
         else:
             self.padding_size = 44 - data_len
-        raw = (
+        self.body = (
             dst_mac.raw +
             src_mac.raw +
             b'\x81\x00' + struct.pack('>H', self.port) +
             ip_layer_data.raw +
             b'\x00' * self.padding_size
         )
-        self.crc = little_hex(zlib.crc32(raw), 4)
+        self.crc = zlib.crc32(self.body).to_bytes(4, 'little')
+
+    @property
+    def raw(self) -> bytes:
+        """
+        包括 preamble 和 CRC 的完整数据，每次生成的 preamble 长度随机
+        """
+        return EthFrame.get_preamble() + self.body + self.crc
 
     @property
     def hex(self) -> str:
-        return (
-            EthFrame.get_preamble() +
-            self.dst_mac.hex +
-            self.src_mac.hex +
-            '81 00 00 0%d ' % self.port +
-            self.ip_layer_data.hex +
-            '00 ' * self.padding_size +
-            self.crc
-        )
+        return hex_bytes(self.raw)
+
+    @staticmethod
+    def wrap(data: bytes) -> bytes:
+        """
+        将 pcap 中读到的帧（不含 preamble 和 FCS）补齐到最短长度，加上 preamble 和 CRC
+        """
+        data = data.ljust(60, b'\x00')
+        return EthFrame.get_preamble() + data + zlib.crc32(data).to_bytes(4, 'little')
 
     def __str__(self):
         return '%s -> %s: %s' % (self.src_mac, self.dst_mac, self.ip_layer_data)
@@ -405,10 +408,19 @@ def parse_arguments() -> bool:
         # get path
         scripts_path = os.path.dirname(sys.argv[0])
         Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        Config.output = os.path.join(Config.path, 'eth_frame_test.mem')
         # parse arguments
         for v in sys.argv[1:]:
             if state == '':
-                if v == '-c':
+                if v == '-s':
+                    state = 's'
+                elif v == '-f':
+                    state = 'f'
+                elif v == '--pcap':
+                    state = 'pcap'
+                elif v == '--from-pcap':
+                    state = 'from_pcap'
+                elif v == '-c':
                     state = 'c'
                 elif v == '-d':
                     state = 'd'
@@ -431,6 +443,18 @@ def parse_arguments() -> bool:
                 if Config.max_data_length < 0:
                     return False
                 state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'f':
+                Config.output = v
+                state = ''
+            elif state == 'pcap':
+                Config.pcap = v
+                state = ''
+            elif state == 'from_pcap':
+                Config.from_pcap = v
+                state = ''
         return state == ''
     except (ValueError):
         return False
@@ -441,18 +465,34 @@ if __name__ == '__main__':
     # IP.test()
     if not parse_arguments():
         wrong_usage_exit()
-
-    output = ''
-    for i in range(Config.count):
-        frame = None
-        while frame is None:
-            if chance(0.3):
-                frame = EthFrame.get_arp()
-            else:
-                frame = EthFrame.get_ip()
-        output += 'info:      %s\neth_frame: %sFFF\n' % (frame, frame.hex)
+    random.seed(Config.seed)
+
+    pcap = PcapWriter(Config.pcap) if Config.pcap else None
+    with FrameWriter(Config.output) as writer:
+        if Config.from_pcap:
+            try:
+                for timestamp, data in read_pcap(Config.from_pcap):
+                    writer.info('pcap frame %d: %d bytes at %d ns' % (writer.frames + 1, len(data), timestamp))
+                    writer.frame(EthFrame.wrap(data))
+                    if pcap is not None:
+                        pcap.write(data, timestamp)
+            except (OSError, ValueError) as e:
+                print('\033[31m%s\033[0m' % e)
+                exit(1)
+        else:
+            for i in range(Config.count):
+                frame = None
+                while frame is None:
+                    if chance(0.3):
+                        frame = EthFrame.get_arp()
+                    else:
+                        frame = EthFrame.get_ip()
+                writer.info(frame)
+                writer.frame(frame.raw)
+                if pcap is not None:
+                    pcap.write(frame.body)
+    if pcap is not None:
+        pcap.close()
 
     print('已生成 %d 条测试样例' %
-          (Config.count))
-
-    open(os.path.join(Config.path, 'eth_frame_test.mem'), 'w').write(output)
+          (writer.frames))
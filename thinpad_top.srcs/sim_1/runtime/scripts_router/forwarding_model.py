@@ -0,0 +1,193 @@
+"""
+io_manager 转发行为的 Python 模型，供 io_manager_generate_testcase.py 计算每帧的期望输出
+
+按 io_manager 逐字节处理的顺序检查各字段，和硬件在同一位置放弃处理，
+因此丢弃之前已经发生的副作用（ARP 表、路由表的更新）也和硬件相同:
+    ARP Request     记录来源，目标 IP 是本接口时回复 ARP Reply
+    ARP Reply       只记录来源
+    IP              目标 IP 直连时直接查 ARP 表，否则查路由表得到 nexthop 再查 ARP 表，
+                    TTL 减 1，checksum 增量更新（RFC 1624），目标 MAC、源 MAC、VLAN ID 改为查到的出口
+    RIP Request     记录来源，回复由 rip_packer 单独发出，不属于这一帧的输出
+    RIP Response    记录来源，逐条插入路由表，nexthop 为 RIP 包的来源 IP
+其他情况以及路由、ARP 查询失败都丢弃；TTL 为 1 的包和硬件一样照常转发（TTL 变为 0）
+
+路由表用 routing_trie.NodePool，和硬件插入后得到的节点池逐位相同
+ARP 表和 simple_arp_table 一样只有 8 项，循环覆盖，已存在的 IP 不会更新
+节点池可能放不下下一条路由时抛出 RuntimeError：硬件此时会回绕覆盖已有节点，之后的期望结果无法计算
+"""
+from __future__ import annotations
+from typing import *
+from routing_trie import NodePool
+from checksum import update
+
+# Address.sv 中路由器各接口的 IP 和 MAC，下标为 VLAN ID
+ROUTER_IPS = {
+    1: 0xc0a80001,
+    2: 0xc0a80101,
+    3: 0xc0a80201,
+    4: 0xc0a80301,
+}
+ROUTER_MACS = {
+    1: 0xa88808188888,
+    2: 0xa88808288888,
+    3: 0xa88808388888,
+    4: 0xa88808488888,
+}
+MCAST_IP = 0xe0000009
+MCAST_MAC = 0x01005e000009
+
+# 测例中的帧不含 preamble 和 CRC，至少 60 字节
+MIN_FRAME_LENGTH = 60
+
+
+def router_port(ip: int) -> int:
+    """
+    Address::port，ip 和某个接口在同一个 /24 子网时返回该接口，否则为 0
+    """
+    for port, router_ip in ROUTER_IPS.items():
+        if (ip ^ router_ip) >> 8 == 0:
+            return port
+    return 0
+
+
+def leading_ones(value: int) -> int:
+    """
+    io_manager 中 count_left_ones 逐字节累加得到的掩码长度
+    """
+    return 32 - (~value & 0xffffffff).bit_length()
+
+
+class ArpTable:
+    def __init__(self, size: int = 8):
+        """
+        size 即 ENTRY_COUNT；write_head 为 $clog2(ENTRY_COUNT) 位，只有 2 的幂时才恰好在 size 处回绕
+        """
+        if size & (size - 1) or size <= 0:
+            raise ValueError('ENTRY_COUNT must be a power of 2')
+        self.size = size
+        self.ips = [0] * size
+        self.entries = [(0, 0)] * size     # (MAC, VLAN ID)
+        self.slots = {}                     # IP -> 下标，add 不会写入重复的 IP，所以每个 IP 至多一项
+        self.write_head = 0
+
+    def lookup(self, ip: int) -> Optional[Tuple[int, int]]:
+        """
+        返回 (MAC, VLAN ID)
+        """
+        slot = self.slots.get(ip)
+        if slot is None:
+            return None
+        return self.entries[slot]
+
+    def add(self, ip: int, mac: int, vlan: int) -> Optional[int]:
+        """
+        和硬件一样，已存在的 IP 不更新，否则循环覆盖 write_head 处的一项
+        返回被挤掉的 IP，原来是空项或者没有写入时返回 None
+        """
+        if ip in self.slots:
+            return None
+        evicted = self.ips[self.write_head]
+        if evicted != 0:
+            del self.slots[evicted]
+        self.ips[self.write_head] = ip
+        self.entries[self.write_head] = (mac, vlan)
+        # IP 为 0 时硬件同样会写入，但这一项永远查不到
+        if ip != 0:
+            self.slots[ip] = self.write_head
+        self.write_head = (self.write_head + 1) % self.size
+        return evicted or None
+
+
+class Router:
+    def __init__(self, pool: NodePool, arp_size: int = 8):
+        # pool 只用到 query、insert 和 room，routing_cache.RecordingPool 包装的也是这三个
+        self.pool = pool
+        self.arp = ArpTable(arp_size)
+
+    def process(self, frame: bytes) -> Optional[bytes]:
+        """
+        处理一帧（不含 preamble 和 CRC），返回路由器发出的帧，丢弃时返回 None
+        """
+        if len(frame) < MIN_FRAME_LENGTH:
+            raise ValueError('frame of %d bytes is shorter than %d' % (len(frame), MIN_FRAME_LENGTH))
+        dst_mac = int.from_bytes(frame[0:6], 'big')
+        src_mac = int.from_bytes(frame[6:12], 'big')
+        vlan = frame[15] & 7
+        if frame[16] != 0x08:
+            return None
+        if frame[17] == 0x06:
+            return self._arp(frame, src_mac, vlan)
+        if frame[17] != 0x00:
+            return None
+        if dst_mac == MCAST_MAC:
+            self._rip(frame, src_mac, vlan)
+            return None
+        return self._ip(frame)
+
+    def _arp(self, frame: bytes, src_mac: int, vlan: int) -> Optional[bytes]:
+        if frame[18:25] != b'\x00\x01\x08\x00\x06\x04\x00' or frame[25] not in (1, 2):
+            return None
+        # 来源 MAC 取以太网头中的，而不是 ARP 中的
+        self.arp.add(int.from_bytes(frame[32:36], 'big'), src_mac, vlan)
+        router_ip = ROUTER_IPS.get(vlan)
+        if router_ip is None or int.from_bytes(frame[42:46], 'big') != router_ip:
+            return None
+        if frame[25] == 2:
+            return None
+        router_mac = ROUTER_MACS[vlan].to_bytes(6, 'big')
+        reply = bytearray(frame)
+        reply[0:6] = frame[6:12]
+        reply[6:12] = router_mac
+        reply[25] = 0x02
+        reply[26:32] = router_mac
+        reply[32:36] = router_ip.to_bytes(4, 'big')
+        reply[36:46] = frame[26:36]
+        return bytes(reply)
+
+    def _ip(self, frame: bytes) -> Optional[bytes]:
+        if frame[26] == 0:
+            return None
+        target = int.from_bytes(frame[34:38], 'big')
+        if router_port(target) == 0:
+            target = self.pool.query(target)
+            if target == 0:
+                return None
+        entry = self.arp.lookup(target)
+        if entry is None:
+            return None
+        mac, port = entry
+        if port not in ROUTER_MACS:
+            raise ValueError('ARP entry of VLAN %d has no router MAC' % port)
+        # TTL 和协议号组成一个 16 位字
+        checksum = update(int.from_bytes(frame[28:30], 'big'), frame[26:28], bytes((frame[26] - 1, frame[27])))
+        output = bytearray(frame)
+        output[0:6] = mac.to_bytes(6, 'big')
+        output[6:12] = ROUTER_MACS[port].to_bytes(6, 'big')
+        output[15] = frame[15] & 0xf8 | port
+        output[26] = frame[26] - 1
+        output[28:30] = checksum.to_bytes(2, 'big')
+        return bytes(output)
+
+    def _rip(self, frame: bytes, src_mac: int, vlan: int):
+        if frame[27] != 0x11:
+            return
+        src_ip = int.from_bytes(frame[30:34], 'big')
+        self.arp.add(src_ip, src_mac, vlan)
+        if int.from_bytes(frame[34:38], 'big') != MCAST_IP or frame[38:42] != b'\x02\x08\x02\x08':
+            return
+        if frame[46] != 2 or frame[47:50] != b'\x02\x00\x00':
+            return
+        # 不足 20 字节的尾部不会触发插入
+        for offset in range(50, len(frame) - 19, 20):
+            entry = frame[offset:offset + 20]
+            infinity = entry[16:19] != b'\x00\x00\x00'
+            # metric 为 0 或 15 的条目被丢弃
+            if not infinity and entry[19] in (0, 15):
+                continue
+            if entry[0:4] != b'\x00\x02\x00\x00':
+                continue
+            metric = (infinity or entry[19] >> 4 != 0) << 4 | entry[19] & 0xf
+            if self.pool.room == 0:
+                raise RuntimeError('routing table node pool is full')
+            self.pool.insert(int.from_bytes(entry[4:8], 'big'), leading_ones(int.from_bytes(entry[8:12], 'big')),
+                             src_ip, metric, vlan)
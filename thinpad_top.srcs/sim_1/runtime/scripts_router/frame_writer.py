@@ -0,0 +1,69 @@
+"""
+以太网帧测例的流式写入，供 eth_frame / io_manager 的测例生成脚本使用
+
+每帧的数据由 bytes 一次转换为 "XX XX ... " 形式的 hex 串，
+写入的行攒够 chunk_lines 行就写进文件，生成任意多的测例时内存占用不变
+"""
+from __future__ import annotations
+from typing import *
+
+
+def hex_bytes(data: bytes) -> str:
+    """
+    转为测例文件中的 hex 串，每个字节后跟一个空格
+    """
+    if len(data) == 0:
+        return ''
+    return data.hex(' ').upper() + ' '
+
+
+class FrameWriter:
+    def __init__(self, path: str, chunk_lines: int = 4096):
+        self.file = open(path, 'w')
+        self.chunk_lines = chunk_lines
+        self.lines = []
+        self.frames = 0     # 已写入的 eth_frame 数量
+
+    def _append(self, line: str):
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_lines:
+            self.flush()
+
+    def info(self, text: str):
+        """
+        注释行，仿真时原样打印
+        """
+        self._append('info:      %s\n' % text)
+
+    def frame(self, data: bytes):
+        """
+        输入的数据包
+        """
+        self.frames += 1
+        self._append('eth_frame: %sFFF\n' % hex_bytes(data))
+
+    def expect(self, data: bytes):
+        """
+        路由器应当发出的数据包
+        """
+        self._append('expect:    %sFFF\n' % hex_bytes(data))
+
+    def discard(self):
+        """
+        前一个数据包应当被丢弃
+        """
+        self._append('discard\n')
+
+    def flush(self):
+        self.file.write(''.join(self.lines))
+        self.lines.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> FrameWriter:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -11,8 +11,8 @@
 如果以 "expect:    " 开头，则为 hex 表示的应当返回的数据包，以 FFF 结束
 如果以 "discard"     开头，则表示前面一个数据包应当被丢弃
 
-todo:
-连上 IP 表、ARP 表后有对应的测例
+每个 eth_frame 之后都有一行 expect 或 discard，由 forwarding_model.Router 给出，
+路由表从 routing_memory.mem 开始，和仿真中的初始状态相同
 
 ARP 包:
 -8  0x55555555555555D5  Preamble
@@ -72,12 +72,16 @@ from typing import *
 import random
 import sys
 import random
-import itertools
 import os
 import struct
 import zlib
 import json
 import re
+from frame_writer import FrameWriter, hex_bytes
+from checksum import checksum, udp_checksum
+from pcap import PcapWriter, read_pcap
+from forwarding_model import Router
+from routing_trie import NodePool
 
 
 def chance(c: float) -> bool:
@@ -85,25 +89,23 @@ def chance(c: float) -> bool:
 
 
 def big_hex(v: int, size: int) -> str:
-    s = ''
-    for i in range(size):
-        s = '%02X ' % (v & 0xff) + s
-        v >>= 8
-    return s
+    return hex_bytes((v & ((1 << (size * 8)) - 1)).to_bytes(size, 'big'))
 
 
 def little_hex(v: int, size: int) -> str:
-    s = ''
-    for i in range(size):
-        s += '%02X ' % (v & 0xff)
-        v >>= 8
-    return s
+    return hex_bytes((v & ((1 << (size * 8)) - 1)).to_bytes(size, 'little'))
 
 
 class Config:
     count = 128             # 生成多少测例
     discard_rate = 0.5      # 错误测例的比例
     max_data_length = 0     # IP 包数据段最大长度
+    seed = None             # seed of random, for reproducing a testcase
+    pcap = ''               # if given, frames are also written to this pcap file
+    from_pcap = ''          # if given, frames are read from this pcap file instead of generated
+    output = ''             # output file, ../io_manager_test.mem if not given
+    routing_memory = ''     # initial routing table image, routing_memory.mem if not given
+    routing_header = ''     # routing_memory.vh of the image, routing_memory.vh if -m is not given
     path = ''               # (maybe) relative path to runtime_path directory
 
 
@@ -116,7 +118,19 @@ def wrong_usage_exit():
         '-d <discard_rate>',
         '\tSpecify the ratio of testcases that should be discarded. Default is %.2f.' % Config.discard_rate,
         '-l <max_data_length>',
-        '\tSpecify the max length of IP packet data. Default is %d.' % Config.max_data_length
+        '\tSpecify the max length of IP packet data. Default is %d.' % Config.max_data_length,
+        '-s <seed>',
+        '\tSpecify the random seed, so that the testcase can be reproduced.',
+        '--pcap <pcap_file>',
+        '\tIf given, frames are also written to a pcap file at line rate.',
+        '--from-pcap <pcap_file>',
+        '\tIf given, frames are converted from a pcap file instead of generated.',
+        '-f <output_file>',
+        '\tSpecify the output file. Default is ../io_manager_test.mem.',
+        '-m <routing_memory>',
+        '\tSpecify the initial routing table image. Default is sources_1/.../routing/routing_memory.mem.',
+        '-p <routing_header>',
+        '\tSpecify the routing_memory.vh written with the image. Inferred from the image if -m is given alone.',
     )
     exit(0)
 
@@ -304,7 +318,7 @@ class IpRequest:
     id: int
     ttl: int
     ip_protocol: int
-    data: List[int]
+    data: bytes
     ip_len: int
     checksum: int
 
@@ -315,43 +329,24 @@ class IpRequest:
         self.ttl = random.choice([64, 128, 255])
         self.ip_protocol = random.randrange(256)
         if chance(0.3):
-            self.ip_len = 20
-            self.data = []
+            self.data = b''
         else:
             data_len = random.randrange(Config.max_data_length + 1)
-            self.data = [random.randrange(256) for i in range(data_len)]
-            self.ip_len = data_len + 20
-        checksum = (
-            0x4500 +
-            self.ip_len +
-            self.id +
-            (self.ttl << 8) + self.ip_protocol +
-            (self.src_ip.value >> 16) + (self.src_ip.value & 0xffff) +
-            (self.dst_ip.value >> 16) + (self.dst_ip.value & 0xffff)
-        )
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        self.checksum = checksum ^ 0xffff
+            self.data = random.getrandbits(data_len * 8).to_bytes(data_len, 'big')
+        self.update_checksum()
 
-    @property
-    def hex(self) -> str:
-        return (
-            '08 00 45 00 ' +
-            big_hex(self.ip_len, 2) +
-            big_hex(self.id, 2) +
-            '00 00 %02X %02X ' % (self.ttl, self.ip_protocol) +
-            big_hex(self.checksum, 2) +
-            self.src_ip.hex +
-            self.dst_ip.hex +
-            ''.join('%02X ' % c for c in self.data)
-        )
+    def update_checksum(self):
+        """
+        根据当前的头部字段和 data 设置 ip_len 和 checksum
+        """
+        self.ip_len = 20 + len(self.data)
+        self.checksum = 0
+        self.checksum = checksum(self.header)
 
     @property
-    def raw(self) -> bytearray:
+    def header(self) -> bytes:
         return (
-            b'\x08\x00\x45\x00' +
+            b'\x45\x00' +
             self.ip_len.to_bytes(2, 'big') +
             self.id.to_bytes(2, 'big') +
             b'\x00\x00' +
@@ -359,14 +354,29 @@ class IpRequest:
             self.ip_protocol.to_bytes(1, 'big') +
             self.checksum.to_bytes(2, 'big') +
             self.src_ip.raw +
-            self.dst_ip.raw +
-            b''.join(c.to_bytes(1, 'big') for c in self.data)
+            self.dst_ip.raw
         )
 
+    @property
+    def hex(self) -> str:
+        return hex_bytes(self.raw)
+
+    @property
+    def raw(self) -> bytes:
+        return b'\x08\x00' + self.header + self.data
+
     def __str__(self):
         return 'IP Request: %s -> %s' % (self.src_ip, self.dst_ip)
 
 
+def udp_datagram(src_ip: IP, dst_ip: IP, payload: bytes) -> bytes:
+    """
+    RIP 使用的 UDP 包（520 -> 520），带校验和
+    """
+    udp = struct.pack('>HHHH', 520, 520, 8 + len(payload), 0) + payload
+    return udp[:6] + udp_checksum(src_ip.value, dst_ip.value, udp).to_bytes(2, 'big') + udp[8:]
+
+
 class RipRequest(IpRequest):
     def __init__(self, src_ip: IP):
         self.dst_ip = IP('224.0.0.9')
@@ -374,26 +384,10 @@ class RipRequest(IpRequest):
         self.id = random.randrange(16**4)
         self.ttl = 1
         self.ip_protocol = 17
-        self.data = [
-            0x02, 0x08, 0x02, 0x08, 0x00, 0x20, 0x58, 0xd9,
-            0x01, 0x02, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x10
-        ]
-        self.ip_len = 20 + len(self.data)
-        checksum = (
-            0x4500 +
-            self.ip_len +
-            self.id +
-            (self.ttl << 8) + self.ip_protocol +
-            (self.src_ip.value >> 16) + (self.src_ip.value & 0xffff) +
-            (self.dst_ip.value >> 16) + (self.dst_ip.value & 0xffff)
-        )
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        self.checksum = checksum ^ 0xffff
+        # 请求整张路由表：一个 family 为 0、metric 为 16 的条目
+        rip = b'\x01\x02\x00\x00' + b'\x00' * 16 + struct.pack('>I', 16)
+        self.data = udp_datagram(self.src_ip, self.dst_ip, rip)
+        self.update_checksum()
 
     def __str__(self):
         return 'RIP Request from %s' % self.src_ip
@@ -410,40 +404,9 @@ class RipResponse(IpRequest):
             self.entries = [RipEntry() for i in range(random.randrange(1, 25))]
         else:
             self.entries = entries
-        udp_length = 12 + 20 * len(self.entries)
-        udp_checksum = (
-            1057 + udp_length +
-            (self.src_ip.value >> 16) + (self.src_ip.value & 0xffff) +
-            (self.dst_ip.value >> 16) + (self.dst_ip.value & 0xffff)
-        )
-        for index, h in enumerate(''.join(e.hex for e in self.entries).split()):
-            val = int(h, 16)
-            if index & 1:
-                udp_checksum += val
-            else:
-                udp_checksum += val << 8
-        udp_checksum %= 0xffff
-        if udp_checksum > 0:
-            udp_checksum ^= 0xffff
-        self.data = [
-            0x02, 0x08, 0x02, 0x08,
-            udp_length >> 8, udp_length & 0xff, udp_checksum >> 8, udp_checksum & 0xff,
-            0x02, 0x02, 0x00, 0x00
-        ] + list(itertools.chain(*[list(e.raw) for e in self.entries]))
-        self.ip_len = 20 + len(self.data)
-        checksum = (
-            0x4500 +
-            self.ip_len +
-            self.id +
-            (self.ttl << 8) + self.ip_protocol +
-            (self.src_ip.value >> 16) + (self.src_ip.value & 0xffff) +
-            (self.dst_ip.value >> 16) + (self.dst_ip.value & 0xffff)
-        )
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        if checksum > 0xffff:
-            checksum = (checksum >> 16) + (checksum & 0xffff)
-        self.checksum = checksum ^ 0xffff
+        rip = b'\x02\x02\x00\x00' + b''.join(e.raw for e in self.entries)
+        self.data = udp_datagram(self.src_ip, self.dst_ip, rip)
+        self.update_checksum()
 
     def __str__(self):
         s = 'RIP Response from %s:' % self.src_ip
@@ -456,20 +419,44 @@ class EthFrame:
     """
     以太网帧，需要生成 Preamble, dest MAC, src MAC, VLAN TAG, CRC
     """
-    # 四个子网，子网内第一条为路由器，会在 ARP 时添加新的记录
+    # 四个子网，子网内第一条为路由器（和 Address.sv 一致），会在 ARP 时添加新的记录
     subnets: List[List[Tuple[MAC, IP]]] = [
         [],
-        [(MAC('a8:88:08:18:88:88'), IP('10.4.1.1'))],
-        [(MAC('a8:88:08:28:88:88'), IP('10.4.2.1'))],
-        [(MAC('a8:88:08:38:88:88'), IP('10.4.3.1'))],
-        [(MAC('a8:88:08:48:88:88'), IP('10.4.4.1'))],
+        [(MAC('a8:88:08:18:88:88'), IP('192.168.0.1'))],
+        [(MAC('a8:88:08:28:88:88'), IP('192.168.1.1'))],
+        [(MAC('a8:88:08:38:88:88'), IP('192.168.2.1'))],
+        [(MAC('a8:88:08:48:88:88'), IP('192.168.3.1'))],
     ]
-    # 让路由器学会的路由
+    # 让路由器学会的路由，值为来源 port
     reachable: Dict[(IP, int), int] = {}
+    # reachable 中的路由及其在列表中的下标，用于 O(1) 随机选择和删除
+    reachable_list: List[(IP, int)] = []
+    reachable_index: Dict[(IP, int), int] = {}
+    # 还能让路由器学会多少条新路由，用完后只重新宣告已学会的路由，不让节点池溢出
+    # （删除路由不会释放分支节点，所以只减不增）
+    route_budget = 0
+
+    @staticmethod
+    def learn(route: (IP, int), port: int):
+        if route not in EthFrame.reachable:
+            EthFrame.reachable_index[route] = len(EthFrame.reachable_list)
+            EthFrame.reachable_list.append(route)
+            EthFrame.route_budget -= 1
+        EthFrame.reachable[route] = port
+
+    @staticmethod
+    def forget(route: (IP, int)):
+        # 用最后一条填上被删除的位置
+        index = EthFrame.reachable_index.pop(route)
+        last = EthFrame.reachable_list.pop()
+        if last != route:
+            EthFrame.reachable_list[index] = last
+            EthFrame.reachable_index[last] = index
+        del EthFrame.reachable[route]
 
     @staticmethod
-    def get_preamble():
-        return '55 ' * random.randint(4, 16) + 'D5 '
+    def get_preamble() -> bytes:
+        return b'\x55' * random.randint(4, 16) + b'\xd5'
 
     @staticmethod
     def get_arp() -> EthFrame:
@@ -499,7 +486,7 @@ class EthFrame:
             return None
         src_mac, src_ip = random.choice(EthFrame.subnets[port][1:])
         # 随机选择一个可达地址
-        prefix, mask = random.choice(list(EthFrame.reachable))
+        prefix, mask = random.choice(EthFrame.reachable_list)
         dst_ip = IP.get_random(prefix, mask)
         # 发给路由器
         dst_mac = EthFrame.subnets[port][0][0]
@@ -545,18 +532,23 @@ class EthFrame:
         for _ in range(random.randrange(1, 25)):
             if len(EthFrame.reachable) > 0 and chance(0):
                 # 删除路由
-                to_delete, prev_port = random.choice(
-                    list(EthFrame.reachable.items()))
+                to_delete = random.choice(EthFrame.reachable_list)
+                prev_port = EthFrame.reachable[to_delete]
                 entries.append(RipEntry(*to_delete, 16))
                 # 仅当 port 一样时能够真正删除
                 if port == prev_port:
-                    del EthFrame.reachable[to_delete]
+                    EthFrame.forget(to_delete)
+            elif EthFrame.route_budget <= 0 and len(EthFrame.reachable) > 0:
+                # 节点池快满了，更新一条已有的路由
+                prefix, mask = random.choice(EthFrame.reachable_list)
+                entries.append(RipEntry(prefix, mask, random.randrange(1, 16)))
+                EthFrame.learn((prefix, mask), port)
             else:
                 # 添加路由
                 prefix = IP(random.randrange(2**32) & 0xffffff00)
                 mask = 24
                 entries.append(RipEntry(prefix, mask, random.randrange(1, 16)))
-                EthFrame.reachable[(prefix, mask)] = port
+                EthFrame.learn((prefix, mask), port)
 
         request = RipResponse(src_ip, entries)
         return EthFrame(dst_mac, src_mac, port, request)
@@ -574,26 +566,32 @@ class EthFrame:
             self.padding_size = 0
         else:
             self.padding_size = 44 - data_len
-        raw = (
+        self.body = (
             dst_mac.raw +
             src_mac.raw +
             b'\x81\x00' + struct.pack('>H', self.port) +
             ip_layer_data.raw +
             b'\x00' * self.padding_size
         )
-        self.crc = little_hex(zlib.crc32(raw), 4)
+        self.crc = zlib.crc32(self.body).to_bytes(4, 'little')
+
+    @property
+    def raw(self) -> bytes:
+        """
+        写入测例的数据，不含 preamble 和 CRC
+        """
+        return self.body
 
     @property
     def hex(self) -> str:
-        return (
-            # EthFrame.get_preamble() +
-            self.dst_mac.hex +
-            self.src_mac.hex +
-            '81 00 00 0%d ' % self.port +
-            self.ip_layer_data.hex +
-            '00 ' * self.padding_size
-            # self.crc
-        )
+        return hex_bytes(self.raw)
+
+    @staticmethod
+    def wrap(data: bytes) -> bytes:
+        """
+        将 pcap 中读到的帧（不含 preamble 和 FCS）补齐到最短长度（测例中不含 preamble 和 CRC）
+        """
+        return data.ljust(60, b'\x00')
 
     def __str__(self):
         # return '%s -> %s: %s' % (self.src_mac, self.dst_mac, self.ip_layer_data)
@@ -606,10 +604,28 @@ def parse_arguments() -> bool:
         # get path
         scripts_path = os.path.dirname(sys.argv[0])
         Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        Config.output = os.path.join(Config.path, 'io_manager_test.mem')
+        Config.routing_memory = os.path.normpath(os.path.join(
+            Config.path, '..', '..', 'sources_1', 'router', 'modules', 'routing', 'routing_memory.mem'))
+        Config.routing_header = os.path.normpath(os.path.join(
+            Config.path, '..', '..', 'sources_1', 'router', 'include', 'routing_memory.vh'))
+        header_given = False
         # parse arguments
         for v in sys.argv[1:]:
             if state == '':
-                if v == '-c':
+                if v == '-s':
+                    state = 's'
+                elif v == '-f':
+                    state = 'f'
+                elif v == '-m':
+                    state = 'm'
+                elif v == '-p':
+                    state = 'p'
+                elif v == '--pcap':
+                    state = 'pcap'
+                elif v == '--from-pcap':
+                    state = 'from_pcap'
+                elif v == '-c':
                     state = 'c'
                 elif v == '-d':
                     state = 'd'
@@ -632,6 +648,27 @@ def parse_arguments() -> bool:
                 if Config.max_data_length < 0:
                     return False
                 state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'f':
+                Config.output = v
+                state = ''
+            elif state == 'm':
+                Config.routing_memory = v
+                if not header_given:
+                    Config.routing_header = ''
+                state = ''
+            elif state == 'p':
+                Config.routing_header = v
+                header_given = True
+                state = ''
+            elif state == 'pcap':
+                Config.pcap = v
+                state = ''
+            elif state == 'from_pcap':
+                Config.from_pcap = v
+                state = ''
         return state == ''
     except (ValueError):
         return False
@@ -642,22 +679,57 @@ if __name__ == '__main__':
     # IP.test()
     if not parse_arguments():
         wrong_usage_exit()
+    random.seed(Config.seed)
 
-    output = ''
-    for i in range(Config.count):
-        frame = None
-        while frame is None:
-            if chance(0.1):
-                frame = EthFrame.get_rip_response()
-            # else:
-            #     frame = EthFrame.get_rip_request()
-            # elif chance(0.3):
-            #     frame = EthFrame.get_arp()
+    try:
+        router = Router(NodePool.load(Config.routing_memory, header=Config.routing_header))
+    except (OSError, ValueError) as e:
+        print('\033[31m%s\033[0m' % e)
+        exit(1)
+    # 留出一条的余量，用完预算后 room 仍不为 0，重新宣告已有的路由不会被当作溢出
+    EthFrame.route_budget = router.pool.room - 1
+
+    def write_frame(data: bytes):
+        """
+        写入一帧及其期望输出
+        """
+        writer.frame(data)
+        output = router.process(data)
+        if output is None:
+            writer.discard()
+        else:
+            writer.expect(output)
+
+    pcap = PcapWriter(Config.pcap) if Config.pcap else None
+    with FrameWriter(Config.output) as writer:
+        try:
+            if Config.from_pcap:
+                for timestamp, data in read_pcap(Config.from_pcap):
+                    writer.info('pcap frame %d: %d bytes at %d ns' % (writer.frames + 1, len(data), timestamp))
+                    write_frame(EthFrame.wrap(data))
+                    if pcap is not None:
+                        pcap.write(data, timestamp)
             else:
-                frame = EthFrame.get_ip()
-        output += 'info:      %s\neth_frame: %sFFF\n' % (frame, frame.hex)
+                for i in range(Config.count):
+                    frame = None
+                    while frame is None:
+                        if chance(0.1):
+                            frame = EthFrame.get_rip_response()
+                        # else:
+                        #     frame = EthFrame.get_rip_request()
+                        # elif chance(0.3):
+                        #     frame = EthFrame.get_arp()
+                        else:
+                            frame = EthFrame.get_ip()
+                    writer.info(frame)
+                    write_frame(frame.raw)
+                    if pcap is not None:
+                        pcap.write(frame.body)
+        except (OSError, ValueError, RuntimeError) as e:
+            print('\033[31mframe %d: %s\033[0m' % (writer.frames, e))
+            exit(1)
+    if pcap is not None:
+        pcap.close()
 
     print('已生成 %d 条测试样例' %
-          (Config.count))
-
-    open(os.path.join(Config.path, 'io_manager_test.mem'), 'w').write(output)
+          (writer.frames))
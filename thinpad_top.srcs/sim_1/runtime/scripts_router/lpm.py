@@ -0,0 +1,134 @@
+"""
+最长前缀匹配的参考实现（DIR-24-8），供各测例生成脚本计算期望结果
+
+tbl24 以地址高 24 位为下标，表项:
+    0               无匹配
+    最高位为 0      匹配到的值
+    最高位为 1      低 31 位为 tbl8 分组编号，再以地址低 8 位在分组内查找
+每个表项另外记录写入它的前缀长度，插入时只覆盖不长于新前缀的表项，
+因此插入顺序可以任意，而查询最多只需要两次查表
+
+插入时需要展开的区间按连续段用切片赋值写入，开销和区间内已有的更长前缀数量相关
+"""
+from __future__ import annotations
+from typing import *
+from array import array
+
+
+# 各掩码长度对应的掩码
+MASKS = [(0xffffffff << (32 - mask)) & 0xffffffff for mask in range(33)]
+
+
+class LpmTable:
+    POINTER = 0x80000000    # tbl24 表项指向 tbl8 分组的标记
+    NESTED = 33             # 指向 tbl8 的 tbl24 表项记录的长度，比任何前缀都长
+    # 将长度翻译为是否比 mask 更长（1 表示更长），用于快速找出不能覆盖的表项
+    _LONGER = [bytes(int(length > mask) for length in range(256))
+               for mask in range(33)]
+
+    def __init__(self):
+        self.tbl24 = array('I', [0]) * (1 << 24)
+        self.len24 = bytearray(1 << 24)
+        self.tbl8 = array('I')
+        self.len8 = bytearray()
+
+    def _fill(self, table: array, lengths: bytearray, start: int, end: int, value: int, mask: int):
+        """
+        将 [start, end) 中前缀长度不超过 mask 的表项设为 value
+
+        按连续段处理：可以覆盖的段整段写入，被更长前缀占据的段整段跳过，
+        最后再进入区间内指向 tbl8 的分组继续填
+        """
+        longer = lengths[start:end].translate(LpmTable._LONGER[mask])
+        size = end - start
+        pos = 0
+        while pos < size:
+            stop = longer.find(1, pos)
+            if stop < 0:
+                stop = size
+            if stop > pos:
+                table[start + pos:start + stop] = array('I', [value]) * (stop - pos)
+                lengths[start + pos:start + stop] = bytes([mask]) * (stop - pos)
+            pos = longer.find(0, stop)
+            if pos < 0:
+                break
+        if table is self.tbl24:
+            nested = lengths.find(LpmTable.NESTED, start, end)
+            while nested >= 0:
+                group = table[nested] ^ LpmTable.POINTER
+                self._fill(self.tbl8, self.len8, group << 8,
+                           (group + 1) << 8, value, mask)
+                nested = lengths.find(LpmTable.NESTED, nested + 1, end)
+
+    def insert(self, prefix: int, mask: int, value: int):
+        """
+        插入 prefix/mask -> value，value 取值 [1, 0x7fffffff]
+        重复插入同一前缀会覆盖之前的值
+        """
+        prefix &= MASKS[mask]
+        if mask <= 24:
+            start = prefix >> 8
+            self._fill(self.tbl24, self.len24, start,
+                       start + (1 << (24 - mask)), value, mask)
+        else:
+            index = prefix >> 8
+            if self.len24[index] == LpmTable.NESTED:
+                group = self.tbl24[index] ^ LpmTable.POINTER
+            else:
+                # 新建一个 tbl8 分组，继承原 tbl24 表项
+                group = len(self.tbl8) >> 8
+                self.tbl8.extend(array('I', [self.tbl24[index]]) * 256)
+                self.len8.extend(bytes([self.len24[index]]) * 256)
+                self.tbl24[index] = LpmTable.POINTER | group
+                self.len24[index] = LpmTable.NESTED
+            start = (group << 8) | (prefix & 0xff)
+            self._fill(self.tbl8, self.len8, start,
+                       start + (1 << (32 - mask)), value, mask)
+
+    def lookup(self, addr: int) -> int:
+        """
+        查询 addr 最长匹配的值，无匹配返回 0
+        """
+        entry = self.tbl24[addr >> 8]
+        if entry & LpmTable.POINTER:
+            return self.tbl8[((entry ^ LpmTable.POINTER) << 8) | (addr & 0xff)]
+        return entry
+
+    def lookup_many(self, addrs: Sequence[int]) -> array:
+        """
+        批量查询，返回和 addrs 一一对应的 array('I')
+        先整体查 tbl24，再只对落入 tbl8 的地址查第二次
+        """
+        tbl24, tbl8 = self.tbl24, self.tbl8
+        result = array('I', [tbl24[addr >> 8] for addr in addrs])
+        for i, entry in enumerate(result):
+            if entry & LpmTable.POINTER:
+                result[i] = tbl8[((entry ^ LpmTable.POINTER) << 8) | (addrs[i] & 0xff)]
+        return result
+
+    @staticmethod
+    def _test():
+        # 和线性扫描对比
+        import random
+        table = LpmTable()
+        routes = []
+        for i in range(1, 2001):
+            mask = random.choice([random.randint(0, 32), 24, 25, 30])
+            prefix = random.getrandbits(32) & MASKS[mask]
+            routes = [r for r in routes if r[:2] != (prefix, mask)]
+            routes.append((prefix, mask, i))
+            table.insert(prefix, mask, i)
+        addrs = [random.getrandbits(32) for _ in range(5000)] + \
+            [(p | random.getrandbits(32) & ~MASKS[m]) & 0xffffffff for p, m, _ in routes]
+        result = table.lookup_many(addrs)
+        for addr, got in zip(addrs, result):
+            best, best_mask = 0, -1
+            for prefix, mask, value in routes:
+                if addr & MASKS[mask] == prefix and mask > best_mask:
+                    best, best_mask = value, mask
+            assert got == best == table.lookup(addr), (hex(addr), got, best)
+        print('ok')
+
+
+if __name__ == '__main__':
+    LpmTable._test()
@@ -0,0 +1,404 @@
+"""
+模拟 routing_table 前面加一级目标地址缓存的效果
+
+routing_table 每次查询要在 BRAM 中逐层读 trie，需要 routing_trie.query_cycles 个周期；
+缓存以完整的目标地址为键记录查询结果，命中时只需 --hit-cycles 个周期，不命中时再查 trie 并填入缓存
+
+输入按扩展名区分:
+    .pcap       按 forwarding_model.Router 处理每一帧，非直连的 IP 包查询路由表，RIP Response 插入路由
+    其他        routing_generate_testcase.py 的输出（文本或 -x 十六进制），或 routing_compile.py 能读取的路由表
+所有输入依次在同一个 routing_trie.NodePool 上重放一次，得到每次查询的结果和周期数，
+再对 -e / -w / -r 的每种组合分别模拟缓存
+
+缓存结构:
+    -e          总项数
+    -w          每组项数，1 为直接映射，等于 -e 时为全相联；组下标为目标地址按位折叠异或
+    -r          组内替换策略：lru、clock（second chance，每项一个访问位）或 fifo
+插入路由时缓存中的结果可能过期:
+    -i flush    清空整个缓存（硬件只需一个代数计数器）
+    -i prefix   只作废被新前缀覆盖的地址，其他地址的最长匹配不受影响（硬件需要逐项比较）
+
+输出每种缓存的命中率、作废次数、存储位数，以及按 125M 时钟估算的平均查询周期和每秒查询次数，
+和没有缓存时对比
+"""
+from __future__ import annotations
+from typing import *
+from collections import OrderedDict
+from array import array
+from routing_trie import NodePool, query_cycles
+from routing_compile import read_testcase
+from forwarding_model import Router
+from lpm import MASKS
+from pcap import read_pcap
+import sys
+import os
+import json
+
+
+class Config:
+    inputs = []             # traces to replay, routing_test.mem if not given
+    entries = [256]         # cache sizes to simulate
+    ways = [4]              # associativities to simulate
+    policies = ['lru']      # replacement policies to simulate
+    invalidation = 'flush'  # flush or prefix
+    hit_cycles = 2          # cycles of a lookup that hits the cache
+    frequency = 125e6       # clock of routing_table.sv
+    json = ''               # if given, also write the results to this file
+    path = ''               # (maybe) relative path to runtime_path directory
+
+
+# 每项的位数：目标地址 32 位 + nexthop 32 位 + 有效位
+ENTRY_BITS = 32 + 32 + 1
+
+
+class Trace:
+    """
+    重放得到的操作序列，按列保存
+        查询    kind 为 0，addr 为目标地址，value 为查到的 nexthop（0 为无匹配），cycles 为 trie 查询周期数
+        插入    kind 为 1，addr 为前缀，value 为掩码长度
+    """
+
+    def __init__(self):
+        self.kind = array('B')
+        self.addr = array('I')
+        self.value = array('I')
+        self.cycles = array('H')
+
+    def __len__(self):
+        return len(self.kind)
+
+    @property
+    def queries(self) -> int:
+        return len(self.kind) - sum(self.kind)
+
+
+class RecordingPool:
+    """
+    包装 NodePool，把 Router 和重放产生的查询、插入记入 Trace
+    """
+
+    def __init__(self, pool: NodePool, trace: Trace):
+        self.pool = pool
+        self.trace = trace
+
+    def query(self, addr: int) -> int:
+        nexthop, reads = self.pool.lookup(addr)
+        self.trace.kind.append(0)
+        self.trace.addr.append(addr)
+        self.trace.value.append(nexthop)
+        self.trace.cycles.append(query_cycles(reads, nexthop != 0))
+        return nexthop
+
+    @property
+    def room(self) -> int:
+        return self.pool.room
+
+    def insert(self, prefix: int, mask: int, nexthop: int, metric: int, from_vlan: int, second: int = 0):
+        self.pool.insert(prefix, mask, nexthop, metric, from_vlan, second)
+        self.trace.kind.append(1)
+        self.trace.addr.append(prefix)
+        self.trace.value.append(mask)
+        self.trace.cycles.append(0)
+
+
+def replay_pcap(pool: RecordingPool, path: str):
+    router = Router(pool)
+    for i, (_, frame) in enumerate(read_pcap(path), 1):
+        try:
+            router.process(frame)
+        except (ValueError, RuntimeError) as e:
+            raise ValueError('%s: frame %d: %s' % (path, i, e))
+
+
+def replay_text(pool: RecordingPool, path: str):
+    """
+    routing_generate_testcase.py 的文本或十六进制输出，或者路由表
+    """
+    for _, route, query in read_testcase(path):
+        if route is not None:
+            pool.insert(*route)
+        else:
+            pool.query(query[0])
+
+
+def fold(addr: int, bits: int) -> int:
+    """
+    把 32 位地址每 bits 位异或在一起，硬件中只是一组异或门
+    """
+    if bits == 0:
+        return 0
+    mask = (1 << bits) - 1
+    index = 0
+    while addr:
+        index ^= addr & mask
+        addr >>= bits
+    return index
+
+
+class Cache:
+    """
+    组相联的目标地址缓存，每组是一个 地址 -> nexthop 的 OrderedDict
+        lru     命中时移到末尾，替换最前面的
+        fifo    替换最早填入的
+        clock   每项一个访问位，指针从上次的位置开始找访问位为 0 的项，经过的项清零
+    """
+
+    def __init__(self, entries: int, ways: int, policy: str):
+        self.entries = entries
+        self.ways = min(ways, entries)
+        self.sets = entries // self.ways
+        self.index_bits = (self.sets - 1).bit_length()
+        self.policy = policy
+        self.lines = [OrderedDict() for _ in range(self.sets)]
+        # clock 的每组：各位置上的地址、访问位和指针
+        self.slots = [[] for _ in range(self.sets)]
+        self.referenced = [bytearray(self.ways) for _ in range(self.sets)]
+        self.hands = [0] * self.sets
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0          # 命中但结果和 trie 不同，作废不完整时才会出现
+        self.invalidations = 0  # 作废的次数（flush 为清空的次数）
+        self.invalidated = 0    # 被作废的项数
+
+    def _set(self, addr: int) -> int:
+        return fold(addr, self.index_bits) % self.sets
+
+    def lookup(self, addr: int, nexthop: int) -> bool:
+        """
+        查询 addr，nexthop 为 trie 的结果，不命中时填入；返回是否命中
+        """
+        index = self._set(addr)
+        line = self.lines[index]
+        if addr in line:
+            self.hits += 1
+            if line[addr] != nexthop:
+                self.stale += 1
+            if self.policy == 'lru':
+                line.move_to_end(addr)
+            elif self.policy == 'clock':
+                self.referenced[index][self.slots[index].index(addr)] = 1
+            return True
+        self.misses += 1
+        self._fill(index, addr, nexthop)
+        return False
+
+    def _fill(self, index: int, addr: int, nexthop: int):
+        line = self.lines[index]
+        if self.policy != 'clock':
+            if len(line) >= self.ways:
+                line.popitem(last=False)
+            line[addr] = nexthop
+            return
+        slots = self.slots[index]
+        referenced = self.referenced[index]
+        if len(slots) < self.ways:
+            slots.append(addr)
+            line[addr] = nexthop
+            return
+        hand = self.hands[index]
+        while referenced[hand]:
+            referenced[hand] = 0
+            hand = (hand + 1) % self.ways
+        del line[slots[hand]]
+        slots[hand] = addr
+        line[addr] = nexthop
+        self.hands[index] = (hand + 1) % self.ways
+
+    def invalidate(self, prefix: int, mask: int):
+        self.invalidations += 1
+        if Config.invalidation == 'flush':
+            for index in range(self.sets):
+                self.invalidated += len(self.lines[index])
+                self._clear(index)
+            return
+        for index in range(self.sets):
+            line = self.lines[index]
+            covered = [addr for addr in line if addr & MASKS[mask] == prefix]
+            if covered:
+                self.invalidated += len(covered)
+                if self.policy == 'clock':
+                    # 作废的项留出空位，剩下的项保持各自的访问位
+                    kept = [(addr, bit) for addr, bit in zip(self.slots[index], self.referenced[index])
+                            if addr not in covered]
+                    self._clear(index)
+                    for addr, bit in kept:
+                        self.referenced[index][len(self.slots[index])] = bit
+                        self.slots[index].append(addr)
+                        self.lines[index][addr] = line[addr]
+                else:
+                    for addr in covered:
+                        del line[addr]
+
+    def _clear(self, index: int):
+        self.lines[index] = OrderedDict()
+        self.slots[index] = []
+        self.referenced[index] = bytearray(self.ways)
+        self.hands[index] = 0
+
+    @property
+    def bits(self) -> int:
+        """
+        存储位数，加上替换策略的状态：lru 每项记录组内排名，clock 每项一个访问位加每组的指针，fifo 每组一个指针
+        """
+        way_bits = (self.ways - 1).bit_length()
+        if self.ways == 1:
+            state = 0
+        elif self.policy == 'lru':
+            state = self.entries * way_bits
+        elif self.policy == 'clock':
+            state = self.entries + self.sets * way_bits
+        else:
+            state = self.sets * way_bits
+        return self.entries * ENTRY_BITS + state
+
+
+def simulate(trace: Trace, cache: Cache) -> Dict[str, Any]:
+    cycles = 0
+    baseline = 0
+    for kind, addr, value, trie_cycles in zip(trace.kind, trace.addr, trace.value, trace.cycles):
+        if kind == 1:
+            cache.invalidate(addr, value)
+            continue
+        baseline += trie_cycles
+        if cache.lookup(addr, value):
+            cycles += Config.hit_cycles
+        else:
+            # 先查缓存，不命中再查 trie，填入缓存和查 trie 同时进行
+            cycles += Config.hit_cycles + trie_cycles
+    queries = max(1, cache.hits + cache.misses)
+    return OrderedDict([
+        ('entries', cache.entries),
+        ('ways', cache.ways),
+        ('policy', cache.policy),
+        ('hit_rate', cache.hits / queries),
+        ('stale', cache.stale),
+        ('invalidations', cache.invalidations),
+        ('invalidated', cache.invalidated),
+        ('bits', cache.bits),
+        ('cycles', cycles / queries),
+        ('baseline_cycles', baseline / queries),
+        ('lookups_per_second', queries / max(1, cycles) * Config.frequency),
+        ('baseline_lookups_per_second', queries / max(1, baseline) * Config.frequency),
+    ])
+
+
+def report(trace: Trace, results: List[Dict[str, Any]]):
+    print('%d 次查询，%d 次插入，作废方式 %s，命中 %d 周期' % (
+        trace.queries, len(trace) - trace.queries, Config.invalidation, Config.hit_cycles))
+    if results:
+        print('没有缓存时平均 %.2f 周期，%.2f M 次查询/秒' % (
+            results[0]['baseline_cycles'], results[0]['baseline_lookups_per_second'] / 1e6))
+    print('%7s %5s %6s %8s %8s %8s %8s %8s' % (
+        'entries', 'ways', 'policy', 'hit', 'cycles', 'M/s', 'speedup', 'bits'))
+    for result in results:
+        print('%7d %5d %6s %7.2f%% %8.2f %8.2f %7.2fx %8d' % (
+            result['entries'], result['ways'], result['policy'], 100 * result['hit_rate'],
+            result['cycles'], result['lookups_per_second'] / 1e6,
+            result['lookups_per_second'] / max(1, result['baseline_lookups_per_second']), result['bits']))
+        if result['stale']:
+            print('\033[31m    %d 次命中的结果已经过期\033[0m' % result['stale'])
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '<file> ...',
+        '\tTestcases, route lists or pcap files to replay, in order. Default is ../routing_test.mem.',
+        '-e <entries>',
+        '\tSpecify the cache sizes to simulate, comma separated powers of 2. Default is %s.' % ','.join(map(str, Config.entries)),
+        '-w <ways>',
+        '\tSpecify the associativities to simulate, comma separated powers of 2. Default is %s.' % ','.join(map(str, Config.ways)),
+        '-r <policy>',
+        '\tSpecify the replacement policies to simulate, comma separated lru, clock or fifo. Default is %s.' % ','.join(Config.policies),
+        '-i <invalidation>',
+        '\tSpecify what an inserted route invalidates, flush or prefix. Default is %s.' % Config.invalidation,
+        '--hit-cycles <cycles>',
+        '\tSpecify the cycles of a lookup that hits the cache. Default is %d.' % Config.hit_cycles,
+        '-j <json_file>',
+        '\tAlso write the results as JSON to this file.', sep='\n')
+    exit(0)
+
+
+def parse_powers(v: str) -> List[int]:
+    values = [int(value) for value in v.split(',')]
+    if any(value <= 0 or value & (value - 1) for value in values):
+        raise ValueError()
+    return values
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        # get path
+        scripts_path = os.path.dirname(sys.argv[0])
+        Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        # parse arguments
+        for v in sys.argv[1:]:
+            if state == '':
+                if v in ('-e', '-w', '-r', '-i', '-j'):
+                    state = v[1]
+                elif v == '--hit-cycles':
+                    state = 'hit'
+                elif not v.startswith('-'):
+                    Config.inputs.append(v)
+                else:
+                    return False
+            elif state == 'e':
+                Config.entries = parse_powers(v)
+                state = ''
+            elif state == 'w':
+                Config.ways = parse_powers(v)
+                state = ''
+            elif state == 'r':
+                Config.policies = v.split(',')
+                if any(policy not in ('lru', 'clock', 'fifo') for policy in Config.policies):
+                    return False
+                state = ''
+            elif state == 'i':
+                if v not in ('flush', 'prefix'):
+                    return False
+                Config.invalidation = v
+                state = ''
+            elif state == 'hit':
+                Config.hit_cycles = int(v)
+                if Config.hit_cycles < 1:
+                    return False
+                state = ''
+            elif state == 'j':
+                Config.json = v
+                state = ''
+        if not Config.inputs:
+            Config.inputs.append(os.path.join(Config.path, 'routing_test.mem'))
+        return state == ''
+    except (ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+
+    trace = Trace()
+    pool = RecordingPool(NodePool(65536), trace)
+    try:
+        for path in Config.inputs:
+            if path.endswith('.pcap'):
+                replay_pcap(pool, path)
+            else:
+                replay_text(pool, path)
+    except (OSError, ValueError, RuntimeError) as e:
+        print('\033[31m%s\033[0m' % e)
+        exit(1)
+
+    results = []
+    for entries in Config.entries:
+        for ways in Config.ways:
+            if ways > entries:
+                continue
+            for policy in Config.policies:
+                results.append(simulate(trace, Cache(entries, ways, policy)))
+    report(trace, results)
+    if Config.json:
+        with open(Config.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,297 @@
+"""
+将路由表编译为 routing_table.sv 使用的 BRAM 初始化镜像
+
+输出:
+    sources_1/router/modules/routing/routing_memory.mem    节点池镜像
+    sources_1/router/include/routing_memory.vh              镜像中已占用的节点，作为写指针的复位值
+
+节点布局由 routing_trie.NodePool 按 ModeInsert 的逻辑逐条插入得到，和硬件学到同一组路由后的结果相同；
+默认在仓库原有的镜像（直连的 192.168.0.0/24 ~ 192.168.3.0/24）之上插入，-b 指定其他基础镜像，-e 从空的节点池开始
+
+输入格式（按行自动识别，# 之后为注释）:
+    路由表测例   insert  10.0.0.0/8 -> 1.2.3.4 (1, 1)
+    文本         10.0.0.0/8 1.2.3.4 [metric [vlan]]
+    bgpdump -m   TABLE_DUMP2|1577836800|B|1.1.1.1|65000|10.0.0.0/8|65000 65001|IGP|1.2.3.4|...
+                 metric 取 AS path 长度（不超过 15），IPv6 条目被跳过
+    JSON         [{"prefix": "10.0.0.0/8", "nexthop": "1.2.3.4", "metric": 1, "vlan": 1}, ...]
+                 整个文件是一个 JSON 数组时按 JSON 读取
+metric 缺省为 1，vlan 缺省为 1；metric 为 16 的条目和硬件一样视为删除
+"""
+from __future__ import annotations
+from typing import *
+from socket import inet_aton
+from routing_trie import NodePool
+import re
+import sys
+import os
+import json
+
+
+class Config:
+    inputs = []             # route list files, '-' for stdin
+    base = ''               # if given, compile on top of this image instead of the direct routes
+    base_header = ''        # routing_memory.vh written with the base image, for its write pointers
+    empty = False           # whether to start from an empty pool instead of the direct routes
+    node_pool_size = 32768  # NODE_POOL_SIZE of routing_table.sv
+    second = 0              # update_time of the generated nexthop nodes
+    fit = False             # whether to stop before the pool overflows instead of failing
+    output = ''             # path of routing_memory.mem
+    header = ''             # path of routing_memory.vh
+    path = ''               # (maybe) relative path to runtime_path directory
+
+
+# 路由 (prefix, mask, nexthop, metric, vlan)
+Route = Tuple[int, int, int, int, int]
+
+# routing_generate_testcase.py -x 输出的第一行
+HEX_HEADER = '// routing_test hex records'
+
+INSERT_LINE = re.compile(r'insert\s+([\d.]+)/(\d+)\s*->\s*([\d.]+)(?:/\d+)?\s*\((\d+),\s*(\d+)\)')
+
+
+def parse_ip(text: str) -> int:
+    return int.from_bytes(inet_aton(text), 'big')
+
+
+def parse_prefix(text: str) -> Tuple[int, int]:
+    """
+    解析 a.b.c.d/len，主机位清零
+    """
+    addr, _, mask = text.partition('/')
+    mask = int(mask) if mask else 32
+    if not 0 <= mask <= 32:
+        raise ValueError('invalid mask length %d' % mask)
+    return parse_ip(addr) & (0xffffffff << (32 - mask)) & 0xffffffff, mask
+
+
+def make_route(prefix: str, nexthop: str, metric: int = 1, vlan: int = 1) -> Route:
+    prefix, mask = parse_prefix(prefix)
+    if not 1 <= metric <= 16:
+        raise ValueError('invalid metric %d' % metric)
+    return prefix, mask, parse_ip(nexthop), metric, vlan
+
+
+def parse_line(line: str) -> Optional[Route]:
+    """
+    解析一行，不是路由的行返回 None
+    """
+    line = line.split('#')[0].strip()
+    if line == '' or line == 'end' or line.startswith('query'):
+        return None
+    if line.startswith('insert'):
+        match = INSERT_LINE.match(line)
+        if match is None:
+            raise ValueError('malformed insert line')
+        prefix, mask, nexthop, metric, vlan = match.groups()
+        return make_route(prefix + '/' + mask, nexthop, int(metric), int(vlan))
+    if '|' in line:
+        fields = line.split('|')
+        if len(fields) < 9 or fields[2] not in ('A', 'B') or ':' in fields[5]:
+            return None
+        hops = len(fields[6].split())
+        return make_route(fields[5], fields[8], min(max(hops, 1), 15))
+    fields = line.split()
+    if not 2 <= len(fields) <= 4:
+        raise ValueError('expected "prefix/len nexthop [metric [vlan]]"')
+    return make_route(*fields[:2], *map(int, fields[2:]))
+
+
+def read_routes(path: str) -> Iterator[Route]:
+    """
+    逐条读取一个文件中的路由，出错时抛出带有位置的 ValueError
+    """
+    f = sys.stdin if path == '-' else open(path)
+    head = f.read(1)
+    while head.isspace():
+        head = f.read(1)
+    if head == '[':
+        try:
+            entries = json.loads(head + f.read())
+        except json.JSONDecodeError as e:
+            raise ValueError('%s: %s' % (path, e))
+        for i, entry in enumerate(entries):
+            try:
+                yield make_route(entry['prefix'], entry['nexthop'],
+                                 int(entry.get('metric', 1)), int(entry.get('vlan', 1)))
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                raise ValueError('%s: entry %d: %s' % (path, i, e))
+        return
+    for i, line in enumerate(f, 1):
+        if i == 1:
+            line = head + line
+        try:
+            route = parse_line(line)
+        except (TypeError, ValueError, OSError) as e:
+            raise ValueError('%s:%d: %s' % (path, i, e))
+        if route is not None:
+            yield route
+
+
+def read_testcase(path: str) -> Iterator[Tuple[int, Optional[Route], Optional[Tuple[int, int]]]]:
+    """
+    逐个读取 routing_generate_testcase.py 的测例（文本或 -x 十六进制）中的操作，也可以是路由表
+    返回 (行号, 插入的路由, None) 或 (行号, None, (查询的地址, 期望的 nexthop))，出错时抛出带有位置的 ValueError
+    """
+    with open(path) as f:
+        is_hex = f.readline().strip() == HEX_HEADER
+        f.seek(0)
+        for i, line in enumerate(f, 1):
+            try:
+                if is_hex:
+                    if line.startswith('//'):
+                        continue
+                    record = int(line, 16)
+                    op = record >> 124
+                    if op == 1:
+                        yield i, (record & 0xffffffff, (record >> 32) & 0x3f, (record >> 40) & 0xffffffff,
+                                  (record >> 72) & 0x1f, (record >> 77) & 7), None
+                    elif op == 2:
+                        yield i, None, (record & 0xffffffff, (record >> 40) & 0xffffffff)
+                    continue
+                if line.startswith('query'):
+                    addr, _, expected = line.split()[1:4]
+                    yield i, None, (parse_ip(addr.split('/')[0]), parse_ip(expected.split('/')[0]))
+                    continue
+                route = parse_line(line)
+            except (IndexError, ValueError, OSError) as e:
+                raise ValueError('%s:%d: %s' % (path, i, e))
+            if route is not None:
+                yield i, route, None
+
+
+def compile_routes(pool: NodePool, routes: Iterable[Route]) -> int:
+    """
+    依次插入，返回插入的条数
+    Config.fit 时在可能溢出前停止（一次插入至多占用 2 个分支节点和 1 个 nexthop 节点）
+    """
+    count = 0
+    for prefix, mask, nexthop, metric, vlan in routes:
+        if Config.fit and (pool.branch_used + 2 > pool.half or pool.nexthop_used + 1 > pool.half):
+            break
+        pool.insert(prefix, mask, nexthop, metric, vlan, Config.second)
+        if pool.overflow:
+            raise ValueError('node pool overflows at %s/%d, use a larger NODE_POOL_SIZE or -f' %
+                             ('.'.join(str(prefix >> i & 0xff) for i in (24, 16, 8, 0)), mask))
+        count += 1
+    return count
+
+
+def write_header(pool: NodePool, path: str):
+    open(path, 'w').write(
+        '// 由 scripts_router/routing_compile.py 生成，和 routing_memory.mem 一一对应\n'
+        '`ifndef _ROUTING_MEMORY_VH_\n'
+        '`define _ROUTING_MEMORY_VH_\n'
+        '\n'
+        '// 镜像中已经占用的节点，复位后从这里继续分配\n'
+        '`define ROUTING_BRANCH_WRITE_ADDR 16\'h%04x\n'
+        '`define ROUTING_NEXTHOP_WRITE_ADDR 16\'h%04x\n'
+        '\n'
+        '`endif\n' % (pool.branch_write_addr, pool.nexthop_write_addr))
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '<route_file> ...',
+        '\tRoute lists to compile, in order. "-" reads from stdin.',
+        '-b <base_mem>',
+        '\tCompile on top of an existing image instead of the directly connected routes.',
+        '-p <base_vh>',
+        '\tSpecify the header written with the base image, whose write pointers are used. Inferred from the image if not given.',
+        '-e | --empty',
+        '\tIf given, compile on an empty pool instead of the directly connected routes.',
+        '-n <node_pool_size>',
+        '\tSpecify NODE_POOL_SIZE of routing_table.sv. Default is %d.' % Config.node_pool_size,
+        '-t <second>',
+        '\tSpecify update_time of the nexthop nodes. Default is %d.' % Config.second,
+        '-o <output_mem>',
+        '\tSpecify the image to write. Default is sources_1/.../routing/routing_memory.mem.',
+        '-d <output_vh>',
+        '\tSpecify the header to write. Default is sources_1/router/include/routing_memory.vh.',
+        '-f | --fit',
+        '\tIf given, routes that may not fit in the pool are dropped instead of failing.', sep='\n')
+    exit(0)
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        # get path
+        scripts_path = os.path.dirname(sys.argv[0])
+        Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        router_path = os.path.join(Config.path, '..', '..', 'sources_1', 'router')
+        Config.output = os.path.normpath(os.path.join(
+            router_path, 'modules', 'routing', 'routing_memory.mem'))
+        Config.header = os.path.normpath(os.path.join(
+            router_path, 'include', 'routing_memory.vh'))
+        # parse arguments
+        for v in sys.argv[1:]:
+            if state == '':
+                if v == '-b':
+                    state = 'b'
+                elif v == '-p':
+                    state = 'p'
+                elif v == '-e' or v == '--empty':
+                    Config.empty = True
+                elif v == '-n':
+                    state = 'n'
+                elif v == '-t':
+                    state = 't'
+                elif v == '-o':
+                    state = 'o'
+                elif v == '-d':
+                    state = 'd'
+                elif v == '-f' or v == '--fit':
+                    Config.fit = True
+                elif v == '-' or not v.startswith('-'):
+                    Config.inputs.append(v)
+                else:
+                    return False
+            elif state == 'b':
+                Config.base = v
+                state = ''
+            elif state == 'p':
+                Config.base_header = v
+                state = ''
+            elif state == 'n':
+                Config.node_pool_size = int(v)
+                state = ''
+            elif state == 't':
+                Config.second = int(v)
+                if not 0 <= Config.second <= 0xffff:
+                    return False
+                state = ''
+            elif state == 'o':
+                Config.output = v
+                state = ''
+            elif state == 'd':
+                Config.header = v
+                state = ''
+        return state == '' and len(Config.inputs) > 0 and not (Config.empty and Config.base)
+    except (ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+
+    try:
+        if Config.base:
+            pool = NodePool.load(Config.base, Config.node_pool_size, Config.base_header)
+        elif Config.empty:
+            pool = NodePool(Config.node_pool_size)
+        else:
+            pool = NodePool.direct(Config.node_pool_size)
+        count = 0
+        for path in Config.inputs:
+            count += compile_routes(pool, read_routes(path))
+    except (OSError, ValueError, RuntimeError) as e:
+        print('\033[31m%s\033[0m' % e)
+        exit(1)
+
+    pool.save(Config.output)
+    write_header(pool, Config.header)
+    print('已编译 %d 条路由，使用 %d/%d 个分支节点，%d/%d 个 nexthop 节点' %
+          (count, pool.branch_used, pool.half, pool.nexthop_used, pool.half))
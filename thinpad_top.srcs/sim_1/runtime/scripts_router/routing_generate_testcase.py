@@ -10,15 +10,26 @@
     end
 
 生成的地址不会为 0.0.0.0
+
+-b 批量模式下，条目按列存放在 array 中，输出分块写入文件，用于生成百万级的测例
+-x 十六进制模式下，每个操作输出为一行定长的十六进制数，testbench 用 $readmemh 读取（见 Hex）
+--zipf / --drift / --flows 让查询按 Zipf 分布、漂移的工作集或流选择目标（见 workload.py），默认均匀选择
+--synthesize 时插入的前缀由 routing_synthesize.py 按真实路由表的长度分布和层次分配预先生成（--lengths 给出分布文件），
+代替均匀的掩码长度和 -p 的单个簇
 """
 from __future__ import annotations
 from typing import *
+from array import array
+from socket import inet_ntoa
+from lpm import LpmTable, MASKS
 import random
 import sys
 import random
 import os
 import struct
 import json
+from workload import Workload
+from routing_synthesize import Synthesizer, DEFAULT_LENGTHS, load_lengths
 
 
 class Config:
@@ -27,6 +38,17 @@ class Config:
     miss_rate = 0.5         # the ratio of queries that would miss
     order = False           # whether all queries will be after insertions
     pressure = False        # whether inserted IP addresses are condense
+    bulk = False            # whether to use the array-backed streaming generator
+    hex = False             # whether to write fixed-width hex records instead of text
+    zipf = 0.0              # if not 0, queries pick inserted entries with this Zipf exponent
+    drift = 0.0             # how many entries the popularity ranking shifts every query
+    flows = 0               # if not 0, queries belong to this many concurrent flows
+    flow_length = 16.0      # mean number of queries of a flow
+    synthesize = False      # whether inserted prefixes come from routing_synthesize
+    lengths = ''            # length distribution file of routing_synthesize, implies synthesize
+    chunk_lines = 65536     # how many lines to buffer before writing in bulk mode
+    seed = None             # seed of random, for reproducing a testcase
+    output = ''             # output file, ../routing_test.mem if not given
     path = ''               # (maybe) relative path to runtime_path directory
 
 
@@ -38,6 +60,8 @@ class IPAddress:
     nexthop: IPAddress
     # if '-p', random generated IP addresses will be near this center
     center: int = random.randint(0, 0xffffffff)
+    # --synthesize 时预先生成的 (prefix, mask)，插入时依次取出
+    synthesized: List[Tuple[int, int]] = []
 
     @staticmethod
     def get_insert_addr() -> IPAddress:
@@ -45,6 +69,9 @@ class IPAddress:
         随机生成一个带有 mask 的地址
         如果在 -p 模式下，生成的地址会集中在一个比较小的范围
         """
+        if IPAddress.synthesized:
+            value, mask = IPAddress.synthesized.pop()
+            return IPAddress(value, mask, random.randint(1, 14), random.randint(1, 4))
         value = 0
         while value == 0:
             if Config.pressure:
@@ -59,11 +86,12 @@ class IPAddress:
         return IPAddress(value, mask, metric, from_vlan)
 
     @staticmethod
-    def get_query_match(target: IPAddress) -> IPAddress:
+    def get_query_match(target: IPAddress, host: Optional[int] = None) -> IPAddress:
         """
         随机生成一个匹配目标地址的地址
+        给出 host 时用它填充掩码以外的位，同一 host 总是得到同一个地址（结果为 0 时仍随机生成）
         """
-        value = 0
+        value = 0 if host is None else target.value ^ (host & (0xffffffff >> target.mask))
         while value == 0:
             value = target.value ^ (
                 random.randint(0, 0xffffffff) & (0xffffffff >> target.mask))
@@ -112,8 +140,9 @@ class IPAddress:
 class Entry:
     inserted = set()    # 已经插入的地址（用于查重）
     inserted_list = []  # 已经插入的地址（用于随机选择）
-    tree = ([], {})     # 四级的树来存储已插入的地址
+    table = LpmTable()  # 已插入的地址，值为在 inserted_list 中的下标 + 1
     counter = 0         # 已经生成的条目数量
+    workload = None     # 查询目标的分布，None 为均匀选择
 
     @staticmethod
     def _test():
@@ -143,36 +172,17 @@ class Entry:
             raise Exception()
         Entry.inserted.add(addr)
         Entry.inserted_list.append(addr)
-        target = Entry.tree
-        for level in range(4):
-            if addr.mask <= (level + 1) * 8:
-                # 如果剩余长度小于等于八位，则用数组保存
-                target[0].append(addr)
-                break
-            # 否则需要进入下一层树
-            if addr[level] in target[1]:
-                target = target[1][addr[level]]
-            else:
-                target[1][addr[level]] = ([], {})
-                target = target[1][addr[level]]
+        Entry.table.insert(addr.value, addr.mask, len(Entry.inserted_list))
 
     @staticmethod
     def _match(addr: IPAddress) -> IPAddress:
         """
         尝试从已插入的地址中寻找可以匹配当前地址的
         """
-        best = None
-        best_mask = 0
-        target = Entry.tree
-        for level in range(4):
-            for dest in target[0]:
-                if dest.mask > best_mask and addr.match(dest):
-                    best, best_mask = dest, dest.mask
-            if addr[level] in target[1]:
-                target = target[1][addr[level]]
-            else:
-                break
-        return best
+        index = Entry.table.lookup(addr.value)
+        if index == 0:
+            return None
+        return Entry.inserted_list[index - 1]
 
     @staticmethod
     def insert() -> str:
@@ -186,23 +196,161 @@ class Entry:
         new_addr.nexthop = nexthop
         Entry._save(new_addr)
         Entry.counter += 1
+        if Config.hex:
+            return Hex.insert(new_addr.value, new_addr.mask, nexthop.value, new_addr.metric, new_addr.from_vlan)
         return 'insert  %s -> %s (%d, %d)\n' % (new_addr, nexthop, new_addr.metric, new_addr.from_vlan)
 
     @staticmethod
     def query() -> str:
         if random.random() < Config.miss_rate or len(Entry.inserted) == 0:
             addr = IPAddress.get_random_addr()
+        elif Entry.workload is not None:
+            index, host = Entry.workload.pick(len(Entry.inserted_list))
+            addr = IPAddress.get_query_match(Entry.inserted_list[index], host)
         else:
             addr = IPAddress.get_query_match(
                 random.choice(Entry.inserted_list))
         match = Entry._match(addr)
         Entry.counter += 1
+        if Config.hex:
+            return Hex.query(addr.value, match.nexthop.value if match is not None else 0)
         if match is not None:
             return 'query   %s -> %s\n' % (addr, match.nexthop)
         else:
             return 'query   %s -> 0.0.0.0/32\n' % addr
 
 
+class Hex:
+    """
+    十六进制测例，每个操作一行 128 位，布局和 testbench_routing_table 中的 buffer 相同
+        [127:124]   操作：1 插入，2 查询，0 结束
+        插入        [79:77] from_vlan, [76:72] metric, [71:40] nexthop, [37:32] mask, [31:0] 地址
+        查询        [71:40] 期望的 nexthop（0 表示无法匹配）, [31:0] 地址
+    第一行是注释，testbench 据此区分文本和十六进制两种格式
+    """
+    header = '// routing_test hex records\n'
+    end = '%032x\n' % 0
+
+    @staticmethod
+    def insert(prefix: int, mask: int, nexthop: int, metric: int, from_vlan: int) -> str:
+        return '%032x\n' % (1 << 124 | from_vlan << 77 | metric << 72 | nexthop << 40 | mask << 32 | prefix)
+
+    @staticmethod
+    def query(addr: int, nexthop: int) -> str:
+        return '%032x\n' % (2 << 124 | nexthop << 40 | addr)
+
+
+def ip_str(value: int) -> str:
+    """
+    uint32 转为点分十进制（inet_ntoa 比 % 格式化快一倍）
+    """
+    return inet_ntoa(value.to_bytes(4, 'big'))
+
+
+class Bulk:
+    """
+    批量模式，不为每条路由创建 IPAddress 对象
+
+    已插入的条目按列保存在 array 中，生成的行攒够一块后直接写入文件，
+    插入、查询穿插的顺序也是边生成边抽取的，不需要保存整个操作序列
+    """
+    prefix = array('I')     # 已插入条目的地址
+    mask = array('B')       # 掩码长度
+    metric = array('B')     # RIP metric
+    from_vlan = array('B')  # 来源 vlan
+    nexthop = array('I')    # 下一跳
+    inserted = set()        # 已插入的 (地址 << 6 | 掩码长度)，用于查重
+    # 值为条目下标 + 1；两种模式不会同时使用，和 Entry 共用一张表
+    table = Entry.table
+
+    @staticmethod
+    def insert() -> str:
+        """
+        生成一条插入的数据，规则同 IPAddress.get_insert_addr
+        """
+        if IPAddress.synthesized:
+            value, mask = IPAddress.synthesized.pop()
+        else:
+            while True:
+                if Config.pressure:
+                    value = int(random.normalvariate(
+                        IPAddress.center, 0x800000)) & 0xffffffff
+                else:
+                    value = random.getrandbits(32)
+                mask = random.getrandbits(5)
+                value &= MASKS[mask]
+                if value != 0 and (value << 6 | mask) not in Bulk.inserted:
+                    break
+        # 这里不用 randint，它在百万次调用时是主要开销
+        metric = int(random.random() * 14) + 1
+        from_vlan = random.getrandbits(2) + 1
+        nexthop = random.getrandbits(32) % 0xffffffff + 1
+
+        Bulk.inserted.add(value << 6 | mask)
+        Bulk.prefix.append(value)
+        Bulk.mask.append(mask)
+        Bulk.metric.append(metric)
+        Bulk.from_vlan.append(from_vlan)
+        Bulk.nexthop.append(nexthop)
+        Bulk.table.insert(value, mask, len(Bulk.prefix))
+        if Config.hex:
+            return Hex.insert(value, mask, nexthop, metric, from_vlan)
+        return 'insert  %s/%d -> %s/32 (%d, %d)\n' % (ip_str(value), mask, ip_str(nexthop), metric, from_vlan)
+
+    @staticmethod
+    def query() -> str:
+        """
+        生成一条查询的数据，规则同 Entry.query
+        """
+        count = len(Bulk.prefix)
+        if random.random() < Config.miss_rate or count == 0:
+            addr = random.getrandbits(32) % 0xffffffff + 1
+        else:
+            if Entry.workload is not None:
+                index, host = Entry.workload.pick(count)
+                addr = Bulk.prefix[index] ^ (host & (0xffffffff >> Bulk.mask[index]))
+            else:
+                index = int(random.random() * count)
+                addr = 0
+            while addr == 0:
+                addr = Bulk.prefix[index] ^ (
+                    random.getrandbits(32) & (0xffffffff >> Bulk.mask[index]))
+        match = Bulk.table.lookup(addr)
+        if Config.hex:
+            return Hex.query(addr, Bulk.nexthop[match - 1] if match > 0 else 0)
+        if match > 0:
+            return 'query   %s/32 -> %s/32\n' % (ip_str(addr), ip_str(Bulk.nexthop[match - 1]))
+        else:
+            return 'query   %s/32 -> 0.0.0.0/32\n' % ip_str(addr)
+
+    @staticmethod
+    def generate(path: str):
+        """
+        生成全部操作，每 Config.chunk_lines 行写入一次文件
+        """
+        insert_left = Config.insertion_count
+        query_left = Config.query_count
+        lines = [Hex.header] if Config.hex else []
+        with open(path, 'w') as f:
+            while insert_left + query_left > 0:
+                if Config.order:
+                    is_insert = insert_left > 0
+                else:
+                    # 按剩余数量的比例抽取，等价于把整个操作序列打乱
+                    is_insert = random.random() * (insert_left + query_left) < insert_left
+                if is_insert:
+                    lines.append(Bulk.insert())
+                    insert_left -= 1
+                else:
+                    lines.append(Bulk.query())
+                    query_left -= 1
+                if len(lines) >= Config.chunk_lines:
+                    f.write(''.join(lines))
+                    lines.clear()
+            lines.append(Hex.end if Config.hex else 'end\n')
+            f.write(''.join(lines))
+
+
 def wrong_usage_exit():
     print('\033[31mInvalid arguments\033[0m')
     print(
@@ -216,7 +364,27 @@ def wrong_usage_exit():
         '-o | --order',
         '\tIf given, all queries will be ordered after insertions.',
         '-p | --pressure',
-        '\tIf given, inserted IP addresses will be condensed in a smaller range.', sep='\n')
+        '\tIf given, inserted IP addresses will be condensed in a smaller range.',
+        '-b | --bulk',
+        '\tIf given, entries are kept in packed arrays and written in chunks, for huge testcases.',
+        '-x | --hex',
+        '\tIf given, operations are written as fixed-width hex records for $readmemh.',
+        '--synthesize',
+        '\tIf given, inserted prefixes follow a real table\'s length distribution and are allocated hierarchically.',
+        '--lengths <length_file>',
+        '\tSpecify the length distribution of --synthesize, see routing_synthesize.py. Implies --synthesize.',
+        '--zipf <s>',
+        '\tIf given, queries pick inserted entries with Zipf exponent s instead of uniformly, earlier ones are hotter.',
+        '--drift <d>',
+        '\tSpecify how many entries the popularity ranking shifts every query. Default is %g.' % Config.drift,
+        '--flows <n>',
+        '\tIf given, queries belong to n concurrent flows, and a flow queries the same address until it ends.',
+        '--flow-length <l>',
+        '\tSpecify the mean number of queries of a flow. Default is %g.' % Config.flow_length,
+        '-s <seed>',
+        '\tSpecify the random seed, so that the testcase can be reproduced.',
+        '-f <output_file>',
+        '\tSpecify the output file. Default is ../routing_test.mem.', sep='\n')
     exit(0)
 
 
@@ -226,19 +394,32 @@ def parse_arguments() -> bool:
         # get path
         scripts_path = os.path.dirname(sys.argv[0])
         Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        Config.output = os.path.join(Config.path, 'routing_test.mem')
         # parse arguments
         for v in sys.argv[1:]:
             if state == '':
-                if v == '-i':
+                if v == '-s':
+                    state = 's'
+                elif v == '-f':
+                    state = 'f'
+                elif v == '-i':
                     state = 'i'
                 elif v == '-q':
                     state = 'q'
                 elif v == '-m':
                     state = 'm'
+                elif v == '--synthesize':
+                    Config.synthesize = True
+                elif v in ('--zipf', '--drift', '--flows', '--flow-length', '--lengths'):
+                    state = v
                 elif v == '-o' or v == '--order':
                     Config.order = True
                 elif v == '-p' or v == '--pressure':
                     Config.pressure = True
+                elif v == '-b' or v == '--bulk':
+                    Config.bulk = True
+                elif v == '-x' or v == '--hex':
+                    Config.hex = True
                 else:
                     return False
             elif state == 'i':
@@ -256,6 +437,34 @@ def parse_arguments() -> bool:
                 if not 0 <= Config.miss_rate <= 1:
                     return False
                 state = ''
+            elif state == '--lengths':
+                Config.lengths = v
+                Config.synthesize = True
+                state = ''
+            elif state == '--zipf':
+                Config.zipf = float(v)
+                if Config.zipf < 0:
+                    return False
+                state = ''
+            elif state == '--drift':
+                Config.drift = float(v)
+                state = ''
+            elif state == '--flows':
+                Config.flows = int(v)
+                if Config.flows < 0:
+                    return False
+                state = ''
+            elif state == '--flow-length':
+                Config.flow_length = float(v)
+                if Config.flow_length < 1:
+                    return False
+                state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'f':
+                Config.output = v
+                state = ''
         return state == ''
     except (ValueError):
         return False
@@ -267,21 +476,41 @@ if __name__ == '__main__':
 
     if not parse_arguments():
         wrong_usage_exit()
+    random.seed(Config.seed)
+    # center 在类定义时就取了随机数，设置种子后重新生成
+    IPAddress.center = random.randint(0, 0xffffffff)
+    if Config.synthesize:
+        try:
+            synthesizer = Synthesizer(load_lengths(Config.lengths) if Config.lengths else DEFAULT_LENGTHS, 16, 0.5)
+            synthesizer.generate(Config.insertion_count)
+        except (OSError, ValueError) as e:
+            print('\033[31m%s\033[0m' % e)
+            exit(1)
+        IPAddress.synthesized = synthesizer.shuffled()
+    workload = Workload(Config.zipf, Config.drift, Config.flows, Config.flow_length)
+    if workload.active:
+        Entry.workload = workload
+
+    if Config.bulk:
+        Bulk.generate(Config.output)
+        print('已生成测试样例，共 %d 条插入，%d 条查询' %
+              (Config.insertion_count, Config.query_count))
+        exit(0)
 
     operations = ['i'] * Config.insertion_count + ['q'] * Config.query_count
     if not Config.order:
         random.shuffle(operations)
 
-    output = ''
+    output = Hex.header if Config.hex else ''
     for op in operations:
         if op == 'i':
             output += Entry.insert()
         else:
             output += Entry.query()
 
-    output += 'end\n'
+    output += Hex.end if Config.hex else 'end\n'
 
     print('已生成测试样例，共 %d 条插入，%d 条查询' %
           (Config.insertion_count, Config.query_count))
 
-    open(os.path.join(Config.path, 'routing_test.mem'), 'w').write(output)
+    open(Config.output, 'w').write(output)
@@ -0,0 +1,192 @@
+"""
+在 routing_trie.NodePool 上重放路由表的插入、查询序列，估算节点用量和查询延迟
+
+输入默认为 ../routing_test.mem（routing_generate_testcase.py 的输出，文本或 -x 十六进制），
+也可以是 routing_compile.py 能读取的任意路由表；查询会和期望结果比对
+    query   10.1.2.3/32 -> 1.2.3.4/32
+
+输出:
+    分支 / nexthop 节点的用量峰值，以及能放下的最小 NODE_POOL_SIZE
+    给定 NODE_POOL_SIZE 下第一次溢出的位置（之后硬件会回绕覆盖已有节点，结果不再可信）
+    查询读取的节点数直方图，以及按 125M 时钟估算的查询延迟
+
+模型固定按 65536 个节点模拟，溢出之前的节点布局和任何更小的 NODE_POOL_SIZE 相同；
+模型本身也放不下时停止重放（之后的查询没有意义），只报告停止之前的部分
+"""
+from __future__ import annotations
+from typing import *
+from routing_trie import NodePool, query_cycles
+from routing_compile import read_testcase
+import random
+import sys
+import os
+
+
+class Config:
+    inputs = []             # files to replay, routing_test.mem if not given
+    node_pool_size = 32768  # NODE_POOL_SIZE of routing_table.sv
+    extra_queries = 0       # how many random queries to make after replaying
+    frequency = 125e6       # clock of routing_table.sv
+    path = ''               # (maybe) relative path to runtime_path directory
+
+# 模型的节点数，即 NODE_POOL_SIZE 的上限
+MODEL_POOL_SIZE = 65536
+
+
+class Stats:
+    inserts = 0             # 已重放的插入数
+    queries = 0             # 已重放的查询数
+    mismatches = 0          # 结果和期望不同的查询数
+    branch_peak = 0         # 分支节点用量峰值
+    nexthop_peak = 0        # nexthop 节点用量峰值
+    overflow_at = ''        # 第一次溢出的位置
+    stopped_at = ''         # 模型的节点池放不下时停止重放的位置
+    depth = {}              # 读取节点数 -> 查询次数
+    matched = 0             # 有匹配的查询数
+    cycles = 0              # 查询总周期数
+    max_cycles = 0          # 单次查询最大周期数
+
+    @staticmethod
+    def record_query(reads: int, matched: bool):
+        Stats.queries += 1
+        Stats.depth[reads] = Stats.depth.get(reads, 0) + 1
+        Stats.matched += matched
+        cycles = query_cycles(reads, matched)
+        Stats.cycles += cycles
+        Stats.max_cycles = max(Stats.max_cycles, cycles)
+
+
+def replay(pool: NodePool, path: str, routes: List[Tuple[int, int]]) -> bool:
+    """
+    重放一个文件，插入的 (prefix, mask) 记入 routes 供随机查询使用
+    模型的节点池放不下时返回 False
+    """
+    half = Config.node_pool_size >> 1
+    for i, route, query in read_testcase(path):
+        position = '%s:%d' % (path, i)
+        if route is None:
+            addr, expected = query
+            nexthop, reads = pool.lookup(addr)
+            Stats.record_query(reads, nexthop != 0)
+            if nexthop != expected:
+                Stats.mismatches += 1
+            continue
+        if pool.room == 0:
+            Stats.stopped_at = '%s (insert #%d)' % (position, Stats.inserts + 1)
+            return False
+        pool.insert(*route)
+        routes.append(route[:2])
+        Stats.inserts += 1
+        Stats.branch_peak = max(Stats.branch_peak, pool.branch_used)
+        Stats.nexthop_peak = max(Stats.nexthop_peak, pool.nexthop_used)
+        if not Stats.overflow_at and (Stats.branch_peak > half or Stats.nexthop_peak > half):
+            Stats.overflow_at = '%s (insert #%d)' % (position, Stats.inserts)
+    return True
+
+
+def random_queries(pool: NodePool, routes: List[Tuple[int, int]], count: int):
+    """
+    随机查询已插入的前缀，主机位随机
+    """
+    for _ in range(count):
+        prefix, mask = random.choice(routes)
+        addr = prefix | random.getrandbits(32) & (0xffffffff >> mask)
+        nexthop, reads = pool.lookup(addr)
+        Stats.record_query(reads, nexthop != 0)
+
+
+def report():
+    half = Config.node_pool_size >> 1
+    need = 4
+    while need >> 1 < max(Stats.branch_peak, Stats.nexthop_peak, 1):
+        need <<= 1
+    print('插入 %d 条，查询 %d 次（%d 次和期望不符）' %
+          (Stats.inserts, Stats.queries, Stats.mismatches))
+    print('分支节点 %d/%d，nexthop 节点 %d/%d，至少需要 NODE_POOL_SIZE %s %d' %
+          (Stats.branch_peak, half, Stats.nexthop_peak, half,
+           '>' if Stats.stopped_at else '=', MODEL_POOL_SIZE if Stats.stopped_at else need))
+    if Stats.overflow_at:
+        print('\033[31mNODE_POOL_SIZE = %d 时在 %s 溢出\033[0m' %
+              (Config.node_pool_size, Stats.overflow_at))
+    if Stats.stopped_at:
+        print('\033[31m模型的 %d 个节点已用完，在 %s 停止重放\033[0m' % (MODEL_POOL_SIZE, Stats.stopped_at))
+    if Stats.queries == 0:
+        return
+    print('读取节点数  查询次数')
+    for reads in sorted(Stats.depth):
+        count = Stats.depth[reads]
+        print('%10d  %8d  %6.2f%%  %s' % (reads, count, count * 100 / Stats.queries,
+                                         '#' * round(count * 50 / Stats.queries)))
+    period = 1e9 / Config.frequency
+    print('平均 %.1f 周期（%.1f ns），最坏 %d 周期（%.1f ns），%.2f M 次查询/秒' % (
+        Stats.cycles / Stats.queries, Stats.cycles / Stats.queries * period,
+        Stats.max_cycles, Stats.max_cycles * period,
+        Stats.queries / Stats.cycles * Config.frequency / 1e6))
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '<file> ...',
+        '\tTestcases or route lists to replay, in order. Default is ../routing_test.mem.',
+        '-n <node_pool_size>',
+        '\tSpecify NODE_POOL_SIZE to check for overflow. Default is %d.' % Config.node_pool_size,
+        '-q <query_count>',
+        '\tSpecify how many random queries to make after replaying. Default is %d.' % Config.extra_queries, sep='\n')
+    exit(0)
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        # get path
+        scripts_path = os.path.dirname(sys.argv[0])
+        Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        # parse arguments
+        for v in sys.argv[1:]:
+            if state == '':
+                if v == '-n':
+                    state = 'n'
+                elif v == '-q':
+                    state = 'q'
+                elif not v.startswith('-'):
+                    Config.inputs.append(v)
+                else:
+                    return False
+            elif state == 'n':
+                Config.node_pool_size = int(v)
+                if Config.node_pool_size & (Config.node_pool_size - 1) or not 4 <= Config.node_pool_size <= 65536:
+                    return False
+                state = ''
+            elif state == 'q':
+                Config.extra_queries = int(v)
+                if Config.extra_queries < 0:
+                    return False
+                state = ''
+        if not Config.inputs:
+            Config.inputs.append(os.path.join(Config.path, 'routing_test.mem'))
+        return state == ''
+    except (ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+
+    pool = NodePool(MODEL_POOL_SIZE)
+    routes = []
+    try:
+        for path in Config.inputs:
+            if not replay(pool, path, routes):
+                break
+        if routes:
+            random_queries(pool, routes, Config.extra_queries)
+    except (OSError, ValueError, RuntimeError) as e:
+        print('\033[31m%s\033[0m' % e)
+        report()
+        exit(1)
+    report()
+    if Stats.stopped_at:
+        exit(1)
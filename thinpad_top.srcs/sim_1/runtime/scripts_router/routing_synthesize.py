@@ -0,0 +1,265 @@
+"""
+合成接近真实路由表形状的前缀集合，用于在 routing_trie / routing_table 上测量节点用量和查询深度
+
+前缀长度按长度分布抽取，默认为公网 IPv4 路由表的大致形状（/24 约占六成，其次是 /22、/23、/21、/20），
+也可以用 -l 给出分布文件:
+    直方图      每行 "长度 权重"，# 之后为注释
+    路由表      routing_compile.py 能读取的任意格式，按其中各长度的条数作为权重
+
+地址按层次分配:
+    地址空间中随机选 -k 个 /8 作为簇（避开 0、127 和 224 以上），簇的大小按 Zipf 分布，前面的簇更大
+    前缀按长度从短到长生成；每个前缀以 -m 的概率作为更具体的前缀嵌套在一个已生成的更短的前缀中，
+    否则放在某个簇中的随机位置（比簇更短的前缀放在整个地址空间的随机位置）
+nexthop 从 -n 个邻居中选，metric 和 vlan 也固定属于邻居，和真实路由器学到的路由一样集中在少数几个出口
+
+输出为 routing_compile.py 的文本格式，按随机顺序排列，每行:
+    10.0.0.0/8 1.2.3.4 metric vlan
+可以直接交给 routing_compile.py 编译、routing_replay.py 统计节点用量和查询深度；
+routing_generate_testcase.py --synthesize 用同样的方法生成插入的前缀；和它一样不会生成 0.0.0.0 开头的前缀
+"""
+from __future__ import annotations
+from typing import *
+from array import array
+from itertools import accumulate
+from socket import inet_ntoa
+from lpm import MASKS
+from routing_compile import read_routes
+import random
+import sys
+import os
+
+
+class Config:
+    count = 100000          # how many prefixes to make
+    lengths = ''            # length distribution file, the built-in one if not given
+    clusters = 16           # how many /8 blocks the prefixes are clustered in
+    nested = 0.5            # the ratio of prefixes nested in a shorter one
+    neighbors = 8           # how many distinct nexthops
+    seed = None             # seed of random, for reproducing a prefix set
+    output = ''             # output file, ../routing_synthesize.txt if not given
+    path = ''               # (maybe) relative path to runtime_path directory
+
+
+# 公网 IPv4 路由表中各前缀长度的大致占比（%），没有列出的长度不会出现
+DEFAULT_LENGTHS = {
+    8: 0.002, 9: 0.002, 10: 0.004, 11: 0.01, 12: 0.03, 13: 0.06, 14: 0.12, 15: 0.2,
+    16: 1.5, 17: 0.9, 18: 1.6, 19: 2.6, 20: 4.1, 21: 4.9, 22: 11.5, 23: 11.0, 24: 61.5,
+}
+
+# 簇的前缀长度
+CLUSTER_MASK = 8
+
+
+def load_lengths(path: str) -> Dict[int, float]:
+    """
+    读取长度分布文件，不是直方图时按路由表统计各长度的条数
+    /0 被忽略：唯一的 /0 前缀是 0.0.0.0/0，而合成的前缀不会是 0.0.0.0
+    """
+    lengths = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            if len(fields) != 2 or '/' in fields[0] or '.' in fields[0]:
+                lengths = None
+                break
+            mask, weight = int(fields[0]), float(fields[1])
+            if not 0 <= mask <= 32 or weight < 0:
+                raise ValueError('%s: invalid length %s' % (path, line.strip()))
+            lengths[mask] = lengths.get(mask, 0) + weight
+    if lengths is None:
+        lengths = {}
+        for route in read_routes(path):
+            lengths[route[1]] = lengths.get(route[1], 0) + 1
+    lengths.pop(0, None)
+    if sum(lengths.values()) <= 0:
+        raise ValueError('%s: no prefix lengths' % path)
+    return lengths
+
+
+def choose_clusters(count: int) -> List[int]:
+    """
+    count 个不同的 /8，返回各自的前缀
+    """
+    candidates = [block for block in range(1, 224) if block != 127]
+    return [block << 24 for block in random.sample(candidates, min(count, len(candidates)))]
+
+
+class Synthesizer:
+    """
+    按长度分布和层次分配生成不重复的前缀，结果按列保存在 array 中
+    """
+
+    def __init__(self, lengths: Dict[int, float], clusters: int, nested: float):
+        self.lengths = lengths
+        self.nested = nested
+        self.clusters = choose_clusters(clusters)
+        # 第 i 个簇的权重为 1 / (i + 1)，这里是累计权重
+        self.cluster_weights = list(accumulate(1 / (i + 1) for i in range(len(self.clusters))))
+        self.prefix = array('I')
+        self.mask = array('B')
+        self.nested_count = 0   # 嵌套在更短前缀中的条数
+
+    def generate(self, count: int):
+        """
+        生成 count 个前缀；能放下的前缀不足时抛出 ValueError
+        """
+        masks, weights = zip(*sorted(self.lengths.items()))
+        drawn = sorted(random.choices(masks, weights, k=count))
+        # 每种长度最多有 2^mask 个前缀，不生成 0.0.0.0
+        capacity = {mask: (1 << mask) - 1 for mask in masks}
+        seen = set()
+        shorter = 0     # prefix 中 [0, shorter) 比当前长度短，可以作为嵌套的父前缀
+        for mask in drawn:
+            while shorter < len(self.mask) and self.mask[shorter] < mask:
+                shorter += 1
+            if capacity[mask] == 0:
+                raise ValueError('no more distinct /%d prefixes' % mask)
+            for _ in range(64):
+                if shorter > 0 and random.random() < self.nested:
+                    parent = int(random.random() * shorter)
+                    value = self.prefix[parent] | (random.getrandbits(32) & ~MASKS[self.mask[parent]])
+                    nested = True
+                elif mask >= CLUSTER_MASK:
+                    cluster = random.choices(self.clusters, cum_weights=self.cluster_weights)[0]
+                    value = cluster | (random.getrandbits(32) & ~MASKS[CLUSTER_MASK])
+                    nested = False
+                else:
+                    value = random.getrandbits(32)
+                    nested = False
+                value &= MASKS[mask]
+                if value != 0 and (value << 6 | mask) not in seen:
+                    break
+            else:
+                # 簇内或父前缀内已经很满，放到整个地址空间
+                value = random.getrandbits(32) & MASKS[mask]
+                nested = False
+                while value == 0 or (value << 6 | mask) in seen:
+                    value = random.getrandbits(32) & MASKS[mask]
+            seen.add(value << 6 | mask)
+            capacity[mask] -= 1
+            self.prefix.append(value)
+            self.mask.append(mask)
+            self.nested_count += nested
+
+    def shuffled(self) -> List[Tuple[int, int]]:
+        """
+        随机顺序的 (prefix, mask)
+        """
+        result = list(zip(self.prefix, self.mask))
+        random.shuffle(result)
+        return result
+
+
+def make_neighbors(count: int) -> List[Tuple[int, int, int]]:
+    """
+    count 个邻居的 (nexthop, metric, vlan)
+    """
+    return [(random.getrandbits(32) % 0xffffffff + 1, random.randint(1, 14), random.randint(1, 4))
+            for _ in range(count)]
+
+
+def write_routes(path: str, prefixes: List[Tuple[int, int]], neighbors: List[Tuple[int, int, int]]):
+    lines = []
+    with open(path, 'w') as f:
+        for prefix, mask in prefixes:
+            nexthop, metric, vlan = random.choice(neighbors)
+            lines.append('%s/%d %s %d %d\n' % (
+                inet_ntoa(prefix.to_bytes(4, 'big')), mask, inet_ntoa(nexthop.to_bytes(4, 'big')), metric, vlan))
+            if len(lines) >= 65536:
+                f.write(''.join(lines))
+                lines.clear()
+        f.write(''.join(lines))
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '-c <count>',
+        '\tSpecify how many prefixes to make. Default is %d.' % Config.count,
+        '-l <length_file>',
+        '\tSpecify the prefix length distribution, a "length weight" histogram or a route list. Default is a public IPv4 table.',
+        '-k <clusters>',
+        '\tSpecify how many /8 blocks the prefixes are clustered in. Default is %d.' % Config.clusters,
+        '-m <nested_ratio>',
+        '\tSpecify the ratio of prefixes nested in a shorter one. Default is %.2f.' % Config.nested,
+        '-n <neighbors>',
+        '\tSpecify how many distinct nexthops. Default is %d.' % Config.neighbors,
+        '-s <seed>',
+        '\tSpecify the random seed, so that the prefix set can be reproduced.',
+        '-f <output_file>',
+        '\tSpecify the output file. Default is ../routing_synthesize.txt.', sep='\n')
+    exit(0)
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        # get path
+        scripts_path = os.path.dirname(sys.argv[0])
+        Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        Config.output = os.path.join(Config.path, 'routing_synthesize.txt')
+        # parse arguments
+        for v in sys.argv[1:]:
+            if state == '':
+                if v in ('-c', '-l', '-k', '-m', '-n', '-s', '-f'):
+                    state = v[1]
+                else:
+                    return False
+            elif state == 'c':
+                Config.count = int(v)
+                if Config.count < 0:
+                    return False
+                state = ''
+            elif state == 'l':
+                Config.lengths = v
+                state = ''
+            elif state == 'k':
+                Config.clusters = int(v)
+                if Config.clusters <= 0:
+                    return False
+                state = ''
+            elif state == 'm':
+                Config.nested = float(v)
+                if not 0 <= Config.nested <= 1:
+                    return False
+                state = ''
+            elif state == 'n':
+                Config.neighbors = int(v)
+                if Config.neighbors <= 0:
+                    return False
+                state = ''
+            elif state == 's':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'f':
+                Config.output = v
+                state = ''
+        return state == ''
+    except (ValueError):
+        return False
+
+
+if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+    random.seed(Config.seed)
+
+    try:
+        lengths = load_lengths(Config.lengths) if Config.lengths else DEFAULT_LENGTHS
+        synthesizer = Synthesizer(lengths, Config.clusters, Config.nested)
+        synthesizer.generate(Config.count)
+    except (OSError, ValueError) as e:
+        print('\033[31m%s\033[0m' % e)
+        exit(1)
+
+    write_routes(Config.output, synthesizer.shuffled(), make_neighbors(Config.neighbors))
+    histogram = {}
+    for mask in synthesizer.mask:
+        histogram[mask] = histogram.get(mask, 0) + 1
+    print('已生成 %d 个前缀，其中 %d 个嵌套在更短的前缀中' % (Config.count, synthesizer.nested_count))
+    print('长度  条数')
+    for mask in sorted(histogram):
+        print('%4d  %8d  %6.2f%%' % (mask, histogram[mask], histogram[mask] * 100 / max(1, Config.count)))
@@ -0,0 +1,438 @@
+"""
+routing_table.sv 节点池的 Python 模型
+
+节点为 72 位，布局和 routing_table.sv 中的 node_t 一致:
+    branch_t    is_nexthop(0) is_prefix mask[5:0] prefix[31:0] next0[15:0] next1[15:0]
+    nexthop_t   is_nexthop(1) port[1:0] metric[4:0] nexthop[31:0] update_time[15:0] parent[15:0]
+指针最高位为 1 的指向 nexthop 区，BRAM 地址为 {ptr[15], ptr[$clog2(NODE_POOL_SIZE)-2:0]}
+
+insert 按 ModeInsert 状态机逐个分支翻译（包括 insert_pointer_buffer 沿用上一次的值等细节），
+同样的插入序列得到的节点池和硬件逐位相同
+"""
+from __future__ import annotations
+from typing import *
+from lpm import MASKS
+import re
+
+
+class Branch:
+    __slots__ = ('is_prefix', 'mask', 'prefix', 'next0', 'next1')
+
+    def __init__(self, is_prefix: int, mask: int, prefix: int, next0: int, next1: int):
+        self.is_prefix = is_prefix
+        self.mask = mask
+        self.prefix = prefix
+        self.next0 = next0
+        self.next1 = next1
+
+    def pack(self) -> int:
+        return self.is_prefix << 70 | self.mask << 64 | self.prefix << 32 | self.next0 << 16 | self.next1
+
+    def __str__(self):
+        return '%s %08x/%d next0=%04x next1=%04x' % (
+            'prefix' if self.is_prefix else 'branch', self.prefix, self.mask, self.next0, self.next1)
+
+
+class Nexthop:
+    __slots__ = ('port', 'metric', 'nexthop', 'update_time', 'parent')
+
+    def __init__(self, port: int, metric: int, nexthop: int, update_time: int, parent: int):
+        self.port = port
+        self.metric = metric
+        self.nexthop = nexthop
+        self.update_time = update_time
+        self.parent = parent
+
+    def pack(self) -> int:
+        return 1 << 71 | self.port << 69 | self.metric << 64 | self.nexthop << 32 | self.update_time << 16 | self.parent
+
+    def __str__(self):
+        return 'nexthop %08x port=%d metric=%d time=%d parent=%04x' % (
+            self.nexthop, self.port, self.metric, self.update_time, self.parent)
+
+
+def unpack(value: int) -> Union[Branch, Nexthop]:
+    """
+    按 is_nexthop 位解析一个 72 位节点（和硬件一样，不看节点所在的区域）
+    """
+    if value >> 71:
+        return Nexthop((value >> 69) & 3, (value >> 64) & 0x1f, (value >> 32) & 0xffffffff,
+                       (value >> 16) & 0xffff, value & 0xffff)
+    return Branch((value >> 70) & 1, (value >> 64) & 0x3f, (value >> 32) & 0xffffffff,
+                  (value >> 16) & 0xffff, value & 0xffff)
+
+
+def query_cycles(reads: int, matched: bool) -> int:
+    """
+    估算一次查询从 query_valid 到 query_ready 的周期数
+    根节点在 ModeIdle 时已经读出；之后每读一个节点要 2 个周期
+    （memory_addr 打一拍，BRAM 读延迟一拍），有匹配时再读一次叶子节点，
+    加上 ModeIdle 接受查询和置 query_ready 各 1 个周期
+    """
+    return 2 * reads + 2 * matched + 1
+
+
+HEADER_DEFINE = re.compile(r'`define\s+ROUTING_(BRANCH|NEXTHOP)_WRITE_ADDR\s+16\'h([0-9a-fA-F]+)')
+
+
+def read_header(path: str) -> Tuple[int, int]:
+    """
+    从 routing_memory.vh 中读取两个写指针的复位值
+    """
+    pointers = {}
+    for line in open(path):
+        match = HEADER_DEFINE.match(line.strip())
+        if match is not None:
+            pointers[match.group(1)] = int(match.group(2), 16)
+    if len(pointers) != 2:
+        raise ValueError('%s: missing ROUTING_BRANCH_WRITE_ADDR or ROUTING_NEXTHOP_WRITE_ADDR' % path)
+    return pointers['BRANCH'], pointers['NEXTHOP']
+
+
+def leading0(value: int) -> int:
+    """
+    32 位数的前导 0 个数，同 Common::leading0
+    """
+    return 32 - value.bit_length()
+
+
+class NodePool:
+    def __init__(self, size: int = 32768):
+        """
+        空的节点池：根节点是 mask 为 0、两个分支都不存在的分叉节点
+        size 即 NODE_POOL_SIZE，两个区各占一半
+        """
+        if size & (size - 1) or not 4 <= size <= 65536:
+            raise ValueError('NODE_POOL_SIZE must be a power of 2 in [4, 65536]')
+        self.size = size
+        self.half = size >> 1
+        self.memory = [0] * size
+        self.memory[0] = Branch(0, 0, 0, 0x8000, 0x8000).pack()
+        self.branch_write_addr = 0x0001
+        self.nexthop_write_addr = 0x8000
+        self.insert_pointer_buffer = 0
+
+    @staticmethod
+    def direct(size: int = 32768) -> NodePool:
+        """
+        仓库中 routing_memory.mem 的初始内容：直连的 192.168.0.0/24 ~ 192.168.3.0/24，
+        nexthop 为 0，metric 为 1（存储值，即 RIP 中的 0），来自端口 0
+        这几个节点是手工排布的（根节点就是 192.168.0.0/22），不能由 insert 得到
+        """
+        pool = NodePool(size)
+        pool.write(0, Branch(0, 22, 0xc0a80000, 0x0001, 0x0002))
+        pool.write(1, Branch(0, 23, 0xc0a80000, 0x0003, 0x0004))
+        pool.write(2, Branch(0, 23, 0xc0a80200, 0x0005, 0x0006))
+        for i in range(4):
+            pool.write(3 + i, Branch(1, 24, 0xc0a80000 | i << 8, 0x8000 | i, 0x8000))
+            pool.write(0x8000 | i, Nexthop(0, 1, 0, 0, 3 + i))
+        pool.branch_write_addr = 0x0007
+        pool.nexthop_write_addr = 0x8004
+        return pool
+
+    @staticmethod
+    def load(path: str, size: int = 32768, header: str = '') -> NodePool:
+        """
+        读取一个 $readmemh 格式的镜像（如 routing_memory.mem）
+        两个写指针从 header（和镜像一起生成的 routing_memory.vh）中读取；
+        没有给出时取各区最后一个非零节点之后，删除过路由的镜像中可能留有旧节点，这时并不准确
+        """
+        pool = NodePool(size)
+        pool.memory = [0] * size
+        index = 0
+        for line in open(path):
+            line = line.split('//')[0].strip()
+            if line == '':
+                continue
+            if line.startswith('@'):
+                index = int(line[1:], 16)
+                continue
+            pool.memory[index] = int(line, 16)
+            index += 1
+        if header:
+            pool.branch_write_addr, pool.nexthop_write_addr = read_header(header)
+        else:
+            pool.branch_write_addr = pool._used(0)
+            pool.nexthop_write_addr = 0x8000 | pool._used(pool.half)
+        return pool
+
+    def _used(self, base: int) -> int:
+        """
+        [base, base + half) 中最后一个非零节点之后的下标
+        """
+        for i in range(self.half - 1, -1, -1):
+            if self.memory[base + i]:
+                return i + 1
+        return 0
+
+    def _index(self, ptr: int) -> int:
+        return (ptr >> 15) * self.half + (ptr & (self.half - 1))
+
+    def read(self, ptr: int) -> Union[Branch, Nexthop]:
+        return unpack(self.memory[self._index(ptr)])
+
+    def write(self, ptr: int, node: Union[Branch, Nexthop]):
+        self.memory[self._index(ptr)] = node.pack()
+
+    @property
+    def branch_used(self) -> int:
+        return self.branch_write_addr
+
+    @property
+    def nexthop_used(self) -> int:
+        return self.nexthop_write_addr & 0x7fff
+
+    @property
+    def room(self) -> int:
+        """
+        至少还能插入多少条路由（一次插入至多占用 2 个分支节点和 1 个 nexthop 节点）
+        """
+        return max(0, min((self.half - self.branch_used) // 2, self.half - self.nexthop_used))
+
+    @property
+    def overflow(self) -> bool:
+        """
+        是否有节点写到了区域之外（硬件上会回绕覆盖已有节点）
+        """
+        return self.branch_used > self.half or self.nexthop_used > self.half
+
+    def _branch(self, ptr: int) -> Branch:
+        node = self.read(ptr)
+        if isinstance(node, Nexthop):
+            # 硬件会在等待分支节点的状态中卡住
+            raise RuntimeError('expected a branch node at %04x' % ptr)
+        return node
+
+    def _nexthop(self, ptr: int) -> Nexthop:
+        node = self.read(ptr)
+        if isinstance(node, Branch):
+            raise RuntimeError('expected a nexthop node at %04x' % ptr)
+        return node
+
+    def _move_node(self, addr: int, node: Branch):
+        # `Move_Node
+        self.insert_pointer_buffer = addr
+        self.write(self.branch_write_addr, node)
+
+    def _situation1(self, shared: int):
+        node = self._branch(self.insert_pointer_buffer)
+        node.is_prefix = 1
+        node.mask = shared
+        node.next0 = self.nexthop_write_addr
+        node.next1 = self.branch_write_addr
+        self.write(self.insert_pointer_buffer, node)
+        self.branch_write_addr = (self.branch_write_addr + 1) & 0xffff
+
+    def _situation2(self, prefix: int, mask: int):
+        self.write(self.branch_write_addr,
+                   Branch(1, mask, prefix, self.nexthop_write_addr, 0x8000))
+        self.insert_pointer_buffer = self.branch_write_addr
+        self.branch_write_addr = (self.branch_write_addr + 1) & 0xffff
+
+    def _situation3(self, prefix: int, shared: int):
+        moved = self.branch_write_addr
+        other = (moved + 1) & 0xffff
+        if (prefix >> (31 - shared)) & 1:
+            node = Branch(0, shared, prefix, moved, other)
+        else:
+            node = Branch(0, shared, prefix, other, moved)
+        self.write(self.insert_pointer_buffer, node)
+        self.branch_write_addr = other
+
+    def _set_parent(self, ptr: int, parent: int):
+        # InsertSituationPre1 / InsertSituationPre3
+        leaf = self._nexthop(ptr)
+        leaf.parent = parent
+        self.write(ptr, leaf)
+
+    def _new_nexthop(self, nexthop: int, metric: int, port: int, second: int):
+        self.write(self.nexthop_write_addr, Nexthop(
+            port, (metric + 1) & 0x1f, nexthop, second, self.insert_pointer_buffer))
+        self.nexthop_write_addr = (self.nexthop_write_addr + 1) & 0xffff
+
+    def _edit_nexthop(self, ptr: int, nexthop: int, metric: int, port: int, second: int):
+        leaf = self._nexthop(ptr)
+        if metric & 0x10:
+            if leaf.port != port:
+                # poison reverse，忽略
+                return
+            # 删除，最后一个 nexthop 节点移到空出来的位置
+            last = ptr + 1 == self.nexthop_write_addr
+            self.nexthop_write_addr = (self.nexthop_write_addr - 1) & 0xffff
+            self.insert_pointer_buffer = ptr
+            parent = self._branch(leaf.parent)
+            parent.next0 &= 0x7fff
+            self.write(leaf.parent, parent)
+            if not last:
+                moved = self._nexthop(self.nexthop_write_addr)
+                self.write(ptr, moved)
+                parent = self._branch(moved.parent)
+                parent.next0 = ptr
+                self.write(moved.parent, parent)
+        elif metric + 1 < leaf.metric:
+            self.write(ptr, Nexthop(port, metric + 1, nexthop, second, leaf.parent))
+
+    def insert(self, prefix: int, mask: int, nexthop: int, metric: int, from_vlan: int, second: int = 0):
+        """
+        插入一条 routing_entry_t，等价于 ModeIdle 取出该条目后 ModeInsert 的全部写操作
+        metric >= 16 表示删除（只有来源端口相同时才真的删除）
+        """
+        prefix &= 0xffffffff
+        mask &= 0x3f
+        metric &= 0x1f
+        port = from_vlan & 3
+        second &= 0xffff
+        if mask == 0 or metric == 0:
+            return
+        invalid = metric & 0x10
+        addr = 0
+        for _ in range(self.half):
+            node = self._branch(addr)
+            shared = min(leading0(prefix ^ node.prefix), mask)
+            if node.is_prefix:
+                if shared < node.mask:
+                    if invalid:
+                        return
+                    if shared == mask:
+                        if not node.next0 & 0x8000:
+                            node.mask = mask
+                            node.next0 = self.nexthop_write_addr
+                            self.write(addr, node)
+                            self.insert_pointer_buffer = addr
+                        else:
+                            self._move_node(addr, node)
+                            self._set_parent(node.next0, self.branch_write_addr)
+                            self._situation1(shared)
+                    else:
+                        self._move_node(addr, node)
+                        if node.next0 & 0x8000:
+                            self._set_parent(node.next0, self.branch_write_addr)
+                        self._situation3(prefix, shared)
+                        self._situation2(prefix, mask)
+                    self._new_nexthop(nexthop, metric, port, second)
+                    return
+                if shared == node.mask == mask:
+                    if node.next0 & 0x8000:
+                        self._edit_nexthop(node.next0, nexthop, metric, port, second)
+                        return
+                    if invalid:
+                        return
+                    # 这里硬件没有更新 insert_pointer_buffer，新叶子的 parent 沿用上一次的值
+                    node.next0 = self.nexthop_write_addr
+                    self.write(addr, node)
+                    self._new_nexthop(nexthop, metric, port, second)
+                    return
+                if not node.next1 & 0x8000:
+                    addr = node.next1
+                    continue
+                if invalid:
+                    return
+                node.next1 = self.branch_write_addr
+                self.write(addr, node)
+                self._situation2(prefix, mask)
+                self._new_nexthop(nexthop, metric, port, second)
+                return
+            else:
+                if shared < node.mask or shared == node.mask == mask:
+                    if invalid:
+                        return
+                    self._move_node(addr, node)
+                    if shared == mask:
+                        self._situation1(shared)
+                    else:
+                        self._situation3(prefix, shared)
+                        self._situation2(prefix, mask)
+                    self._new_nexthop(nexthop, metric, port, second)
+                    return
+                if (prefix >> (31 - node.mask)) & 1:
+                    child = node.next1
+                else:
+                    child = node.next0
+                if not child & 0x8000:
+                    addr = child
+                    continue
+                if invalid:
+                    return
+                if (prefix >> (31 - node.mask)) & 1:
+                    node.next1 = self.branch_write_addr
+                else:
+                    node.next0 = self.branch_write_addr
+                self.write(addr, node)
+                self._situation2(prefix, mask)
+                self._new_nexthop(nexthop, metric, port, second)
+                return
+        raise RuntimeError('loop in the trie at %04x' % addr)
+
+    def lookup(self, addr: int) -> Tuple[int, int]:
+        """
+        按 ModeQuery 的逻辑查询，返回 (nexthop, 读取的分支节点数)，nexthop 为 0 表示无匹配
+        """
+        best_match = 0
+        ptr = 0
+        reads = 0
+        while True:
+            node = self._branch(ptr)
+            reads += 1
+            if reads > self.half:
+                raise RuntimeError('loop in the trie at %04x' % ptr)
+            if (addr ^ node.prefix) & MASKS[node.mask]:
+                break
+            if node.is_prefix:
+                if node.next0 & 0x8000:
+                    best_match = node.next0
+                if node.next1 & 0x8000:
+                    break
+                ptr = node.next1
+            else:
+                child = node.next1 if (addr >> (31 - node.mask)) & 1 else node.next0
+                if child & 0x8000:
+                    break
+                ptr = child
+        if best_match & 0x8000:
+            return self._nexthop(best_match).nexthop, reads
+        return 0, reads
+
+    def query(self, addr: int) -> int:
+        """
+        按 ModeQuery 的逻辑查询，返回 nexthop，0 表示无匹配
+        """
+        return self.lookup(addr)[0]
+
+    def save(self, path: str):
+        """
+        写出 $readmemh 格式的镜像：分支区全部写出，nexthop 区只写到 nexthop_write_addr 之前
+        """
+        lines = ['%018X\n' % value for value in self.memory[:self.half]]
+        lines += ['%018X\n' % value for value in
+                  self.memory[self.half:self.half + min(self.nexthop_used, self.half)]]
+        open(path, 'w').write(''.join(lines))
+
+    @staticmethod
+    def _test():
+        # 和 lpm.LpmTable 对比查询结果
+        import random
+        from lpm import LpmTable
+        pool = NodePool()
+        table = LpmTable()
+        routes = {}
+        for i in range(3000):
+            mask = random.randint(1, 32)
+            prefix = random.getrandbits(32) & MASKS[mask]
+            if (prefix, mask) in routes:
+                continue
+            nexthop = random.getrandbits(32) | 1
+            routes[prefix, mask] = nexthop
+            pool.insert(prefix, mask, nexthop, random.randint(1, 15), random.randint(0, 3))
+        nexthops = [0]
+        for (prefix, mask), nexthop in routes.items():
+            nexthops.append(nexthop)
+            table.insert(prefix, mask, len(nexthops) - 1)
+        addrs = [random.getrandbits(32) for _ in range(5000)] + \
+            [prefix | random.getrandbits(32) & ~MASKS[mask] & 0xffffffff for prefix, mask in routes]
+        for addr in addrs:
+            assert pool.query(addr) == nexthops[table.lookup(addr)], hex(addr)
+        print('ok: %d branch nodes, %d nexthop nodes' % (pool.branch_used, pool.nexthop_used))
+
+
+if __name__ == '__main__':
+    NodePool._test()
@@ -1,18 +1,186 @@
 """
-执行目录下所有脚本
+并行执行目录下所有测例生成脚本
+
+每个脚本的种子由 --seed 给出的主种子派生，同一个主种子总是生成同样的测例；
+不给 --seed 时随机选一个并打印出来，用于复现出错的回归测试
+
+eth_frame 测例中每帧各自独立，条数较多时拆成若干分片并行生成，再按顺序拼接成一个文件；
+路由表、ARP 表、io_manager 测例的期望结果依赖之前学到的所有路由和 ARP 条目，不能拆分
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import hashlib
+import random
 import sys
 import os
 
+
+class Config:
+    seed = None             # master seed, random if not given
+    jobs = os.cpu_count()   # how many generators to run at the same time
+    count = None            # overrides -c of the eth_frame / io_manager generators
+    shard_size = 20000      # at least how many frames in one shard
+    path = ''               # (maybe) relative path to runtime_path directory
+
+
+# 可以拆分的脚本 -> (默认条数, 输出文件)
+SHARDABLE = {
+    'eth_frame_generate_testcase.py': (128, 'eth_frame_test.mem'),
+}
+# 接受 -c 但不能拆分的帧测例脚本
+COUNTED = {
+    'io_manager_generate_testcase.py',
+}
+
+
+def derive_seed(name: str, shard: int) -> int:
+    """
+    由主种子、脚本名和分片编号派生种子（不用 hash()，它在每次运行时不同）
+    """
+    digest = hashlib.sha256(('%d/%s/%d' % (Config.seed, name, shard)).encode()).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def run(command: list) -> str:
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError('%s\n%s' % (' '.join(command), result.stdout.decode()))
+    return result.stdout.decode()
+
+
+def concat(parts: list, path: str):
+    """
+    按顺序拼接分片并删除
+    """
+    with open(path, 'wb') as output:
+        for part in parts:
+            with open(part, 'rb') as f:
+                while True:
+                    block = f.read(1 << 20)
+                    if not block:
+                        break
+                    output.write(block)
+            os.remove(part)
+
+
+def wrong_usage_exit():
+    print('\033[31mInvalid arguments\033[0m')
+    print(
+        'Arguments:',
+        '--seed <seed>',
+        '\tSpecify the master seed. Default is a random one, which will be printed.',
+        '-j <jobs>',
+        '\tSpecify how many generators to run at the same time. Default is %d.' % Config.jobs,
+        '-c <count>',
+        '\tSpecify how many frames the eth_frame / io_manager generators make.',
+        '--shard <shard_size>',
+        '\tSpecify at least how many frames to make in one shard. Default is %d.' % Config.shard_size, sep='\n')
+    exit(0)
+
+
+def parse_arguments() -> bool:
+    state = ''
+    try:
+        # get path
+        scripts_path = os.path.dirname(os.path.abspath(__file__))
+        Config.path = os.path.normpath(os.path.join(scripts_path, '..'))
+        # parse arguments
+        for v in sys.argv[1:]:
+            if state == '':
+                if v == '--seed':
+                    state = 'seed'
+                elif v == '-j':
+                    state = 'j'
+                elif v == '-c':
+                    state = 'c'
+                elif v == '--shard':
+                    state = 'shard'
+                else:
+                    return False
+            elif state == 'seed':
+                Config.seed = int(v)
+                state = ''
+            elif state == 'j':
+                Config.jobs = int(v)
+                if Config.jobs <= 0:
+                    return False
+                state = ''
+            elif state == 'c':
+                Config.count = int(v)
+                if Config.count < 0:
+                    return False
+                state = ''
+            elif state == 'shard':
+                Config.shard_size = int(v)
+                if Config.shard_size <= 0:
+                    return False
+                state = ''
+        return state == ''
+    except (ValueError):
+        return False
+
+
 if __name__ == '__main__':
+    if not parse_arguments():
+        wrong_usage_exit()
+    if Config.seed is None:
+        Config.seed = random.getrandbits(32)
+    print('seed: %d' % Config.seed)
+
     # locate this script
     directory = os.path.dirname(os.path.abspath(__file__))
-    for filename in os.listdir(directory):
-        path = os.path.join(directory, filename)
-        if os.path.samefile(path, sys.argv[0]):
+    # 目录下其他脚本是生成器共用的模块或独立工具
+    names = sorted(filename for filename in os.listdir(directory)
+                   if filename.endswith('_generate_testcase.py'))
+
+    # 任务为一组命令，(输出文件, 分片列表) 为需要拼接的输出
+    commands = []
+    merges = []
+    for name in names:
+        command = [sys.executable, os.path.join(directory, name)]
+        if name not in SHARDABLE:
+            command += ['-s', str(derive_seed(name, 0))]
+            if name in COUNTED and Config.count is not None:
+                command += ['-c', str(Config.count)]
+            commands.append(command)
             continue
-        if filename[-3:] == '.py':
-            command = 'python3 ' + path
-            print(command)
-            os.system(command)
+        default_count, output = SHARDABLE[name]
+        count = default_count if Config.count is None else Config.count
+        # 分片数只取决于条数，和 -j 无关，保证同一个种子在任何机器上结果相同
+        shards = max(1, count // Config.shard_size)
+        output = os.path.join(Config.path, output)
+        parts = []
+        for shard in range(shards):
+            # 条数尽量平均分
+            shard_count = count // shards + (shard < count % shards)
+            part = output if shards == 1 else '%s.%d' % (output, shard)
+            parts.append(part)
+            commands.append(command + ['-s', str(derive_seed(name, shard)),
+                                       '-c', str(shard_count), '-f', part])
+        if shards > 1:
+            merges.append((output, parts))
+
+    failed = False
+    try:
+        with ThreadPoolExecutor(Config.jobs) as pool:
+            futures = [(command, pool.submit(run, command)) for command in commands]
+            for command, future in futures:
+                print(' '.join(command[1:]))
+                try:
+                    print(future.result(), end='')
+                except RuntimeError as e:
+                    print('\033[31m%s\033[0m' % e)
+                    failed = True
+        if failed:
+            exit(1)
+
+        for output, parts in merges:
+            concat(parts, output)
+            print('已拼接 %d 个分片到 %s' % (len(parts), output))
+    finally:
+        # 出错或中断时不在输出旁边留下分片（拼接成功的分片已经删除）
+        for output, parts in merges:
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
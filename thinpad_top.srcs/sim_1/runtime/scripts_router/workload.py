@@ -0,0 +1,133 @@
+"""
+查询目标的分布，供 routing_generate_testcase.py 和 arp_generate_testcase.py 生成接近真实流量的查询
+
+默认每次查询从已插入的条目中均匀选一个；给出以下参数时改为:
+    zipf        第 k 热门的条目被选中的概率正比于 1 / k^s，s 越大越集中
+                热门程度按插入顺序排，先插入的最热门（插入的地址本身是随机的，所以和地址无关）
+    drift       热门程度每次查询平移 drift 个条目，即热门的工作集随时间缓慢漂移
+    flows       同时有若干条流，每次查询属于随机一条；一条流平均持续 flow_length 次查询，
+                期间查询同一个目标地址，结束后换一个按上面的分布选出的新目标
+每次选择只用 O(1) 的计算，不需要按条目数建表，所以插入和查询穿插、条目数不断变化时也可以直接使用；
+Zipf 用 rejection-inversion 采样（Hörmann & Derflinger 1996），是精确的离散分布
+
+选择结果为 (条目下标, host)，host 为 32 位数，生成脚本用它填充地址中掩码以外的位；
+每个条目下只有 HOSTS 个固定的 host，同样按 zipf（没有给出时均匀）选择，
+所以热门的不只是前缀，目标地址本身也会重复出现，和真实流量一样能体现目标地址缓存的效果；
+同一条流的查询返回相同的 host，因此查询的是同一个地址
+"""
+from __future__ import annotations
+from typing import *
+import math
+import random
+
+# 每个条目下的 host 数
+HOSTS = 16
+
+
+def _log1p_over(x: float) -> float:
+    """
+    log(1 + x) / x，x 接近 0 时取极限 1
+    """
+    return math.log1p(x) / x if abs(x) > 1e-8 else 1 - x / 2
+
+
+def _expm1_over(x: float) -> float:
+    """
+    (exp(x) - 1) / x，x 接近 0 时取极限 1
+    """
+    return math.expm1(x) / x if abs(x) > 1e-8 else 1 + x / 2
+
+
+class Zipf:
+    """
+    1..n 上指数为 s 的 Zipf 分布，n 可以每次采样时不同
+    """
+
+    def __init__(self, s: float):
+        self.s = s
+        self.n = 0
+        self.h_integral_x1 = self._h_integral(1.5) - 1
+        self.s_const = 2 - self._h_integral_inverse(self._h_integral(2.5) - self._h(2))
+
+    def _h(self, x: float) -> float:
+        return math.exp(-self.s * math.log(x))
+
+    def _h_integral(self, x: float) -> float:
+        log_x = math.log(x)
+        return _expm1_over((1 - self.s) * log_x) * log_x
+
+    def _h_integral_inverse(self, x: float) -> float:
+        t = max(-1.0, x * (1 - self.s))
+        return math.exp(_log1p_over(t) * x)
+
+    def sample(self, n: int) -> int:
+        """
+        返回 [1, n] 中的一个数
+        """
+        if n != self.n:
+            self.n = n
+            self.h_integral_n = self._h_integral(n + 0.5)
+        while True:
+            u = self.h_integral_n + random.random() * (self.h_integral_x1 - self.h_integral_n)
+            x = self._h_integral_inverse(u)
+            k = min(max(int(x + 0.5), 1), n)
+            if k - x <= self.s_const or u >= self._h_integral(k + 0.5) - self._h(k):
+                return k
+
+
+def _mix(index: int, rank: int) -> int:
+    """
+    条目下标和 host 的排名映射到一个固定的 32 位 host（murmur3 的 fmix32），低位也足够分散
+    """
+    x = (index * HOSTS + rank) & 0xffffffff
+    x ^= x >> 16
+    x = (x * 0x85ebca6b) & 0xffffffff
+    x ^= x >> 13
+    x = (x * 0xc2b2ae35) & 0xffffffff
+    x ^= x >> 16
+    return x
+
+
+class Workload:
+    def __init__(self, zipf: float = 0, drift: float = 0, flows: int = 0, flow_length: float = 1):
+        self.zipf = Zipf(zipf) if zipf > 0 else None
+        self.drift = drift
+        self.flows = [None] * flows     # 每条流为 (条目下标, host)，None 表示还没有开始
+        self.flow_end = 1 / max(1.0, flow_length)
+        self.count = 0                  # 已经选择的次数，用于计算漂移
+
+    @property
+    def active(self) -> bool:
+        """
+        是否和默认的均匀选择不同
+        """
+        return self.zipf is not None or self.drift != 0 or len(self.flows) > 0
+
+    def _target(self, n: int) -> int:
+        if self.zipf is not None:
+            rank = self.zipf.sample(n) - 1
+        else:
+            rank = int(random.random() * n)
+        return (rank + int(self.count * self.drift)) % n
+
+    def _host(self, index: int) -> int:
+        if self.zipf is not None:
+            rank = self.zipf.sample(HOSTS) - 1
+        else:
+            rank = int(random.random() * HOSTS)
+        return _mix(index, rank)
+
+    def pick(self, n: int) -> Tuple[int, int]:
+        """
+        从 n 个条目中选择一个，返回 (条目下标, host)，n 不能为 0
+        """
+        self.count += 1
+        if len(self.flows) == 0:
+            index = self._target(n)
+            return index, self._host(index)
+        slot = int(random.random() * len(self.flows))
+        flow = self.flows[slot]
+        if flow is None or random.random() < self.flow_end:
+            index = self._target(n)
+            flow = self.flows[slot] = (index, self._host(index))
+        return flow
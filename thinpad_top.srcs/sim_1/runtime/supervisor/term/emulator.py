@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- encoding=utf-8 -*-
+
+# Stand-in for a board running the supervisor kernel, for testing and
+# benchmarking term.py without hardware
+#
+# It speaks the protocol of kern/shell.S over TCP (one board per port) or a pty:
+#   welcome  the 33-byte version string, on every TCP connection, or once
+#            when the pty is created as the real board does after reset
+#   R        the 30 user registers saved at 0x807F0000
+#   D/A      read / write memory, both take an address and a length
+#   G        0x06, then 0x07 after the program "ran"; 0x80 and the welcome
+#            message again for an address outside the user code space, as
+#            the kernel does when it restarts after an exception
+#   T        12 bytes of a TLB entry, all ones unless --tlb is given
+# Programs are not executed, G only takes --run-time seconds
+#
+# BoardLink is the same board without a connection, answering as soon as a
+# command is written, for the expected responses to a stimulus
+#
+# Both directions of the link have a bandwidth and a latency, so the time
+# term.py spends on uploads and dumps is close to what a serial port takes,
+# e.g. --baud 115200 is 11520 B/s with a start and a stop bit per byte
+
+import argparse
+import asyncio
+import os
+import struct
+import time
+import tty
+from protocol import OP_R, OP_D, OP_A, OP_G, OP_T, TIMERSET, TIMETOKEN, TRAP, REGS, TLB_ENTRY, TLB_ENTRIES, WORD
+
+WELCOME = b'MONITOR for MIPS32 - initialized.'
+
+# 8 MB of memory seen from kseg0
+RAM_BASE = 0x80000000
+RAM_SIZE = 0x800000
+USER_CODE = (0x80100000, 0x80400000)
+UREGS = 0x807F0000
+
+# how many words follow each command
+COMMAND_WORDS = {OP_R: 0, OP_D: 2, OP_A: 2, OP_G: 1, OP_T: 1}
+
+ELO_GLOBALF = 1 << 0
+ELO_VALIDF = 1 << 1
+
+# the link sends at most this many bytes at once, so that a long dump
+# arrives gradually instead of after the whole transfer time
+LINK_PIECE = 64
+
+
+class Link:
+    # one direction of a link with limited bandwidth (bytes per second, None
+    # for unlimited) and a fixed latency (seconds)
+    # data written is handed to deliver() at the time it would arrive,
+    # b'' after write_eof()
+
+    def __init__(self, deliver, bandwidth=None, latency=0):
+        self.deliver = deliver
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.queue = asyncio.Queue()
+        self.free = 0       # when the link has sent everything queued so far
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def write(self, data):
+        now = time.monotonic()
+        self.free = max(now, self.free)
+        if not self.bandwidth:
+            self.queue.put_nowait((self.free + self.latency, data))
+            return
+        for i in range(0, len(data), LINK_PIECE):
+            piece = data[i:i+LINK_PIECE]
+            self.free += len(piece) / self.bandwidth
+            self.queue.put_nowait((self.free + self.latency, piece))
+
+    async def idle(self):
+        # until the link has sent everything written so far
+        delay = self.free - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def write_eof(self):
+        self.free = max(time.monotonic(), self.free)
+        self.queue.put_nowait((self.free + self.latency, b''))
+
+    async def _run(self):
+        while True:
+            arrival, piece = await self.queue.get()
+            delay = arrival - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.deliver(piece)
+
+    def close(self):
+        self.task.cancel()
+
+
+class LinkedStreams:
+    # the board's reader and writer behind a pair of Links
+
+    def __init__(self, reader, writer, bandwidth, latency):
+        self.raw_writer = writer
+        self.reader = asyncio.StreamReader()
+        self.uplink = Link(self._feed, bandwidth, latency)
+        self.downlink = Link(self._send, bandwidth, latency)
+        self.receive_task = asyncio.get_running_loop().create_task(self._receive(reader))
+
+    async def _receive(self, reader):
+        # the socket is only read as fast as the uplink sends, so once the
+        # socket buffers are full term.py's writes are slowed down as by a
+        # serial port; what the buffers hold is still accepted at once
+        while True:
+            data = await reader.read(LINK_PIECE * 16)
+            if not data:
+                break
+            self.uplink.write(data)
+            await self.uplink.idle()
+        self.uplink.write_eof()
+
+    async def _feed(self, data):
+        if data:
+            self.reader.feed_data(data)
+        else:
+            self.reader.feed_eof()
+
+    async def _send(self, data):
+        self.raw_writer.write(data)
+        await self.raw_writer.drain()
+
+    def write(self, data):
+        self.downlink.write(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.receive_task.cancel()
+        self.uplink.close()
+        self.downlink.close()
+        self.raw_writer.close()
+
+
+def tlb_entries():
+    # what kern/init.S leaves in the TLB: entries 2 and up are invalid, each
+    # with a different kseg0 VA, entries 0 and 1 map the page table into kseg2
+    # (PFNs are 0 here, they depend on where the kernel is linked)
+    entries = []
+    for i in range(TLB_ENTRIES):
+        entries.append((RAM_BASE + (TLB_ENTRIES - i) * 0x2000, 0, 0))
+    entries[0] = (0xC0000000, ELO_VALIDF | ELO_GLOBALF, ELO_VALIDF | ELO_GLOBALF)
+    entries[1] = (0xC03FE000, ELO_VALIDF | ELO_GLOBALF, ELO_VALIDF | ELO_GLOBALF)
+    return entries
+
+
+class Board:
+    # memory, registers and TLB of one board, shared by its connections
+
+    def __init__(self, run_time=0, tlb=False, bandwidth=None, latency=0):
+        self.run_time = run_time
+        self.tlb = tlb_entries() if tlb else None
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.memory = bytearray(RAM_SIZE)
+
+    def _offset(self, addr, num):
+        offset = (addr - RAM_BASE) & 0xffffffff
+        if offset + num > RAM_SIZE:
+            return None
+        return offset
+
+    def load(self, addr, num):
+        offset = self._offset(addr, num)
+        if offset is None:
+            # nothing is mapped there on the board either
+            return bytes(num)
+        return bytes(self.memory[offset:offset+num])
+
+    def store(self, addr, data):
+        offset = self._offset(addr, len(data))
+        if offset is not None:
+            self.memory[offset:offset+len(data)] = data
+
+    async def serve(self, reader, writer, welcome=True):
+        streams = LinkedStreams(reader, writer, self.bandwidth, self.latency)
+        try:
+            if welcome:
+                streams.write(WELCOME)
+            while True:
+                op = await streams.reader.readexactly(1)
+                await self.command(op, streams.reader, streams)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            streams.close()
+
+    async def command(self, op, reader, writer):
+        words = COMMAND_WORDS.get(op, 0)
+        args = struct.unpack('<%dI' % words, await reader.readexactly(WORD.size * words))
+        data = await reader.readexactly(args[1] & ~3) if op == OP_A else b''
+        for i, reply in enumerate(self.respond(op, args, data)):
+            # the program runs between the replies of G
+            if i > 0:
+                await asyncio.sleep(self.run_time)
+            writer.write(reply)
+
+    def respond(self, op, args, data):
+        # the replies to a command, args are the words after it and data
+        # what A writes
+        if op == OP_R:
+            return [self.load(UREGS, REGS.size)]
+        elif op == OP_D:
+            return [self.load(args[0], args[1])]
+        elif op == OP_A:
+            self.store(args[0], data)
+        elif op == OP_G:
+            if not USER_CODE[0] <= args[0] < USER_CODE[1]:
+                return [bytes((TRAP,)) + WELCOME]
+            return [bytes((TIMERSET,)), bytes((TIMETOKEN,))]
+        elif op == OP_T:
+            if self.tlb is None:
+                return [b'\xff' * TLB_ENTRY.size]
+            return [TLB_ENTRY.pack(*self.tlb[args[0] % TLB_ENTRIES])]
+        # the kernel ignores anything else
+        return []
+
+
+class BoardLink:
+    # a Board behind the link interface of transport.py, e.g. for a Recorder
+    # to save what the board would answer; starts with the welcome message
+
+    def __init__(self, board, welcome=True):
+        self.board = board
+        self.input = bytearray()
+        self.output = bytearray(WELCOME if welcome else b'')
+        self.replies = True
+        self.received = 0
+        self.sent = 0
+
+    def write(self, data):
+        self.input += data
+        self.sent += len(data)
+        while len(self.input) > 0:
+            op = bytes(self.input[:1])
+            header = 1 + WORD.size * COMMAND_WORDS.get(op, 0)
+            if len(self.input) < header:
+                break
+            args = struct.unpack_from('<%dI' % COMMAND_WORDS.get(op, 0), self.input, 1)
+            length = header + (args[1] & ~3 if op == OP_A else 0)
+            if len(self.input) < length:
+                break
+            data = bytes(self.input[header:length])
+            del self.input[:length]
+            for reply in self.board.respond(op, args, data):
+                self.output += reply
+
+    def read(self, n, timeout=None):
+        if len(self.output) < n:
+            raise ConnectionError('the board has nothing more to send')
+        return self.read_some(n)
+
+    def read_some(self, n=65536, timeout=None):
+        if len(self.output) == 0:
+            raise ConnectionError('the board has nothing more to send')
+        data = bytes(self.output[:n])
+        del self.output[:n]
+        self.received += len(data)
+        return data
+
+    def unread(self, data):
+        self.output[:0] = data
+        self.received -= len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        count = len(self.output)
+        self.output.clear()
+        return count
+
+    def close(self):
+        pass
+
+
+async def serve_tcp(host, port, boards):
+    servers = []
+    for i, board in enumerate(boards):
+        server = await asyncio.start_server(board.serve, host, port + i)
+        servers.append(server)
+        print('board %d listening on %s:%d' % (i, host, port + i), flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+async def serve_pty(boards):
+    loop = asyncio.get_running_loop()
+    tasks = []
+    for i, board in enumerate(boards):
+        # the slave stays open here, otherwise reading the master fails
+        # whenever term.py is not connected
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(master, 'rb', 0))
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+            os.fdopen(os.dup(master), 'wb', 0))
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        print('board %d on %s' % (i, os.ttyname(slave)), flush=True)
+        tasks.append(board.serve(reader, writer))
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Stand-in supervisor boards for testing term.py.')
+    parser.add_argument('-t', '--tcp', default='127.0.0.1:6666', help='Address:port of the first board (127.0.0.1:6666 by default)')
+    parser.add_argument('-p', '--pty', action='store_true', help='Create a pty for every board instead, use it with term.py -p')
+    parser.add_argument('-n', '--boards', default=1, type=int, help='How many boards, on consecutive ports (1 by default)')
+    parser.add_argument('--run-time', default=0, type=float, help='Seconds every G takes (0 by default)')
+    parser.add_argument('--tlb', action='store_true', help='Report the TLB entries of a kernel with TLB enabled')
+    parser.add_argument('--baud', default=None, type=int, help='Link bandwidth as a serial baudrate, 10 bits per byte (unlimited by default)')
+    parser.add_argument('--bandwidth', default=None, type=float, help='Link bandwidth in bytes per second, overrides --baud')
+    parser.add_argument('--latency', default=0, type=float, help='One-way link latency in seconds (0 by default)')
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth or (args.baud / 10 if args.baud else None)
+    boards = [Board(args.run_time, args.tlb, bandwidth, args.latency) for i in range(args.boards)]
+    try:
+        if args.pty:
+            asyncio.run(serve_pty(boards))
+        else:
+            host, _, port = args.tcp.rpartition(':')
+            asyncio.run(serve_tcp(host, int(port), boards))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- encoding=utf-8 -*-
+
+# Run the same term.py script on several boards at once
+#
+# Every board gets its own term.py in batch mode (-x), so uploads and G runs
+# happen in parallel, and the JSON timings of all boards are aggregated into
+# per-board and per-command latency / throughput statistics
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TERM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'term.py')
+
+
+# one board, identified by the term.py arguments that reach it
+class Board:
+    def __init__(self, name, endpoint_args):
+        self.name = name
+        self.endpoint_args = endpoint_args
+        self.records = []
+        self.returncode = None
+        self.log = ''
+        self.elapse = 0
+
+def parse_boards(args):
+    boards = []
+    for endpoint in args.tcp or []:
+        boards.append(Board(endpoint, ['-t', endpoint]))
+    for endpoint in args.serial or []:
+        # PORT or PORT@BAUD
+        port, _, baud = endpoint.partition('@')
+        boards.append(Board(endpoint, ['-s', port, '-b', baud or str(args.baud)]))
+    return boards
+
+def run_board(board, script, term_args):
+    command = [sys.executable, TERM] + board.endpoint_args + term_args + ['-x', script, '--json', '-']
+    time_start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    board.elapse = time.time() - time_start
+    board.returncode = process.returncode
+    board.log = stderr.decode('utf-8', 'replace')
+    for line in stdout.decode('utf-8', 'replace').splitlines():
+        try:
+            board.records.append(json.loads(line))
+        except ValueError:
+            pass
+
+def run_boards(boards, script, term_args):
+    # one thread per board drains its pipes, so a chatty board never stalls the others
+    with ThreadPoolExecutor(len(boards)) as pool:
+        for future in [pool.submit(run_board, board, script, term_args) for board in boards]:
+            future.result()
+
+# name of a command in the statistics: the name given to G, or the script line
+def record_key(record):
+    return record.get('name', record['command'])
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return collections.OrderedDict([
+        ('count', len(values)),
+        ('min', values[0]),
+        ('median', statistics.median(values)),
+        ('mean', statistics.mean(values)),
+        ('max', values[-1]),
+    ])
+
+def board_statistics(board):
+    commands = collections.OrderedDict()
+    for record in board.records:
+        commands.setdefault(record_key(record), []).append(record)
+    result = collections.OrderedDict()
+    for key, records in commands.items():
+        ok = [record for record in records if record['status'] == 'ok']
+        stats = collections.OrderedDict()
+        stats['runs'] = len(records)
+        stats['failed'] = len(records) - len(ok)
+        stats['seconds'] = summarize([record['seconds'] for record in ok])
+        stats['run_seconds'] = summarize([record['run_seconds'] for record in ok if 'run_seconds' in record])
+        stats['throughput'] = summarize([record['throughput'] for record in ok if record['throughput'] > 0])
+        result[key] = stats
+    total_bytes = sum(record['bytes_sent'] + record['bytes_received'] for record in board.records)
+    return collections.OrderedDict([
+        ('returncode', board.returncode),
+        ('elapsed', board.elapse),
+        ('bytes', total_bytes),
+        ('commands', result),
+    ])
+
+def fleet_statistics(boards):
+    # the same command compared across boards, from the median of each board
+    keys = []
+    for board in boards:
+        for record in board.records:
+            if record_key(record) not in keys:
+                keys.append(record_key(record))
+    result = collections.OrderedDict()
+    for key in keys:
+        medians = {}
+        for board in boards:
+            values = [record.get('run_seconds', record['seconds']) for record in board.records
+                if record_key(record) == key and record['status'] == 'ok']
+            if values:
+                medians[board.name] = statistics.median(values)
+        if not medians:
+            continue
+        stats = summarize(list(medians.values()))
+        stats['slowest'] = max(medians, key=medians.get)
+        result[key] = stats
+    return result
+
+def print_report(boards, fleet):
+    for board in boards:
+        status = 'ok' if board.returncode == 0 else 'failed (%d)' % board.returncode
+        print('%s: %s, %d commands in %.3fs' % (board.name, status, len(board.records), board.elapse))
+        failed = [record for record in board.records if record['status'] != 'ok']
+        for record in failed:
+            print('    line %d: %s %s' % (record['line'], record['status'], record.get('message', '')))
+        if board.returncode != 0 and not failed:
+            # term.py itself failed, e.g. could not connect
+            for line in board.log.splitlines()[-5:]:
+                print('    ' + line)
+    print('%-40s %10s %10s %10s  %s' % ('command', 'min', 'median', 'max', 'slowest board'))
+    for key, stats in fleet.items():
+        print('%-40s %10.6f %10.6f %10.6f  %s' % (key[:40], stats['min'], stats['median'], stats['max'], stats['slowest']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Run a term.py script on several boards in parallel.')
+    parser.add_argument('-x', '--script', required=True, help='Batch mode script run on every board')
+    parser.add_argument('-t', '--tcp', action='append', help='TCP address:port of a board, may be repeated')
+    parser.add_argument('-s', '--serial', action='append', help='Serial port of a board as PORT or PORT@BAUD, may be repeated')
+    parser.add_argument('-b', '--baud', default=9600, help='Baudrate of serial ports without @BAUD (9600 by default)')
+    parser.add_argument('-c', '--continued', action='store_true', help='Do not wait for the welcome message')
+    parser.add_argument('--repeat', default=1, type=int, help='How many times every board runs the script (1 by default)')
+    parser.add_argument('--timeout', default=None, help='Passed to term.py --timeout')
+    parser.add_argument('--run-timeout', default=None, help='Passed to term.py --run-timeout')
+    parser.add_argument('--json', default=None, help='Also write the statistics and all records as JSON to this file')
+    args = parser.parse_args()
+
+    boards = parse_boards(args)
+    if not boards:
+        parser.print_help()
+        exit(1)
+    term_args = ['--repeat', str(args.repeat)]
+    if args.continued:
+        term_args.append('-c')
+    if args.timeout is not None:
+        term_args += ['--timeout', args.timeout]
+    if args.run_timeout is not None:
+        term_args += ['--run-timeout', args.run_timeout]
+
+    run_boards(boards, args.script, term_args)
+    fleet = fleet_statistics(boards)
+    print_report(boards, fleet)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(collections.OrderedDict([
+                ('boards', collections.OrderedDict((board.name, board_statistics(board)) for board in boards)),
+                ('commands', fleet),
+                ('records', collections.OrderedDict((board.name, board.records) for board in boards)),
+            ]), f, indent=2)
+    if any(board.returncode != 0 for board in boards):
+        exit(1)
@@ -0,0 +1,135 @@
+# -*- encoding=utf-8 -*-
+
+# Encoding of the supervisor protocol (kern/shell.S), shared by term.py,
+# translator.py and the board emulator so that they send the same bytes
+#
+# Supervisor wraps a link from transport.py: a live Connection, a Recorder
+# that writes the stimulus to a file (e.g. cpu_sv_test.mem) or a Replay of a
+# recorded session. Requests are encoded into one buffer with precompiled
+# structs and written at once; responses are decoded from memoryviews.
+# A link without replies (a Recorder with no board behind it) makes every
+# request return None instead of waiting for an answer
+
+import struct
+
+OP_R = b'R'
+OP_D = b'D'
+OP_A = b'A'
+OP_G = b'G'
+OP_T = b'T'
+TIMERSET = 0x06     # G: the program started
+TIMETOKEN = 0x07    # G: the program returned
+TRAP = 0x80         # an exception, the kernel restarts
+
+WELCOME_LENGTH = 33
+REGISTERS = 30      # $1 to $30
+TLB_ENTRIES = 16
+
+WORD = struct.Struct('<I')
+# op, address, length of A and D
+ADDR_NUM = struct.Struct('<cII')
+# op, address (or index) of G and T
+ADDR = struct.Struct('<cI')
+REGS = struct.Struct('<%dI' % REGISTERS)
+# EntryHi, EntryLo0, EntryLo1
+TLB_ENTRY = struct.Struct('<III')
+
+
+# convert 32-bit int to byte string of length 4, from LSB to MSB
+def int_to_byte_string(val):
+    return WORD.pack(val)
+
+def byte_string_to_int(val):
+    return WORD.unpack_from(val)[0]
+
+def encode_upload(addr, data, chunk):
+    # A commands writing data to addr, chunk bytes (a multiple of 4) each,
+    # built in one buffer; the shell loops forever on a zero length, so
+    # nothing is encoded for empty data
+    view = memoryview(data).cast('B')
+    commands = (len(view) + chunk - 1) // chunk
+    buffer = bytearray(len(view) + ADDR_NUM.size * commands)
+    pos = 0
+    for offset in range(0, len(view), chunk):
+        piece = view[offset:offset+chunk]
+        ADDR_NUM.pack_into(buffer, pos, OP_A, (addr + offset) & 0xffffffff, len(piece))
+        pos += ADDR_NUM.size
+        buffer[pos:pos+len(piece)] = piece
+        pos += len(piece)
+    return buffer
+
+def encode_dump(addr, num):
+    return ADDR_NUM.pack(OP_D, addr & 0xffffffff, num)
+
+def encode_go(addr):
+    return ADDR.pack(OP_G, addr & 0xffffffff)
+
+def encode_tlb(index):
+    return ADDR.pack(OP_T, index & 0xffffffff)
+
+def decode_words(data):
+    view = memoryview(data).cast('B')
+    return struct.unpack_from('<%dI' % (len(view) // 4), view)
+
+
+class Supervisor:
+    # requests to a board over a link, see transport.py for the links
+    # chunk is at most how many bytes one A command carries
+
+    def __init__(self, link, chunk=1024):
+        self.link = link
+        self.chunk = max(4, chunk - chunk % 4)
+
+    def _reply(self, num):
+        if not self.link.replies:
+            return None
+        return self.link.read(num)
+
+    def welcome(self):
+        return self._reply(WELCOME_LENGTH)
+
+    def upload(self, addr, data, progress=None):
+        # data is padded to whole words, returns the bytes put on the wire
+        # progress(sent, total) is called after every A command
+        if len(data) % 4 != 0:
+            data = bytes(data) + b'\0' * (4 - len(data) % 4)
+        if not progress:
+            buffer = encode_upload(addr, data, self.chunk)
+            self.link.write(buffer)
+            self.link.flush()
+            return len(buffer)
+        wire = 0
+        for offset in range(0, len(data), self.chunk):
+            buffer = encode_upload(addr + offset, memoryview(data)[offset:offset+self.chunk], self.chunk)
+            self.link.write(buffer)
+            self.link.flush()
+            wire += len(buffer)
+            progress(min(offset + self.chunk, len(data)), len(data))
+        return wire
+
+    def dump(self, addr, num):
+        # num bytes of memory, num must not be 0
+        self.link.write(encode_dump(addr, num))
+        self.link.flush()
+        return self._reply(num)
+
+    def registers(self):
+        # $1 to $30 of the user program
+        self.link.write(OP_R)
+        self.link.flush()
+        data = self._reply(REGS.size)
+        return None if data is None else REGS.unpack_from(data)
+
+    def tlb(self, index):
+        # (EntryHi, EntryLo0, EntryLo1), all ones if TLB is not supported
+        self.link.write(encode_tlb(index))
+        self.link.flush()
+        data = self._reply(TLB_ENTRY.size)
+        return None if data is None else TLB_ENTRY.unpack_from(data)
+
+    def go(self, addr):
+        # start the program at addr, the caller then reads its output up to
+        # TIMETOKEN or TRAP; returns False when the link has no replies
+        self.link.write(encode_go(addr))
+        self.link.flush()
+        return self.link.replies
@@ -2,23 +2,21 @@
 # -*- encoding=utf-8 -*-
 
 import argparse
+import collections
+import hashlib
+import json
 import math
 import os
 import platform
 import re
-import select
-import socket
 import string
 import struct
 import subprocess
 import sys
 import tempfile
 from timeit import default_timer as timer
-try:
-    import serial
-except:
-    print("Please install pyserial")
-    exit(1)
+from protocol import Supervisor, decode_words, TIMERSET, TIMETOKEN, TRAP
+from transport import Connection, Recorder, Replay
 try:
     import readline
 except:
@@ -32,12 +30,23 @@ if 'GCCPREFIX' in os.environ:
 CMD_ASSEMBLER = CCPREFIX + 'as'
 CMD_DISASSEMBLER = CCPREFIX + 'objdump'
 CMD_BINARY_COPY = CCPREFIX + 'objcopy'
+ASM_FLAGS = ['-EL', '-mips32r2']
 
 Reg_alias = ['zero', 'AT', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3', 't0', 't1', 't2', 't3', 't4', 't5', 't6', 't7', 's0', 
                 's1', 's2', 's3', 's4', 's5', 's6', 's7', 't8', 't9/jp', 'k0', 'k1', 'gp', 'sp', 'fp/s8', 'ra']
 
 inp = None
 outp = None
+# protocol.Supervisor over the same link as inp / outp
+board = None
+# at most how many bytes are sent with one A command, set by --chunk
+upload_chunk = 1024
+# seconds to wait for a reply from the board, set by --timeout
+response_timeout = 10
+# seconds to wait for a user program started by G, set by --run-timeout
+run_timeout = None
+# file the commands typed are saved to as a batch mode script, set by --log
+session_log = None
 
 def test_programs():
     tmp = tempfile.NamedTemporaryFile()
@@ -58,66 +67,289 @@ def output_binary(binary):
     else:
         sys.stdout.write(binary)
 
-# convert 32-bit int to byte string of length 4, from LSB to MSB
-def int_to_byte_string(val):
-    return struct.pack('<I', val)
+# cache of assembled snippets, keyed by the hash of assembler, flags, source
+# and the offset the binary starts at; only the bytes from that offset on are
+# kept, so the .org padding of a program loaded high in memory costs nothing
+# least recently used entries are evicted once the entries in memory take more
+# than capacity bytes; if a directory is given, every result is also stored
+# there and survives restarts of term, and the least recently used files are
+# removed once they take more than directory_capacity bytes
+class AsmCache:
+    def __init__(self, capacity=16 << 20, directory=None, directory_capacity=64 << 20):
+        self.capacity = capacity
+        self.directory = directory
+        self.directory_capacity = directory_capacity
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def key(self, source, offset=0):
+        text = '\0'.join([CMD_ASSEMBLER] + ASM_FLAGS + ['%x' % offset, source])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key in self.entries:
+            binary = self.entries.pop(key)
+            self.entries[key] = binary
+            return binary
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, key + '.bin')
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            binary = f.read()
+        # the modification time orders the files for prune
+        os.utime(path, None)
+        self.put(key, binary, store=False)
+        return binary
+
+    def put(self, key, binary, store=True):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = binary
+        self.size += len(binary)
+        while self.size > self.capacity and len(self.entries) > 1:
+            self.size -= len(self.entries.popitem(last=False)[1])
+        if store and self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # write to a temporary file first so that a crash never leaves a truncated entry
+            tmp = tempfile.NamedTemporaryFile(dir=self.directory, delete=False)
+            tmp.write(binary)
+            tmp.close()
+            os.rename(tmp.name, os.path.join(self.directory, key + '.bin'))
+            self.prune()
+
+    def prune(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        # the newest file is kept even if it alone is too large
+        for _, size, name in sorted(files)[:-1]:
+            if total <= self.directory_capacity:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+asm_cache = AsmCache()
 
-def byte_string_to_int(val):
-    return struct.unpack('<I', val)[0]
+# assembler messages look like "/tmp/tmpXXXX:12: Error: unrecognized opcode `foo'"
+ASM_ERROR = re.compile(r':(\d+): Error: (.*)$')
 
 # invoke assembler to compile instructions (in little endian MIPS32)
-# returns a byte string of encoded instructions, from lowest byte to highest byte
-# returns empty string on failure (in which case assembler messages are printed to stdout)
-def multi_line_asm(instr):
+# returns (binary, errors): binary is a byte string of encoded instructions
+# from byte offset on (the .org of the source), from lowest byte to highest
+# byte, or None on failure; errors maps line numbers of the source (from 1) to
+# assembler messages, messages without a line number are under 0
+def run_assembler(source, offset=0):
+    key = asm_cache.key(source, offset)
+    binary = asm_cache.get(key)
+    if binary is not None:
+        return binary, {}
+
     tmp_asm = tempfile.NamedTemporaryFile(delete=False)
     tmp_obj = tempfile.NamedTemporaryFile(delete=False)
     tmp_binary = tempfile.NamedTemporaryFile(delete=False)
 
+    errors = {}
     try:
-        tmp_asm.write((instr + "\n").encode('utf-8'))
+        tmp_asm.write((source + "\n").encode('utf-8'))
         tmp_asm.close()
         tmp_obj.close()
         tmp_binary.close()
-        subprocess.check_output([
-            CMD_ASSEMBLER, '-EL', '-mips32r2', tmp_asm.name, '-o', tmp_obj.name])
+        subprocess.check_output([CMD_ASSEMBLER] + ASM_FLAGS + [
+            tmp_asm.name, '-o', tmp_obj.name], stderr=subprocess.STDOUT)
         subprocess.check_call([
             CMD_BINARY_COPY, '-j', '.text', '-O', 'binary', tmp_obj.name, tmp_binary.name])
         with open(tmp_binary.name, 'rb') as f:
+            f.seek(offset)
             binary = f.read()
-            return binary
+        asm_cache.put(key, binary)
+        return binary, errors
     except subprocess.CalledProcessError as e:
-        print(e.output)
+        for line in (e.output or b'').decode('utf-8', 'replace').splitlines():
+            match = ASM_ERROR.search(line)
+            if match is not None:
+                errors.setdefault(int(match.group(1)), []).append(match.group(2))
+            elif 'Assembler messages' not in line and line.strip() != '':
+                errors.setdefault(0, []).append(line.strip())
     except:
-        print("Unexpected error:", sys.exc_info()[0])
+        errors.setdefault(0, []).append("Unexpected error: %s" % sys.exc_info()[0])
     finally:
         os.remove(tmp_asm.name)
         # object file won't exist if assembler fails
         if os.path.exists(tmp_obj.name):
             os.remove(tmp_obj.name)
         os.remove(tmp_binary.name)
-    return ''
+    return None, errors
 
-# invoke objdump to disassemble single instruction
-# accepts encoded instruction (exactly 4 bytes), from least significant byte
+# assemble instructions, results are cached
+# returns a byte string of encoded instructions from byte offset on, from lowest
+# byte to highest byte
+# returns empty string on failure (in which case assembler messages are printed to stdout)
+def multi_line_asm(instr, offset=0):
+    binary, errors = run_assembler(instr, offset)
+    if binary is None:
+        for line in sorted(errors):
+            for message in errors[line]:
+                print(message)
+        return ''
+    return binary
+
+# the offset of addr in the binary the assembler makes, i.e. its .org
+def asm_offset(addr):
+    return addr & 0xfffffff
+
+# the assembler source of a program loaded at addr, as a list of lines, and
+# a dict from index in lines to (line number in the source, whether it takes
+# an address)
+def asm_source(addr, lines):
+    offset = asm_offset(addr)
+    asm = [".set noreorder", ".set noat", ".org {:#x}".format(offset)]
+    placed = {}
+    for index, line in enumerate(lines):
+        line = line.strip()
+        if line == '':
+            continue
+        if re.match("\\w+:$", line) is not None:
+            # ASM label only
+            asm.append(line)
+            placed[index] = (len(asm), False)
+            continue
+        try:
+            asm.append(".word {:#x}".format(int(line, 16)))
+        except ValueError:
+            asm.append(line)
+        placed[index] = (len(asm), True)
+    return asm, placed
+
+# assemble a whole program with one assembler run, printing each line with its
+# address like run_A does; lines rejected by the assembler are reported with
+# the assembler messages and left out, then the rest is assembled again
+# returns the same as multi_line_asm, from addr on
+def batch_asm(addr, lines):
+    asm, placed = asm_source(addr, lines)
+    binary, errors = run_assembler("\n".join(asm), asm_offset(addr))
+    if binary is None:
+        source = "\n".join(line for number, line in enumerate(asm, 1) if number not in errors)
+        binary, _ = run_assembler(source, asm_offset(addr))
+    prompt_addr = addr
+    for index, line in enumerate(lines):
+        if index not in placed:
+            continue
+        number, takes_addr = placed[index]
+        print('[0x%04x] %s' % (prompt_addr, line.strip()))
+        if number in errors:
+            for message in errors[number]:
+                print('    ' + message)
+        elif takes_addr:
+            prompt_addr = prompt_addr + 4
+    for message in errors.get(0, []):
+        print(message)
+    if binary is None:
+        return ''
+    return binary
+
+# section name -> contents, of a little endian ELF32 object file
+def elf_sections(data):
+    shoff = struct.unpack_from('<I', data, 0x20)[0]
+    shentsize, shnum, shstrndx = struct.unpack_from('<HHH', data, 0x2e)
+    headers = [struct.unpack_from('<10I', data, shoff + i * shentsize) for i in range(shnum)]
+    names = headers[shstrndx][4]
+    sections = {}
+    for name, kind, _, _, offset, size in (header[:6] for header in headers):
+        name = data[names + name:data.index(b'\0', names + name)].decode('utf-8', 'replace')
+        # SHT_NOBITS takes no space in the file
+        sections[name] = bytes(size) if kind == 8 else data[offset:offset+size]
+    return sections
+
+ASM_LABEL = re.compile(r'^\s*(\w+):')
+
+# assemble the programs [(addr, lines)] that batch_asm will be asked for with a
+# single assembler run, and put the results in asm_cache
+# each program goes to a section of its own and its labels are renamed, so
+# that programs at the same address or with the same labels do not clash; if
+# the run fails nothing is cached, and batch_asm assembles the programs (and
+# reports their errors) one by one as usual
+# returns how many programs were assembled
+def preassemble(programs):
+    pending = collections.OrderedDict()
+    for addr, lines in programs:
+        asm, _ = asm_source(addr, lines)
+        key = asm_cache.key("\n".join(asm), asm_offset(addr))
+        if key not in pending and asm_cache.get(key) is None:
+            pending[key] = (asm, asm_offset(addr))
+    if not pending:
+        return 0
+    combined = []
+    for index, (asm, _) in enumerate(pending.values()):
+        labels = [match.group(1) for match in map(ASM_LABEL.match, asm) if match is not None]
+        rename = re.compile(r'\b(%s)\b' % '|'.join(map(re.escape, labels))) if labels else None
+        combined.append('.section .text.p%d,"ax",@progbits' % index)
+        for line in asm:
+            if rename is not None:
+                line = rename.sub(lambda match: '__p%d_%s' % (index, match.group(1)), line)
+            combined.append(line)
+
+    tmp_asm = tempfile.NamedTemporaryFile(delete=False)
+    tmp_obj = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        tmp_asm.write(("\n".join(combined) + "\n").encode('utf-8'))
+        tmp_asm.close()
+        tmp_obj.close()
+        subprocess.check_output([CMD_ASSEMBLER] + ASM_FLAGS + [
+            tmp_asm.name, '-o', tmp_obj.name], stderr=subprocess.STDOUT)
+        with open(tmp_obj.name, 'rb') as f:
+            sections = elf_sections(f.read())
+        binaries = [sections['.text.p%d' % index] for index in range(len(pending))]
+    except (subprocess.CalledProcessError, OSError, KeyError, ValueError, struct.error):
+        return 0
+    finally:
+        os.remove(tmp_asm.name)
+        if os.path.exists(tmp_obj.name):
+            os.remove(tmp_obj.name)
+    for (key, (_, offset)), binary in zip(pending.items(), binaries):
+        asm_cache.put(key, binary[offset:])
+    return len(pending)
+
+# objdump lines look like "80000000:\t21107f00 \taddu\tv0,v1,ra"
+DISASM_LINE = re.compile(r'^\s*([0-9a-f]+):\s+([0-9a-f]{8})\s+(.*)$')
+
+# invoke objdump once to disassemble a whole range of instructions
+# accepts encoded instructions (a multiple of 4 bytes), from least significant byte
+# returns a dict from address to the disassembled text of the word there
 # objdump does not seem to report errors so this function does not guarantee
 # to produce meaningful result
-def single_line_disassmble(binary_instr, addr):
-    assert(len(binary_instr) == 4)
+def disassemble(binary, addr):
+    assert(len(binary) % 4 == 0)
     tmp_binary = tempfile.NamedTemporaryFile(delete=False)
-    tmp_binary.write(binary_instr)
+    tmp_binary.write(binary)
     tmp_binary.close()
 
-    raw_output = subprocess.check_output([
-        CMD_DISASSEMBLER, '-D', '-b', 'binary',
-        '--adjust-vma=' + str(addr),
-        '-m', 'mips:isa32r2', tmp_binary.name])
-    # the last line should be something like:
-    #    0:   21107f00        addu    v0,v1,ra
-    result = raw_output.strip().split(b'\n')[-1].split(None, 2)[-1]
+    try:
+        # -z: show zero words too, instead of collapsing them into "..."
+        raw_output = subprocess.check_output([
+            CMD_DISASSEMBLER, '-D', '-z', '-b', 'binary',
+            '--adjust-vma=' + str(addr),
+            '-m', 'mips:isa32r2', tmp_binary.name])
+    finally:
+        os.remove(tmp_binary.name)
 
-    os.remove(tmp_binary.name)
+    result = {}
+    for line in raw_output.decode('utf-8', 'replace').splitlines():
+        match = DISASM_LINE.match(line)
+        if match is not None:
+            result[int(match.group(1), 16) & 0xffffffff] = match.group(3).strip()
+    return result
 
-    return result.decode('utf-8')
+# invoke objdump to disassemble single instruction
+# accepts encoded instruction (exactly 4 bytes), from least significant byte
+def single_line_disassmble(binary_instr, addr):
+    assert(len(binary_instr) == 4)
+    return disassemble(binary_instr, addr).get(addr & 0xffffffff, '')
 
 
 def run_T(num):
@@ -129,11 +361,10 @@ def run_T(num):
         entries = 1
     print("Index | ASID |  VAddr  |  PAddr  | C | D | V | G")
     for i in range(start, start+entries):
-        outp.write(b'T')
-        outp.write(int_to_byte_string(i))
-        entry_hi = byte_string_to_int(inp.read(4))
-        entry_lo0 = byte_string_to_int(inp.read(4))
-        entry_lo1 = byte_string_to_int(inp.read(4))
+        entry = board.tlb(i)
+        if entry is None:
+            continue
+        entry_hi, entry_lo0, entry_lo1 = entry
         if (entry_hi & entry_lo1 & entry_lo0) == 0xffffffff:
             print("Error: TLB support not enabled")
             break
@@ -142,11 +373,39 @@ def run_T(num):
         print("              %05x_000 %05x_000  %x   %x   %x   %x" %
             (                entry_hi>>12|1, entry_lo1>>6, entry_lo1>>3&7, entry_lo1>>2&1, entry_lo1>>1&1, entry_lo1&1))
 
+# write binary to memory at addr, with one A command per upload_chunk bytes
+# the shell reads exactly len bytes after each header, so chunks need no reply
+# binary is padded to whole words, and progress is shown for large uploads
+# on a real link the upload ends with a D of one word: writes return as soon as
+# the OS has buffered the data, only the reply shows the board has received it
+def upload(addr, binary):
+    total = (len(binary) + 3) // 4 * 4
+    if total == 0:
+        # the shell loops forever on a zero length, so never send one
+        return
+    time_start = timer()
+    # no rate here: a chunk counts as sent once the OS has buffered it, only
+    # the figure after the final D below is what the link really did
+    def progress(sent, total):
+        sys.stdout.write('\ruploading %d/%d bytes (%d%%)' % (sent, total, sent * 100 // total))
+        sys.stdout.flush()
+    large = total > board.chunk
+    wire = board.upload(addr, binary, progress if large else None)
+    if isinstance(inp, Connection):
+        board.dump(addr, 4)
+    elapse = timer() - time_start
+    if large:
+        print('')
+    print('%d bytes written to 0x%08x in %.3fs (%d bytes on the wire, %.1f B/s)' % (
+        total, addr, elapse, wire, total / elapse if elapse > 0 else 0))
+
+# returns the lines taken, for the session log
 def run_A(addr):
     print("one instruction per line, empty line to end.")
-    offset = addr & 0xfffffff
+    offset = asm_offset(addr)
     prompt_addr = addr
     asm = ".set noreorder\n.set noat\n.org {:#x}\n".format(offset)
+    lines = []
     while True:
         line = raw_input('[0x%04x] ' % prompt_addr).strip()
         if line == '':
@@ -154,6 +413,7 @@ def run_A(addr):
         elif re.match("\\w+:$", line) is not None:
             # ASM label only
             asm += line + "\n"
+            lines.append(line)
             continue
         try:
             asm += ".word {:#x}\n".format(int(line, 16))
@@ -162,55 +422,35 @@ def run_A(addr):
             if instr == '':
                 continue
             asm += line + "\n"
+        lines.append(line)
         prompt_addr = prompt_addr + 4
     # print(asm)
-    binary = multi_line_asm(asm)
-    for i in range(offset, len(binary), 4):
-        outp.write(b'A')
-        outp.write(int_to_byte_string(addr))
-        outp.write(int_to_byte_string(4))
-        outp.write(binary[i:i+4])
-        addr = addr + 4
+    binary = multi_line_asm(asm, offset)
+    upload(addr, binary)
+    return lines
 
 def run_F(addr, file_name):
     if not os.path.isfile(file_name):
         print("file %s does not exist" % file_name)
         return
     print("reading from file %s" % file_name)
-    offset = addr & 0xfffffff
-    prompt_addr = addr
-    asm = ".set noreorder\n.set noat\n.org {:#x}\n".format(offset)
+    if file_name.lower().endswith('.bin'):
+        # raw binary, e.g. objcopy -O binary output, is written as is
+        with open(file_name, "rb") as f:
+            binary = f.read()
+        upload(addr, binary)
+        return
     with open(file_name, "r") as f:
-        for line in f:
-            print('[0x%04x] %s' % (prompt_addr, line.strip()))
-            if line == '':
-                break
-            elif re.match("\\w+:$", line) is not None:
-                # ASM label only
-                asm += line + "\n"
-                continue
-            try:
-                asm += ".word {:#x}\n".format(int(line, 16))
-            except ValueError:
-                instr = multi_line_asm(".set noat\n" + line)
-                if instr == '':
-                    continue
-                asm += line + "\n"
-            prompt_addr = prompt_addr + 4
-    binary = multi_line_asm(asm)
-    for i in range(offset, len(binary), 4):
-        outp.write(b'A')
-        outp.write(int_to_byte_string(addr))
-        outp.write(int_to_byte_string(4))
-        outp.write(binary[i:i+4])
-        addr = addr + 4
+        lines = f.read().splitlines()
+    binary = batch_asm(addr, lines)
+    upload(addr, binary)
 
 
 def run_R():
-    outp.write(b'R')
-    for i in range(1, 31):
-        val_raw = inp.read(4)
-        val = byte_string_to_int(val_raw)
+    values = board.registers()
+    if values is None:
+        return
+    for i, val in zip(range(1, 31), values):
         print('R{0}{1:7} = 0x{2:0>8x}'.format(
             str(i).ljust(2),
             '(' + Reg_alias[i] + ')',
@@ -222,57 +462,70 @@ def run_D(addr, num):
     if num % 4 != 0:
         print("num % 4 should be zero")
         return
-    outp.write(b'D')
-    outp.write(int_to_byte_string(addr))
-    outp.write(int_to_byte_string(num))
-    counter = 0
-    while counter < num:
-        val_raw = inp.read(4)
-        counter = counter + 4
-        val = byte_string_to_int(val_raw)
-        print('0x%08x: 0x%08x' % (addr,val))
-        addr = addr + 4
+    # the shell loops forever on a zero length
+    if num == 0:
+        return
+    data = board.dump(addr, num)
+    if data is None:
+        return
+    words = decode_words(data)
+    print('\n'.join('0x%08x: 0x%08x' % (addr + i * 4, val) for i, val in enumerate(words)))
 
 
 def run_U(addr, num):
     if num % 4 != 0:
         print("num % 4 should be zero")
         return
-    outp.write(b'D')
-    outp.write(int_to_byte_string(addr))
-    outp.write(int_to_byte_string(num))
-    counter = 0
-    while counter < num:
-        val_raw = inp.read(4)
-        print('0x%08x: %s' % (addr,single_line_disassmble(val_raw, addr)))
-        counter = counter + 4
-        addr = addr + 4
+    if num == 0:
+        return
+    data = board.dump(addr, num)
+    if data is None:
+        return
+    texts = disassemble(data, addr)
+    print('\n'.join('0x%08x: %s' % (addr + i, texts.get((addr + i) & 0xffffffff, '???'))
+        for i in range(0, num, 4)))
 
 def run_G(addr):
-    outp.write(b'G')
-    outp.write(int_to_byte_string(addr))
+    if not board.go(addr):
+        return None
     class TrapError(Exception):
         pass
     try:
         ret = inp.read(1)
-        if ret == b'\x80':
+        if ret[0] == TRAP:
             raise TrapError()
-        if ret != b'\x06':
+        if ret[0] != TIMERSET:
             print("start mark should be 0x06")
         time_start = timer()
         while True:
-            ret = inp.read(1)
-            if ret == b'\x07':
-                break
-            elif ret == b'\x80':
+            # take whatever has arrived, so long outputs are printed in chunks
+            data = inp.read_some(timeout=run_timeout)
+            ends = [i for i in (data.find(TIMETOKEN), data.find(TRAP)) if i >= 0]
+            if not ends:
+                output_binary(data)
+                continue
+            end = min(ends)
+            output_binary(data[:end])
+            # anything after the end mark belongs to the next command
+            inp.unread(data[end+1:])
+            if data[end] == TRAP:
                 raise TrapError()
-            output_binary(ret)
+            break
+        sys.stdout.flush()
         print('') #just a new line
         elapse = timer() - time_start
         print('elapsed time: %.3fs' % (elapse))
+        return elapse
     except TrapError:
         print('supervisor reported an exception during execution')
+        return None
+
 
+# save a command to the session log, in the syntax of batch mode scripts
+def log_command(line):
+    if session_log is not None:
+        session_log.write(line + '\n')
+        session_log.flush()
 
 def MainLoop():
     while True:
@@ -286,92 +539,222 @@ def MainLoop():
                 break
             elif cmd == 'A':
                 addr = raw_input('>>addr: 0x')
-                run_A(int(addr, 16))
+                lines = run_A(int(addr, 16))
+                if lines:
+                    log_command('A %x %s' % (int(addr, 16), '; '.join(lines)))
             elif cmd == 'F':
-                file_name = raw_input('>>file name: ')
+                file_name = raw_input('>>file name (.s or .bin): ')
                 addr = raw_input('>>addr: 0x')
                 run_F(int(addr, 16), file_name)
+                if os.path.isfile(file_name):
+                    log_command('F %x %s' % (int(addr, 16), os.path.abspath(file_name)))
             elif cmd == 'R':
                 run_R()
+                log_command('R')
             elif cmd == 'D':
                 addr = raw_input('>>addr: 0x')
                 num = raw_input('>>num: ')
                 run_D(int(addr, 16), int(num))
+                log_command('D %x %d' % (int(addr, 16), int(num)))
             elif cmd == 'U':
                 addr = raw_input('>>addr: 0x')
                 num = raw_input('>>num: ')
                 run_U(int(addr, 16), int(num))
+                log_command('U %x %d' % (int(addr, 16), int(num)))
             elif cmd == 'G':
                 addr = raw_input('>>addr: 0x')
                 run_G(int(addr, 16))
+                log_command('G %x' % int(addr, 16))
             elif cmd == 'T':
                 num = raw_input('>>num: ')
                 run_T(int(num))
+                log_command('T %d' % int(num))
             else:
                 print("Invalid command")
         except ValueError as e:
             print(e)
+        except TimeoutError as e:
+            print(e)
+        except ConnectionError as e:
+            # the board closed the link or it is out of sync, nothing later can succeed
+            print(e)
+            break
+        except KeyboardInterrupt:
+            print('interrupted')
+
+# batch mode: run commands from a script and report one JSON object per command
+# script lines, '#' starts a comment and numbers are hex as in the prompts:
+#   A <addr> <instr>[; <instr>...]
+#   F <addr> <file>       relative to the script
+#   D <addr> <num>
+#   U <addr> <num>
+#   R
+#   G <addr> [name]       name labels the run in the report, e.g. UTEST_1PTB
+#   T <num>
+SCRIPT_ARGUMENTS = {'A': 2, 'F': 2, 'D': 2, 'U': 2, 'R': 0, 'G': 1, 'T': 1}
+
+def parse_script(file_name):
+    commands = []
+    directory = os.path.dirname(os.path.abspath(file_name))
+    with open(file_name, 'r') as f:
+        lines = f.read().splitlines()
+    for number, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if line == '':
+            continue
+        cmd = line.split()[0].upper()
+        if cmd not in SCRIPT_ARGUMENTS:
+            raise ValueError('%s:%d: unknown command %s' % (file_name, number, line.split()[0]))
+        if cmd == 'A':
+            # instructions contain spaces
+            args = line.split(None, 2)[1:]
+        else:
+            args = line.split()[1:]
+        # the name of G is optional
+        if len(args) != SCRIPT_ARGUMENTS[cmd] and not (cmd == 'G' and len(args) == 2):
+            raise ValueError('%s:%d: %s takes %d arguments' % (file_name, number, cmd, SCRIPT_ARGUMENTS[cmd]))
+        try:
+            if cmd in ('A', 'F', 'D', 'U', 'G'):
+                args[0] = int(args[0], 16)
+            if cmd in ('D', 'U', 'T'):
+                args[-1] = int(args[-1])
+        except ValueError:
+            raise ValueError('%s:%d: invalid number in %s' % (file_name, number, line))
+        if cmd == 'F':
+            args[1] = os.path.join(directory, args[1])
+        commands.append((number, line, cmd, args))
+    return commands
+
+# the programs a script assembles, as [(addr, lines)] for preassemble
+def script_programs(commands):
+    programs = []
+    for number, line, cmd, args in commands:
+        if cmd == 'A':
+            programs.append((args[0], args[1].split(';')))
+        elif cmd == 'F' and not args[1].lower().endswith('.bin') and os.path.isfile(args[1]):
+            with open(args[1], 'r') as f:
+                programs.append((args[0], f.read().splitlines()))
+    return programs
+
+def run_script_command(cmd, args):
+    # returns extra fields for the report
+    if cmd == 'A':
+        binary = batch_asm(args[0], args[1].split(';'))
+        upload(args[0], binary)
+    elif cmd == 'F':
+        run_F(args[0], args[1])
+    elif cmd == 'D':
+        run_D(args[0], args[1])
+    elif cmd == 'U':
+        run_U(args[0], args[1])
+    elif cmd == 'R':
+        run_R()
+    elif cmd == 'G':
+        elapse = run_G(args[0])
+        if elapse is None and board.link.replies:
+            return {'status': 'trap'}
+        if elapse is None:
+            return {}
+        return {'run_seconds': elapse}
+    elif cmd == 'T':
+        run_T(args[0])
+    return {}
+
+def run_script(commands, report, repeat=1):
+    failed = 0
+    for iteration in range(repeat):
+        for number, line, cmd, args in commands:
+            record = collections.OrderedDict([
+                ('iteration', iteration), ('line', number), ('command', line), ('status', 'ok')])
+            if cmd == 'G' and len(args) > 1:
+                record['name'] = args[1]
+            received, sent = inp.received, outp.sent
+            EmptyBuf()
+            time_start = timer()
+            stop = False
+            try:
+                record.update(run_script_command(cmd, args))
+            except (ValueError, TimeoutError) as e:
+                record['status'] = 'error'
+                record['message'] = str(e)
+            except ConnectionError as e:
+                # nothing later can succeed
+                record['status'] = 'error'
+                record['message'] = str(e)
+                stop = True
+            elapse = timer() - time_start
+            record['seconds'] = elapse
+            record['bytes_sent'] = outp.sent - sent
+            record['bytes_received'] = inp.received - received
+            total = record['bytes_sent'] + record['bytes_received']
+            record['throughput'] = total / elapse if elapse > 0 else 0
+            if report is not None:
+                report.write(json.dumps(record) + '\n')
+                report.flush()
+            if record['status'] != 'ok':
+                failed += 1
+            if stop:
+                return failed
+    return failed
+
+# inp, outp and board all go through link
+def SetLink(link):
+    global outp, inp, board
+    inp = link
+    outp = link
+    board = Supervisor(link, upload_chunk)
 
 def InitializeSerial(pipe_path, baudrate):
-    global outp, inp
-    tty = serial.Serial(port=pipe_path, baudrate=baudrate)
-    tty.reset_input_buffer()
-    inp = tty
-    outp = tty
+    try:
+        conn = Connection(response_timeout).open_serial(pipe_path, int(baudrate))
+    except ImportError:
+        print("Please install pyserial")
+        return False
+    SetLink(conn)
+    return True
+
+def InitializePipe(paths):
+    # "rx,tx" or a single path used both ways, e.g. a pty
+    rx_path, _, tx_path = paths.partition(',')
+    conn = Connection(response_timeout).open_pipe(rx_path, tx_path or rx_path)
+    SetLink(conn)
+    return True
+
+def InitializeRecorder(paths):
+    # "stimulus,responses"; without a board (inp is None) only the stimulus
+    # is written, e.g. cpu_sv_test.mem for the CPU testbench
+    stimulus_path, _, responses_path = paths.partition(',')
+    SetLink(Recorder(stimulus_path, responses_path or None, inp))
+    return True
+
+def InitializeReplay(paths):
+    # "responses,stimulus" saved by a Recorder
+    responses_path, _, stimulus_path = paths.partition(',')
+    SetLink(Replay(responses_path, stimulus_path or None))
     return True
 
 def Main(welcome_message=True):
     #debug
     # welcome_message = False
     if welcome_message:
-        output_binary(inp.read(33))
-        print('')
+        try:
+            welcome = board.welcome()
+            if welcome is not None:
+                output_binary(welcome)
+                print('')
+        except TimeoutError:
+            print('no welcome message from the board, is it reset?')
     MainLoop()
 
-class tcp_wrapper:
-
-    def __init__(self, sock=None):
-        if sock is None:
-            self.sock = socket.socket(
-                socket.AF_INET, socket.SOCK_STREAM)
-        else:
-            self.sock = sock
-
-    def connect(self, host, port):
-        self.sock.connect((host, port))
-
-    def write(self, msg):
-        totalsent = 0
-        MSGLEN = len(msg)
-        while totalsent < MSGLEN:
-            sent = self.sock.send(msg[totalsent:])
-            if sent == 0:
-                raise RuntimeError("socket connection broken")
-            totalsent = totalsent + sent
-
-    def flush(self): # dummy
-        pass
-
-    def read(self, MSGLEN):
-        chunks = []
-        bytes_recd = 0
-        while bytes_recd < MSGLEN:
-            chunk = self.sock.recv(min(MSGLEN - bytes_recd, 2048))
-            # print 'read:...', list(map(lambda c: hex(ord(c)), chunk))
-            if chunk == b'':
-                raise RuntimeError("socket connection broken")
-            chunks.append(chunk)
-            bytes_recd = bytes_recd + len(chunk)
-        return b''.join(chunks)
-
-    def reset_input_buffer(self):
-        local_input = [self.sock]
-        while True:
-            inputReady, o, e = select.select(local_input, [], [], 0.0)
-            if len(inputReady) == 0:
-                break
-            for s in inputReady:
-                s.recv(1)
+def MainScript(commands, report, repeat, welcome_message=True):
+    # one assembler run for the whole script
+    preassemble(script_programs(commands))
+    if welcome_message:
+        welcome = board.welcome()
+        if welcome is not None:
+            output_binary(welcome)
+            print('')
+    return run_script(commands, report, repeat)
 
 def EmptyBuf():
     inp.reset_input_buffer()
@@ -387,16 +770,17 @@ def InitializeTCP(host_port):
 
     match = ValidIpAddressRegex.search(host_port) or ValidHostnameRegex.search(host_port)
     groups = match.groups()
-    ser = tcp_wrapper()
     host, port = groups[0], groups[4]
     sys.stdout.write("connecting to %s:%s..." % (host, port))
     sys.stdout.flush()
-    ser.connect(host, int(port))
+    try:
+        ser = Connection(response_timeout).open_tcp(host, int(port))
+    except (OSError, TimeoutError) as e:
+        print(e)
+        return False
     print("connected")
 
-    global outp, inp
-    outp = ser
-    inp = ser
+    SetLink(ser)
     return True
 
 if __name__ == "__main__":
@@ -407,7 +791,42 @@ if __name__ == "__main__":
     parser.add_argument('-t', '--tcp', default=None, help='TCP server address:port for communication')
     parser.add_argument('-s', '--serial', default=None, help='Serial port name (e.g. /dev/ttyACM0, COM3)')
     parser.add_argument('-b', '--baud', default=9600, help='Serial port baudrate (9600 by default)')
+    parser.add_argument('-p', '--pipe', default=None, help='Files, FIFOs or a pty to talk through, as RX,TX or one path for both')
+    parser.add_argument('--record', default=None,
+        help='Save what is sent as STIMULUS[,RESPONSES], also what the board answers if connected to one')
+    parser.add_argument('--replay', default=None,
+        help='Answer with RESPONSES[,STIMULUS] saved by --record instead of a board, checking the stimulus if given')
+    parser.add_argument('--timeout', default=response_timeout, type=float,
+        help='Seconds to wait for a reply from the board (%g by default, 0 to wait forever)' % response_timeout)
+    parser.add_argument('--run-timeout', default=0, type=float,
+        help='Seconds to wait for a program started by G (forever by default)')
+    parser.add_argument('-x', '--script', default=None, help='Run the commands in this file instead of prompting for them')
+    parser.add_argument('--json', default='-', help='Where batch mode writes its JSON timings, one line per command (stdout by default)')
+    parser.add_argument('--repeat', default=1, type=int, help='How many times batch mode runs the script (1 by default)')
+    parser.add_argument('--log', default=None, help='Save the commands typed to this file as a batch mode script')
+    parser.add_argument('--asm-cache', default=None, help='Directory to keep assembled snippets across runs')
+    parser.add_argument('--chunk', default=upload_chunk, type=int,
+        help='Max bytes written by one A command (%d by default, 4 for one word per command)' % upload_chunk)
     args = parser.parse_args()
+    asm_cache.directory = args.asm_cache
+    upload_chunk = args.chunk
+    response_timeout = args.timeout or None
+    run_timeout = args.run_timeout or None
+    if args.log:
+        session_log = open(args.log, 'a')
+
+    if args.script:
+        try:
+            script = parse_script(args.script)
+        except (OSError, ValueError) as e:
+            print(e)
+            exit(1)
+        if args.json == '-':
+            # keep stdout for the report, everything else goes to stderr
+            report = sys.stdout
+            sys.stdout = sys.stderr
+        else:
+            report = open(args.json, 'w')
 
     if args.tcp:
         if not InitializeTCP(args.tcp):
@@ -417,10 +836,23 @@ if __name__ == "__main__":
         if not InitializeSerial(args.serial, args.baud):
             print('Failed to open serial port')
             exit(1)
-    else:
+    elif args.pipe:
+        InitializePipe(args.pipe)
+    elif args.replay:
+        InitializeReplay(args.replay)
+    elif not args.record:
         parser.print_help()
         exit(1)
+    if args.record:
+        InitializeRecorder(args.record)
     if not test_programs():
         exit(1)
-    Main(not args.continued)
+    failed = 0
+    if args.script:
+        failed = MainScript(script, report, args.repeat, not args.continued)
+    else:
+        Main(not args.continued)
+    outp.close()
+    if failed != 0:
+        exit(1)
 
@@ -0,0 +1,454 @@
+# -*- encoding=utf-8 -*-
+
+# Transport layer between term.py and the board
+#
+# An asyncio event loop runs in a background thread and keeps receiving into
+# one buffer, whatever the backend is:
+#   TCP     asyncio streams (QEMU, the remote lab, the local emulator)
+#   serial  pyserial, polled by a helper thread since it has no asyncio support
+#   pipe    a file, FIFO or pty opened with os.open, also read by a helper thread
+# Connection wraps it with the blocking read/write/flush/reset_input_buffer
+# interface of serial.Serial that term.py was written against, plus timeouts,
+# so a hung board raises TimeoutError instead of blocking forever; a read times
+# out when nothing arrives for that long, so a slow link can send any amount
+#
+# Recorder and Replay have the same interface without a board:
+#   Recorder  saves everything sent (the stimulus, e.g. cpu_sv_test.mem) and,
+#             in front of a Connection, everything read from it
+#   Replay    answers with the responses saved by a Recorder and can check
+#             that the same stimulus is sent again
+
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+import time
+
+# sentinel for "use the connection's default timeout"
+DEFAULT = object()
+
+# seconds without a byte after which the link counts as quiet again
+QUIET = 0.5
+
+
+class Transport:
+    # the receive buffer shared by all backends
+    # everything except feed / feed_eof runs in the event loop
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.buffer = bytearray()
+        self.waiters = []
+        self.closed = False
+        self.error = None
+        self.last_feed = 0.0    # time.monotonic() when data last arrived
+
+    def feed(self, data):
+        self.buffer += data
+        self.last_feed = time.monotonic()
+        self._wake()
+
+    def feed_eof(self, error=None):
+        self.closed = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.waiters = []
+
+    async def _wait(self):
+        if self.closed:
+            raise ConnectionError(self.error or 'connection closed by the other side')
+        waiter = self.loop.create_future()
+        self.waiters.append(waiter)
+        await waiter
+
+    async def read(self, n):
+        # exactly n bytes
+        while len(self.buffer) < n:
+            await self._wait()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    async def read_some(self, n):
+        # at least one and at most n bytes
+        while len(self.buffer) == 0:
+            await self._wait()
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+    def drain(self):
+        # drop everything received so far, returns how many bytes were dropped
+        count = len(self.buffer)
+        self.buffer.clear()
+        return count
+
+    async def write(self, data):
+        raise NotImplementedError()
+
+    async def close(self):
+        self.feed_eof()
+
+
+class StreamTransport(Transport):
+    # TCP backend over asyncio streams
+
+    @classmethod
+    async def connect(cls, loop, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        transport = cls(loop, writer)
+        loop.create_task(transport._receive(reader))
+        return transport
+
+    def __init__(self, loop, writer):
+        super().__init__(loop)
+        self.writer = writer
+
+    async def _receive(self, reader):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                self.feed(data)
+            self.feed_eof()
+        except OSError as e:
+            self.feed_eof(str(e))
+
+    async def write(self, data):
+        if self.closed:
+            raise ConnectionError(self.error or 'connection closed by the other side')
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def close(self):
+        self.writer.close()
+        await super().close()
+
+
+class ThreadTransport(Transport):
+    # backend for blocking devices: a helper thread calls read() and feeds the
+    # loop, writes run in the default executor
+    # read() returning b'' means end of file, or just nothing yet if poll is set
+
+    def __init__(self, loop, read, write, close, poll=False):
+        super().__init__(loop)
+        self._read = read
+        self._write = write
+        self._close = close
+        self.poll = poll
+        self.stopped = False
+        self.thread = threading.Thread(target=self._receive, daemon=True)
+        self.thread.start()
+
+    def _receive(self):
+        try:
+            while not self.stopped:
+                data = self._read()
+                if data:
+                    self.loop.call_soon_threadsafe(self.feed, data)
+                elif not self.poll:
+                    break
+            error = None
+        except (OSError, ValueError) as e:
+            error = str(e)
+        if not self.stopped:
+            self.loop.call_soon_threadsafe(self.feed_eof, error)
+
+    async def write(self, data):
+        if self.closed:
+            raise ConnectionError(self.error or 'connection closed by the other side')
+        await self.loop.run_in_executor(None, self._write, data)
+
+    async def close(self):
+        self.stopped = True
+        self._close()
+        await super().close()
+
+
+def serial_transport(loop, port, baudrate):
+    import serial
+    # short timeout so that the helper thread notices close()
+    tty = serial.Serial(port=port, baudrate=baudrate, timeout=0.1)
+    tty.reset_input_buffer()
+
+    def read():
+        return tty.read(max(1, tty.in_waiting))
+
+    def write(data):
+        tty.write(data)
+        tty.flush()
+
+    return ThreadTransport(loop, read, write, tty.close, poll=True)
+
+
+def pipe_transport(loop, rx_path, tx_path):
+    # the same path for both directions works for a pty or a socket-like device
+    if rx_path == tx_path:
+        rx = tx = os.open(rx_path, os.O_RDWR)
+    else:
+        rx = os.open(rx_path, os.O_RDONLY)
+        tx = os.open(tx_path, os.O_WRONLY | os.O_CREAT, 0o644)
+
+    def read():
+        return os.read(rx, 65536)
+
+    def write(data):
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[os.write(tx, view):]
+
+    def close():
+        os.close(rx)
+        if tx != rx:
+            os.close(tx)
+
+    return ThreadTransport(loop, read, write, close)
+
+
+class Connection:
+    # blocking interface to a transport, used as inp / outp by term.py
+    # timeout is in seconds, None waits forever; Ctrl-C always interrupts a wait
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.transport = None
+        self.replies = True
+        self.received = 0   # bytes read by term.py so far
+        self.sent = 0       # bytes written so far
+        # set when the board kept sending after a read timed out, what it
+        # sends can no longer be told apart from the replies to later commands
+        self.desynchronized = False
+        # otherwise pending receive tasks are reported when the interpreter exits
+        atexit.register(self.close)
+
+    def _run(self, coro, timeout=None, idle=False):
+        # with idle set the deadline restarts whenever data arrives
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        start = time.monotonic()
+
+        def left():
+            since = max(start, self.transport.last_feed) if idle else start
+            return since + timeout - time.monotonic()
+
+        try:
+            while True:
+                wait = 0.1 if timeout is None else min(0.1, max(0, left()))
+                try:
+                    return future.result(wait)
+                except concurrent.futures.TimeoutError:
+                    # before Python 3.11 this is not the builtin TimeoutError
+                    if future.done():
+                        raise
+                if timeout is not None and left() <= 0:
+                    raise TimeoutError('no response from the board in %gs' % timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _check_sync(self):
+        if self.desynchronized:
+            raise ConnectionError('the board kept sending after a timeout, the link is out of sync')
+
+    def _read(self, coro, timeout):
+        if self.desynchronized:
+            coro.close()
+        self._check_sync()
+        timeout = self.timeout if timeout is DEFAULT else timeout
+        try:
+            data = self._run(coro, timeout, idle=True)
+        except TimeoutError:
+            self._settle(timeout)
+            raise
+        self.received += len(data)
+        return data
+
+    def _settle(self, timeout):
+        # drop whatever arrives for another timeout, late replies to the
+        # command that timed out would otherwise be taken as the replies to the
+        # next one; if the link is not quiet by then, give up on it
+        end = time.monotonic() + max(timeout, QUIET)
+        while time.monotonic() < end:
+            self.reset_input_buffer()
+            time.sleep(min(QUIET, max(0, end - time.monotonic())))
+        if time.monotonic() - self.transport.last_feed < QUIET:
+            self.desynchronized = True
+        self.reset_input_buffer()
+
+    def _open(self, transport):
+        self.transport = transport
+        return self
+
+    def open_tcp(self, host, port):
+        return self._open(self._run(StreamTransport.connect(self.loop, host, port), self.timeout))
+
+    def open_serial(self, port, baudrate):
+        return self._open(serial_transport(self.loop, port, baudrate))
+
+    def open_pipe(self, rx_path, tx_path):
+        return self._open(pipe_transport(self.loop, rx_path, tx_path))
+
+    def read(self, n, timeout=DEFAULT):
+        return self._read(self.transport.read(n), timeout)
+
+    def read_some(self, n=65536, timeout=DEFAULT):
+        return self._read(self.transport.read_some(n), timeout)
+
+    def unread(self, data):
+        self.loop.call_soon_threadsafe(self.transport.unread, data)
+        self.received -= len(data)
+
+    def write(self, data):
+        self._check_sync()
+        self._run(self.transport.write(bytes(data)), self.timeout)
+        self.sent += len(data)
+
+    def flush(self):
+        # write() returns only after the data is handed to the device
+        pass
+
+    def reset_input_buffer(self):
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self.loop)
+        return future.result()
+
+    async def _drain(self):
+        return self.transport.drain()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        if self.transport is not None:
+            try:
+                self._run(self._close(), self.timeout)
+            except (OSError, TimeoutError):
+                pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _close(self):
+        await self.transport.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Recorder:
+    # link is None for a stimulus file only, reads then return None
+
+    def __init__(self, stimulus_path, responses_path=None, link=None):
+        self.stimulus = open(stimulus_path, 'wb')
+        self.responses_path = responses_path
+        self.responses = bytearray()
+        self.link = link
+        self.replies = link is not None
+        self.received = 0
+        self.sent = 0
+
+    def _record(self, data):
+        self.responses += data
+        self.received += len(data)
+        return data
+
+    def read(self, n, timeout=DEFAULT):
+        if self.link is None:
+            return None
+        return self._record(self.link.read(n, timeout))
+
+    def read_some(self, n=65536, timeout=DEFAULT):
+        if self.link is None:
+            return None
+        return self._record(self.link.read_some(n, timeout))
+
+    def unread(self, data):
+        # what is pushed back is recorded again when it is read
+        if len(data) > 0:
+            del self.responses[-len(data):]
+            self.received -= len(data)
+            self.link.unread(data)
+
+    def write(self, data):
+        self.stimulus.write(data)
+        self.sent += len(data)
+        if self.link is not None:
+            self.link.write(data)
+
+    def flush(self):
+        self.stimulus.flush()
+
+    def reset_input_buffer(self):
+        if self.link is not None:
+            return self.link.reset_input_buffer()
+        return 0
+
+    def close(self):
+        self.stimulus.close()
+        if self.responses_path is not None:
+            with open(self.responses_path, 'wb') as f:
+                f.write(self.responses)
+        if self.link is not None:
+            self.link.close()
+
+
+class Replay:
+    # reads come from a responses file saved by Recorder; if the stimulus
+    # file is given, every write must match it byte for byte
+
+    def __init__(self, responses_path, stimulus_path=None):
+        with open(responses_path, 'rb') as f:
+            self.responses = f.read()
+        self.stimulus = None
+        if stimulus_path is not None:
+            with open(stimulus_path, 'rb') as f:
+                self.stimulus = f.read()
+        self.replies = True
+        self.received = 0
+        self.sent = 0
+
+    def _take(self, n):
+        if self.received >= len(self.responses):
+            raise ConnectionError('end of the recorded responses')
+        data = self.responses[self.received:self.received+n]
+        self.received += len(data)
+        return data
+
+    def read(self, n, timeout=DEFAULT):
+        if self.received + n > len(self.responses):
+            raise ConnectionError('end of the recorded responses')
+        return self._take(n)
+
+    def read_some(self, n=65536, timeout=DEFAULT):
+        return self._take(n)
+
+    def unread(self, data):
+        self.received -= len(data)
+
+    def write(self, data):
+        if self.stimulus is not None:
+            expected = self.stimulus[self.sent:self.sent+len(data)]
+            if expected != bytes(data):
+                mismatch = next((i for i in range(len(expected)) if expected[i] != data[i]), len(expected))
+                raise ValueError('stimulus differs from the recording at byte %d' % (self.sent + mismatch))
+        self.sent += len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        return 0
+
+    def close(self):
+        pass
@@ -0,0 +1,9 @@
+// 由 scripts_router/routing_compile.py 生成，和 routing_memory.mem 一一对应
+`ifndef _ROUTING_MEMORY_VH_
+`define _ROUTING_MEMORY_VH_
+
+// 镜像中已经占用的节点，复位后从这里继续分配
+`define ROUTING_BRANCH_WRITE_ADDR 16'h0007
+`define ROUTING_NEXTHOP_WRITE_ADDR 16'h8004
+
+`endif
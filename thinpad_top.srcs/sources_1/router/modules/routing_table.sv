@@ -2,6 +2,7 @@
 
 `include "debug.vh"
 `include "types.vh"
+`include "routing_memory.vh"
 
 `define POISON_REVERSE
 
@@ -324,8 +325,9 @@ always_ff @ (posedge clk_125M) begin
     enum_last <= 0;
 
     if (!rst_n) begin
-        branch_write_addr <= 16'h0007;
-        nexthop_write_addr <= 16'h8004;
+        // 从 routing_memory.mem 中已有的节点之后开始分配
+        branch_write_addr <= `ROUTING_BRANCH_WRITE_ADDR;
+        nexthop_write_addr <= `ROUTING_NEXTHOP_WRITE_ADDR;
         work_mode <= ModeIdle;
         ip_target <= '0;
         enum_completed <= 16'h8000;